@@ -0,0 +1,179 @@
+# ASGI entry point: the same API as server.py on one long-lived event loop.
+# Lesson jobs are tasks on that loop (no asyncio.run per request), database and
+# storage calls go through asqlcommands' pooled AsyncSupabaseStore, and the
+# OpenAI/Gemini clients are reused across requests because they all share the loop.
+#
+#   cd backend && hypercorn asgi:app --bind 0.0.0.0:5000
+#
+# Run a single worker process: jobs live in this process's memory.
+
+import os
+import hashlib
+from quart import Quart, Response, request, jsonify
+from quart_cors import cors  # to allow frontend requests
+from hypercorn.middleware import ProxyFixMiddleware
+from asqlcommands import close_async_store, get_async_store
+from auth import TRUSTED_PROXY_HOPS, authenticate_async
+from jobs import AsyncJobManager, QueueFullError, DONE
+from jobqueue import QueuedJobManager
+from cache import lesson_cache
+from multi_tool_agent.content_cache import get_image_cache, get_lesson_cache
+from multi_tool_agent.tracing import render_metrics, trace, traced
+from lessons import (
+    EVENTS_KEEPALIVE_SECONDS, create_lesson_args, lesson_steps, lessons_page_args, sse_event,
+    wants_thumbnails, with_steps, with_thumbnails,
+)
+
+app = cors(Quart(__name__), allow_origin="*")  # enable CORS for all routes
+if TRUSTED_PROXY_HOPS:
+    # Behind nginx or another proxy: take the client address from X-Forwarded-For (auth.py)
+    app.asgi_app = ProxyFixMiddleware(app.asgi_app, mode="legacy", trusted_hops=TRUSTED_PROXY_HOPS)
+
+@app.route('/login', methods=['POST'])
+async def login():
+    data = await request.get_json(silent=True) or {}
+    username = data.get('username')
+    password = data.get('password')
+    if not username or not password:
+        return jsonify({"success": False, "message": "Invalid credentials"}), 401
+
+    store = await get_async_store()
+    AppUser, retry_after = await authenticate_async(store.verify_user, username, password, request.remote_addr)
+    if retry_after:
+        return jsonify({"success": False, "message": "Too many login attempts"}), 429, {"Retry-After": str(retry_after)}
+
+    if AppUser:
+        return jsonify({"success": True, "role": AppUser["role"]})
+    else:
+        return jsonify({"success": False, "message": "Invalid credentials"}), 401
+
+async def build_lesson(job, title, topic, level, description, force_regenerate=False):
+    """Runs as a task on the server loop: generate, upload and persist one lesson."""
+    # Imported on first job so the web tier boots without loading ADK and the model SDKs
+    from multi_tool_agent.agent import main
+
+    store = await get_async_store()
+
+    with trace(job.id):
+        steps_array, file_urls, thumbnail_urls = await main(
+            topic, description, level,
+            upload=store.upload_images, progress=job.update, job_id=job.id, force_regenerate=force_regenerate,
+            on_event=job.emit,
+        )
+
+        # Lesson and steps land together, so a failure can't leave an orphaned lesson
+        job.update(stage="saving")
+        steps = lesson_steps(steps_array, file_urls, thumbnail_urls)
+        lesson, error = await store.add_lesson_with_steps(title, description, level, steps, job_id=job.id)
+        if error:
+            raise RuntimeError(error)
+
+    job.update(stage="done")
+    return with_steps(lesson, steps)
+
+# See server.LESSON_JOB_BACKEND; with "queue", `python worker.py` runs the lessons
+LESSON_JOB_BACKEND = os.getenv("LESSON_JOB_BACKEND", "threads")
+lesson_jobs = QueuedJobManager() if LESSON_JOB_BACKEND == "queue" else AsyncJobManager(build_lesson)
+
+@app.after_serving
+async def cancel_lesson_jobs():
+    if isinstance(lesson_jobs, AsyncJobManager):
+        await lesson_jobs.shutdown()
+    await close_async_store()
+
+@app.route('/createLesson', methods=['POST'])
+@traced("server.enqueue_lesson")
+async def create_lesson():
+    data = await request.get_json()
+
+    try:
+        job = lesson_jobs.submit(*create_lesson_args(data))
+    except QueueFullError as e:
+        return jsonify({"success": False, "message": str(e)}), 503
+
+    return jsonify({"success": True, "message": "Lesson creation started", "job_id": job.id}), 202
+
+@app.route('/lessonJobs/<job_id>', methods=['GET'])
+async def get_lesson_job(job_id):
+    job = lesson_jobs.get(job_id)
+    if job is None:
+        return jsonify({"success": False, "message": "Unknown job"}), 404
+
+    body = {"success": True, "job": job.to_dict()}
+    if job.status == DONE:
+        body["lesson"] = job.result
+    return jsonify(body)
+
+@app.route('/lessonJobs/<job_id>/lesson', methods=['GET'])
+async def get_lesson_job_result(job_id):
+    job = lesson_jobs.get(job_id)
+    if job is None:
+        return jsonify({"success": False, "message": "Unknown job"}), 404
+    if job.status != DONE:
+        return jsonify({"success": False, "message": job.error or "Lesson not ready", "job": job.to_dict()}), 409 if job.error else 202
+
+    return jsonify({"success": True, "message": "Lesson created successfully", "lesson": job.result})
+
+@app.route('/getLessons', methods=['GET'])
+async def getLessons():
+    try:
+        lessons, next_cursor = await (await get_async_store()).get_lessons_page(*lessons_page_args(request.args))
+        thumbnails = wants_thumbnails(request.args)
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+
+    if thumbnails:
+        lessons = with_thumbnails(lessons)
+
+    # Pages come from lesson_cache; the ETag lets an unchanged dashboard get a bodyless 304
+    response = jsonify({"lessons": lessons, "next_cursor": next_cursor})
+    etag = hashlib.sha1(await response.get_data()).hexdigest()
+    if request.if_none_match.contains(etag):
+        return Response(status=304, headers={"ETag": f'"{etag}"'})
+    response.set_etag(etag)
+    return response
+
+@app.route('/lessonJobs/<job_id>/events', methods=['GET'])
+async def stream_lesson_job(job_id):
+    """Server-Sent Events for one job, see server.stream_lesson_job."""
+    job = lesson_jobs.get(job_id)
+    if job is None:
+        return jsonify({"success": False, "message": "Unknown job"}), 404
+
+    start = request.headers.get('Last-Event-ID', -1, type=int) + 1
+
+    async def stream():
+        index = start
+        while True:
+            events, finished = await job.wait_events_async(index, EVENTS_KEEPALIVE_SECONDS)
+            for event in events:
+                yield sse_event(index, event).encode()
+                index += 1
+            if finished:
+                return
+            if not events:
+                yield b": keep-alive\n\n"
+
+    response = Response(
+        stream(),
+        mimetype='text/event-stream',
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+    response.timeout = None  # the stream lives as long as the job
+    return response
+
+@app.route('/cacheStats', methods=['GET'])
+async def cache_stats():
+    return jsonify({
+        "lesson_listings": {"hits": lesson_cache.hits, "misses": lesson_cache.misses},
+        "lessons": get_lesson_cache().stats(),
+        "images": get_image_cache().stats(),
+    })
+
+@app.route('/metrics', methods=['GET'])
+async def metrics():
+    """See server.metrics."""
+    return Response(render_metrics(), mimetype="text/plain; version=0.0.4")
+
+if __name__ == '__main__':
+    app.run(debug=True)
@@ -0,0 +1,262 @@
+# Async counterpart of sqlcommands.SupabaseStore for the ASGI app (asgi.py).
+# It runs on the server's event loop over supabase's AsyncClient and one pooled
+# keep-alive httpx.AsyncClient, so concurrent requests share connections instead
+# of each blocking a thread. Query builders, cursors, cache keys, retry policies
+# and upload naming are shared with sqlcommands.
+
+import asyncio
+import httpx
+from typing import Optional, Tuple, Dict, Any, List
+from supabase import acreate_client, AsyncClient, AsyncClientOptions
+from postgrest.exceptions import APIError
+
+from cache import lesson_cache
+from auth import hash_password, off_thread_async, verify_credentials
+from multi_tool_agent.tracing import span, traced
+from sqlcommands import (
+    AppUser, UploadResult, RetryPolicy, BUCKET_NAME, SUPABASE_URL, SUPABASE_SERVICE_ROLE,
+    SUPABASE_MAX_RETRIES, UPLOAD_CONCURRENCY, UPLOAD_MAX_RETRIES,
+    public_url, transport_options, _is_transient, _is_retryable_query, _count_retry, _object_name,
+    _credentials_query, _password_update, _lessons_query, _lessons_page_query, _lessons_page, _steps_query,
+    _only, _user_insert, _account_error, _lesson_insert, _create_lesson_rpc, _steps_insert,
+    APP_USER_COLUMNS, LESSON_COLUMNS, USER_COLUMNS,
+)
+
+
+class AsyncSupabaseStore:
+    """
+    SupabaseStore's methods as coroutines. Build with `await AsyncSupabaseStore.open()`
+    (acreate_client is async) and use it from one event loop, or construct it
+    directly over an existing AsyncClient.
+    """
+
+    def __init__(
+        self,
+        client: AsyncClient,
+        url: Optional[str] = SUPABASE_URL,
+        *,
+        http: Optional[httpx.AsyncClient] = None,
+        retry: Optional[RetryPolicy] = None,
+        upload_retry: Optional[RetryPolicy] = None,
+        upload_concurrency: int = UPLOAD_CONCURRENCY,
+    ):
+        self.client = client
+        self.url = url
+        self.retry = retry or RetryPolicy(SUPABASE_MAX_RETRIES)
+        self.upload_retry = upload_retry or RetryPolicy(UPLOAD_MAX_RETRIES)
+        self.upload_concurrency = upload_concurrency
+        self._http = http
+
+    @classmethod
+    async def open(
+        cls,
+        url: Optional[str] = SUPABASE_URL,
+        key: Optional[str] = SUPABASE_SERVICE_ROLE,
+        *,
+        retry: Optional[RetryPolicy] = None,
+        upload_retry: Optional[RetryPolicy] = None,
+        upload_concurrency: int = UPLOAD_CONCURRENCY,
+        **transport: Any,
+    ) -> "AsyncSupabaseStore":
+        if not url or not key:
+            raise RuntimeError("Missing SUPABASE_URL or SUPABASE_SERVICE_ROLE in .env")
+        http = httpx.AsyncClient(**transport_options(**transport))
+        client = await acreate_client(url, key, AsyncClientOptions(httpx_client=http))
+        return cls(client, url, http=http, retry=retry, upload_retry=upload_retry, upload_concurrency=upload_concurrency)
+
+    async def close(self) -> None:
+        if self._http is not None:
+            await self._http.aclose()
+
+    async def _execute(self, query: Any, operation: str, idempotent: bool = True) -> Any:
+        """See SupabaseStore._execute."""
+        for attempt in range(self.retry.retries + 1):
+            try:
+                return await query.execute()
+            except Exception as e:
+                if attempt == self.retry.retries or not _is_retryable_query(e, idempotent):
+                    raise
+                _count_retry(operation)
+                await asyncio.sleep(self.retry.delay(attempt))
+
+    # ---------- Users ----------
+    @traced("supabase.verify_user")
+    async def verify_user(self, email: str, password: str) -> Optional[AppUser]:
+        """See SupabaseStore.verify_user. The hash runs on auth's pool, off the event loop."""
+        rows = (await self._execute(_credentials_query(self.client, email), "verify_user")).data or []
+        row = rows[0] if rows else None
+        ok, new_hash = await off_thread_async(verify_credentials, password, row)
+        if not ok:
+            return None
+        if new_hash:
+            await self._execute(_password_update(self.client, row["id"], new_hash), "verify_user")
+        return _only(row, APP_USER_COLUMNS)  # type: ignore
+
+    @traced("supabase.create_account")
+    async def create_account(self, email: str, password: str, name: str, role: int) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+        """See SupabaseStore.create_account."""
+        password_hash = await off_thread_async(hash_password, password)
+        try:
+            res = await self._execute(_user_insert(self.client, email, password_hash, name, role), "create_account", idempotent=False)
+        except APIError as e:
+            return None, _account_error(e)
+        if not res.data:
+            return None, "Failed to create user"
+        return _only(res.data[0], USER_COLUMNS), None
+
+    # ---------- Lessons ----------
+    @traced("supabase.get_lessons")
+    @lesson_cache.cached_async
+    async def get_lessons(self, user_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        return (await self._execute(_lessons_query(self.client), "get_lessons")).data or []
+
+    @traced("supabase.get_lessons_page")
+    @lesson_cache.cached_async
+    async def get_lessons_page(
+        self,
+        limit: int = 50,
+        cursor: Optional[str] = None,
+        include_steps: bool = True,
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """See SupabaseStore.get_lessons_page."""
+        query = _lessons_page_query(self.client, limit, cursor, include_steps)
+        return _lessons_page((await self._execute(query, "get_lessons_page")).data or [], limit, include_steps)
+
+    @traced("supabase.get_steps")
+    @lesson_cache.cached_async
+    async def get_steps(self, lesson_id: int) -> List[Dict[str, Any]]:
+        return (await self._execute(_steps_query(self.client, lesson_id), "get_steps")).data or []
+
+    @traced("supabase.add_lesson")
+    async def add_lesson(
+        self,
+        lesson_name: str,
+        lesson_description: str,
+        lesson_level: str,
+    ) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+        insert_lesson = await self._execute(
+            _lesson_insert(self.client, lesson_name, lesson_description, lesson_level), "add_lesson", idempotent=False,
+        )
+        if not insert_lesson.data:
+            return None, "Failed to create lesson"
+
+        lesson_cache.invalidate()
+        return _only(insert_lesson.data[0], LESSON_COLUMNS), None
+
+    @traced("supabase.add_lesson_with_steps")
+    async def add_lesson_with_steps(
+        self,
+        lesson_name: str,
+        lesson_description: str,
+        lesson_level: str,
+        steps: List[Dict[str, Any]],
+        job_id: Optional[str] = None,
+    ) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+        """See SupabaseStore.add_lesson_with_steps."""
+        try:
+            rpc = _create_lesson_rpc(self.client, lesson_name, lesson_description, lesson_level, steps, job_id)
+            res = await self._execute(rpc, "add_lesson_with_steps", idempotent=job_id is not None)
+            if not res.data:
+                return None, "Failed to create lesson"
+            lesson_cache.invalidate()
+            return res.data, None
+        except APIError as e:
+            if e.code != "PGRST202":  # PostgREST: function not found
+                return None, e.message or "Failed to create lesson"
+            print("⚠️ create_lesson_with_steps RPC missing, apply sql/create_lesson_with_steps.sql")
+
+        lesson, error = await self.add_lesson(lesson_name, lesson_description, lesson_level)
+        if error:
+            return None, error
+        try:
+            _, error = await self.add_steps(lesson["lesson_id"], steps)
+        except APIError as e:
+            error = e.message or "Failed to insert steps"
+        if error:
+            # Don't leave an orphaned lesson without its steps
+            delete = self.client.table("lessons").delete().eq("lesson_id", lesson["lesson_id"])
+            await self._execute(delete, "add_lesson_with_steps")
+            lesson_cache.invalidate()
+            return None, error
+        return lesson, None
+
+    # ---------- Steps ----------
+    @traced("supabase.add_steps")
+    async def add_steps(
+        self,
+        lesson_id: int,
+        steps: List[Dict[str, Any]],
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        if not steps:
+            return [], None
+
+        res = await self._execute(_steps_insert(self.client, lesson_id, steps), "add_steps", idempotent=False)
+        if not res.data:
+            return [], "Failed to insert steps"
+
+        lesson_cache.invalidate()
+        return sorted(res.data, key=lambda x: x["step_number"]), None
+
+    @traced("supabase.add_step")
+    async def add_step(
+        self,
+        lesson_id: int,
+        step_number: int,
+        step_description: str,
+        step_image: Optional[str] = None,
+        step_thumbnail: Optional[str] = None,
+    ) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+        rows, error = await self.add_steps(lesson_id, [{
+            "step_number": step_number, "step_description": step_description,
+            "image_path": step_image, "thumbnail_path": step_thumbnail,
+        }])
+        if error:
+            return None, "Failed to insert step"
+        return (rows[0] if rows else None), None
+
+    # ---------- Storage ----------
+    async def _upload_one(self, source: str, data: bytes, ext: str, semaphore: asyncio.Semaphore) -> UploadResult:
+        object_name, file_options = _object_name(ext)
+
+        with span("supabase.upload", bytes=len(data)) as stage:
+            for attempt in range(self.upload_retry.retries + 1):
+                try:
+                    async with semaphore:
+                        await self.client.storage.from_(BUCKET_NAME).upload(object_name, data, file_options)
+                    url = public_url(object_name, self.url)
+                    print(f"✅ Uploaded {source} → {url}")
+                    return {"source": source, "object_name": object_name, "url": url, "error": None}
+                except Exception as e:
+                    if attempt == self.upload_retry.retries or not _is_transient(e):
+                        print(f"❌ Failed to upload {source}: {e}")
+                        stage.add(failures=1)
+                        return {"source": source, "object_name": None, "url": None, "error": str(e)}
+                    stage.add(retries=1)
+                    await asyncio.sleep(self.upload_retry.delay(attempt))
+
+    async def upload_images(self, images: List[bytes], ext: str = "png") -> List[UploadResult]:
+        """See SupabaseStore.upload_images. At most upload_concurrency uploads are in flight per call."""
+        semaphore = asyncio.Semaphore(self.upload_concurrency)
+        return list(await asyncio.gather(
+            *(self._upload_one(f"image {i}", data, ext, semaphore) for i, data in enumerate(images, 1))
+        ))
+
+
+# ---------- Store ----------
+_store: Optional[AsyncSupabaseStore] = None
+_store_lock = asyncio.Lock()
+
+async def get_async_store() -> AsyncSupabaseStore:
+    """One store for the ASGI server's event loop, built on first use."""
+    global _store
+    async with _store_lock:  # requests racing on a cold start share one pool
+        if _store is None:
+            _store = await AsyncSupabaseStore.open()
+    return _store
+
+async def close_async_store() -> None:
+    """Close the loop's store and its connections, e.g. when the server stops."""
+    global _store
+    if _store is not None:
+        await _store.close()
+        _store = None
@@ -0,0 +1,232 @@
+# Login hot path: password hashing, a short-lived cache of successful logins,
+# and a token-bucket limiter that turns away brute-force bursts.
+# Passwords are stored as scrypt hashes (users.password_hash, sql/users_password_hash.sql).
+# Rows that still hold a plaintext password are upgraded on their next successful
+# login, as are hashes made with an older work factor.
+#
+# The cache and limiter live in this process's memory: with several server
+# processes each one limits and caches on its own.
+#
+# Only failed attempts use up the limit: every attempt takes a token while it is
+# checked and a successful one gives it back. Behind a reverse proxy every request
+# comes from the proxy's address, so set TRUSTED_PROXY_HOPS to the number of
+# proxies in front of the app and the client address is read from X-Forwarded-For
+# instead (server.py and asgi.py install the middleware). Leave it at 0 when the app
+# is reached directly, or clients could pick their own address.
+
+import os
+import hmac
+import math
+import json
+import time
+import base64
+import asyncio
+import hashlib
+import secrets
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+from dotenv import load_dotenv
+
+from cache import TTLCache
+
+load_dotenv()
+
+PASSWORD_HASH_N = int(os.getenv("PASSWORD_HASH_N", str(2 ** 14)))      # scrypt cost (power of two); raise to slow hashing down
+PASSWORD_HASH_R = int(os.getenv("PASSWORD_HASH_R", "8"))               # scrypt block size; memory is 128 * N * r bytes
+PASSWORD_HASH_P = int(os.getenv("PASSWORD_HASH_P", "1"))               # scrypt parallelism
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+LOGIN_CACHE_TTL = int(os.getenv("LOGIN_CACHE_TTL", "60"))              # seconds a successful login is remembered
+LOGIN_CACHE_SIZE = int(os.getenv("LOGIN_CACHE_SIZE", "1024"))          # entries
+LOGIN_RATE_BURST = int(os.getenv("LOGIN_RATE_BURST", "5"))             # failed attempts allowed back to back, per user
+LOGIN_RATE_PER_MINUTE = float(os.getenv("LOGIN_RATE_PER_MINUTE", "10"))  # sustained failed attempts, per user
+LOGIN_IP_RATE_BURST = int(os.getenv("LOGIN_IP_RATE_BURST", "50"))       # the same per client address, which a classroom
+LOGIN_IP_RATE_PER_MINUTE = float(os.getenv("LOGIN_IP_RATE_PER_MINUTE", "100"))  # behind one NAT shares
+LOGIN_RATE_KEYS = int(os.getenv("LOGIN_RATE_KEYS", "10000"))           # buckets kept before the least recent is dropped
+TRUSTED_PROXY_HOPS = int(os.getenv("TRUSTED_PROXY_HOPS", "0"))          # reverse proxies whose X-Forwarded-For is trusted
+
+# ---------- Password hashing ----------
+def hash_password(password: str, n: int = PASSWORD_HASH_N, r: int = PASSWORD_HASH_R, p: int = PASSWORD_HASH_P) -> str:
+    """Hash as scrypt$n$r$p$salt$digest, keeping the work factor so it can be raised later."""
+    salt = secrets.token_bytes(16)
+    digest = _scrypt(password, salt, n, r, p)
+    return "$".join(["scrypt", str(n), str(r), str(p), _b64(salt), _b64(digest)])
+
+def check_password(password: str, stored: Optional[str]) -> bool:
+    """Constant-time check against a hash_password() string. A missing hash still costs one hash."""
+    try:
+        scheme, n, r, p, salt, digest = (stored or "").split("$")
+        if scheme != "scrypt":
+            raise ValueError(scheme)
+        expected = base64.b64decode(digest, validate=True)
+        actual = _scrypt(password, base64.b64decode(salt, validate=True), int(n), int(r), int(p))
+    except (ValueError, OverflowError):  # binascii.Error is a ValueError; so are scrypt's bad parameters
+        # Unknown user or unusable hash: spend the same time, so response times don't reveal which
+        hmac.compare_digest(_DUMMY, _scrypt(password, _DUMMY_SALT, PASSWORD_HASH_N, PASSWORD_HASH_R, PASSWORD_HASH_P))
+        return False
+    return hmac.compare_digest(expected, actual)
+
+def needs_rehash(stored: Optional[str]) -> bool:
+    """True for plaintext rows and hashes made with a different work factor than the current one."""
+    return not (stored or "").startswith(f"scrypt${PASSWORD_HASH_N}${PASSWORD_HASH_R}${PASSWORD_HASH_P}$")
+
+def verify_credentials(password: str, row: Optional[Dict[str, Any]]) -> Tuple[bool, Optional[str]]:
+    """
+    Check `password` against a users row with password_hash (and legacy plaintext
+    password) columns. Returns (ok, new_hash); new_hash is set when the row should
+    be upgraded to a current hash. CPU-heavy: run it through off_thread().
+    """
+    stored = (row or {}).get("password_hash")
+    if row and not stored and row.get("password") is not None:
+        # Legacy plaintext row: on success it gets a hash and loses the plaintext
+        ok = hmac.compare_digest(password.encode(), str(row["password"]).encode())
+        return ok, hash_password(password) if ok else None
+    ok = check_password(password, stored)
+    return ok, hash_password(password) if ok and needs_rehash(stored) else None
+
+def _scrypt(password: str, salt: bytes, n: int, r: int, p: int) -> bytes:
+    return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p, maxmem=256 * n * r + 1024 * 1024, dklen=32)
+
+def _b64(raw: bytes) -> str:
+    return base64.b64encode(raw).decode()
+
+_DUMMY_SALT = secrets.token_bytes(16)
+_DUMMY = secrets.token_bytes(32)
+
+@lru_cache(maxsize=None)
+def get_hash_pool() -> ThreadPoolExecutor:
+    # hashlib.scrypt releases the GIL, so a thread pool runs hashes in parallel;
+    # its size also caps how many cores logins can take at once
+    return ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
+
+def off_thread(fn: Callable[..., Any], *args: Any) -> Any:
+    """Run a hashing call on the hash pool and wait for it."""
+    return get_hash_pool().submit(fn, *args).result()
+
+async def off_thread_async(fn: Callable[..., Any], *args: Any) -> Any:
+    """off_thread() without blocking the event loop."""
+    return await asyncio.wrap_future(get_hash_pool().submit(fn, *args))
+
+# ---------- Rate limiting ----------
+class RateLimiter:
+    """Token buckets by key: `burst` attempts at once, refilled at `per_minute`."""
+
+    def __init__(self, burst: int = LOGIN_RATE_BURST, per_minute: float = LOGIN_RATE_PER_MINUTE, max_keys: int = LOGIN_RATE_KEYS):
+        self.burst = burst
+        self.rate = per_minute / 60.0
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()  # key -> (tokens, updated_at)
+        self._lock = threading.Lock()
+
+    def acquire(self, *keys: str) -> Optional[float]:
+        """Take one token from every key's bucket. If any is empty, take none and return seconds to wait."""
+        now = time.monotonic()
+        with self._lock:
+            levels = {key: self._level(key, now) for key in keys}
+            short = [(1 - tokens) / self.rate for tokens in levels.values() if tokens < 1]
+            wait = max(short) if short else None
+            for key, tokens in levels.items():
+                self._buckets[key] = (tokens if wait else tokens - 1, now)
+                self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return wait
+
+    def refund(self, *keys: str) -> None:
+        """Give back the token acquire() took from each key, e.g. once an attempt turned out fine."""
+        now = time.monotonic()
+        with self._lock:
+            for key in keys:
+                if key in self._buckets:
+                    self._buckets[key] = (min(float(self.burst), self._level(key, now) + 1), now)
+
+    def _level(self, key: str, now: float) -> float:
+        tokens, updated_at = self._buckets.get(key, (float(self.burst), now))
+        return min(float(self.burst), tokens + (now - updated_at) * self.rate)
+
+# ---------- Verification cache ----------
+class LoginCache:
+    """
+    Recent successful logins, so a user logging in again within `ttl` skips the
+    database and the hash. Keyed by an HMAC of email and password under a key that
+    never leaves this process; a changed password stops matching immediately, the
+    old one keeps working until its entry expires.
+    """
+
+    def __init__(self, ttl: int = LOGIN_CACHE_TTL, maxsize: int = LOGIN_CACHE_SIZE):
+        self.ttl = ttl
+        self._entries = TTLCache(maxsize)
+        self._key = secrets.token_bytes(32)
+
+    def _digest(self, email: str, password: str) -> str:
+        return hmac.new(self._key, f"{email}\0{password}".encode(), hashlib.sha256).hexdigest()
+
+    def get(self, email: str, password: str) -> Optional[Dict[str, Any]]:
+        hit = self._entries.get(self._digest(email, password))
+        return json.loads(hit) if hit is not None else None
+
+    def put(self, email: str, password: str, user: Dict[str, Any]) -> None:
+        self._entries.set(self._digest(email, password), json.dumps(user), self.ttl)
+
+login_limiter = RateLimiter()
+client_limiter = RateLimiter(LOGIN_IP_RATE_BURST, LOGIN_IP_RATE_PER_MINUTE)
+login_cache = LoginCache()
+
+# ---------- Login ----------
+def _acquire(email: str, client: Optional[str]) -> Optional[int]:
+    """Take a token for the email and one for the client address, or neither; returns whole seconds to wait."""
+    user_key, client_key = f"user:{email.strip().lower()}", f"ip:{client or 'unknown'}"
+    wait = login_limiter.acquire(user_key)
+    if wait is None:
+        wait = client_limiter.acquire(client_key)
+        if wait is not None:
+            login_limiter.refund(user_key)
+    return math.ceil(wait) if wait is not None else None
+
+def _refund(email: str, client: Optional[str]) -> None:
+    login_limiter.refund(f"user:{email.strip().lower()}")
+    client_limiter.refund(f"ip:{client or 'unknown'}")
+
+def authenticate(
+    verify_user: Callable[[str, str], Optional[Dict[str, Any]]],
+    email: str,
+    password: str,
+    client: Optional[str],
+) -> Tuple[Optional[Dict[str, Any]], Optional[int]]:
+    """
+    (user, None) on success, (None, None) on bad credentials, or (None, whole
+    seconds to wait) when the email or the client address has failed too often.
+    A cached login is answered before the limiter: it already proved the password.
+    """
+    user = login_cache.get(email, password)
+    if user is not None:
+        return user, None
+    wait = _acquire(email, client)
+    if wait:
+        return None, wait
+    user = verify_user(email, password)
+    if user:
+        _refund(email, client)
+        login_cache.put(email, password, user)
+    return user, None
+
+async def authenticate_async(
+    verify_user: Callable[[str, str], Awaitable[Optional[Dict[str, Any]]]],
+    email: str,
+    password: str,
+    client: Optional[str],
+) -> Tuple[Optional[Dict[str, Any]], Optional[int]]:
+    """authenticate() with a coroutine verify_user."""
+    user = login_cache.get(email, password)
+    if user is not None:
+        return user, None
+    wait = _acquire(email, client)
+    if wait:
+        return None, wait
+    user = await verify_user(email, password)
+    if user:
+        _refund(email, client)
+        login_cache.put(email, password, user)
+    return user, None
@@ -0,0 +1,384 @@
+# Offline load benchmark: runs the Flask app in-process with local fakes for
+# Gemini (genai.Client), gpt-image-1 (OpenAI/AsyncOpenAI images.generate) and
+# Supabase (tables, RPC and storage), then drives /createLesson and /getLessons
+# at a given concurrency. Reports p50/p95/p99 latency, throughput and peak RSS.
+# Outbound connections are blocked, so no keys or network are needed and an
+# accidental live call fails the run instead of skewing it.
+#
+#   cd backend && python -m bench.offline --lessons 40 --reads 400 --concurrency 8 \
+#       --image-latency 0.5 --image-kb 1500
+#
+# The fakes replace the lazy client accessors (generatesteps.get_client,
+# generatesimages.get_client/_get_async_client) and the Supabase client under the
+# shared store (sqlcommands.set_store);
+# the pipeline, job manager, caches and HTTP layer are the real code. Lessons run
+# in the direct pipeline: the ADK agents call Gemini through ADK's own client.
+
+import os
+import re
+import sys
+import json
+import time
+import uuid
+import zlib
+import math
+import base64
+import struct
+import socket
+import asyncio
+import argparse
+import resource
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+def _no_network(*args, **kwargs):
+    raise RuntimeError("network access during offline benchmark")
+
+
+# ---------- Fake Gemini ----------
+class FakeGenaiClient:
+    """Stands in for genai.Client: models.generate_content returns a {"steps": [...]} JSON reply."""
+
+    def __init__(self, latency: float, steps: int):
+        self.latency = latency
+        self.steps = steps
+        self.models = self
+
+    def generate_content(self, model: str, contents: str, config: Any = None) -> SimpleNamespace:
+        time.sleep(self.latency)
+        # Distinct text per call, so the image cache doesn't turn later lessons into cache hits
+        call_id = uuid.uuid4().hex[:8]
+        steps = [f"Step {i}. Work through part {i} of problem {call_id}" for i in range(1, self.steps + 1)]
+        usage = SimpleNamespace(prompt_token_count=len(contents.split()), candidates_token_count=40 * self.steps)
+        return SimpleNamespace(text=json.dumps({"steps": steps}), usage_metadata=usage)
+
+
+# ---------- Fake gpt-image-1 ----------
+def _noise_png(payload_bytes: int) -> bytes:
+    """A real RGB PNG of random pixels (so it barely compresses) of roughly payload_bytes."""
+    side = max(1, int(math.sqrt(payload_bytes / 3)))
+    raw = b"".join(b"\x00" + os.urandom(side * 3) for _ in range(side))
+
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    header = struct.pack(">IIBBBBB", side, side, 8, 2, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(raw, 1)) + chunk(b"IEND", b"")
+
+
+class FakeImages:
+    """images.generate for both OpenAI and AsyncOpenAI, returning `payload_bytes` of base64 PNG per image."""
+
+    def __init__(self, latency: float, payload_bytes: int):
+        self.latency = latency
+        self._b64 = base64.b64encode(_noise_png(payload_bytes)).decode()
+
+    def _response(self, n: int) -> SimpleNamespace:
+        return SimpleNamespace(
+            data=[SimpleNamespace(b64_json=self._b64) for _ in range(n)],
+            usage=SimpleNamespace(input_tokens=120, output_tokens=4160 * n),
+        )
+
+    def generate(self, model: str, prompt: str, size: str, n: int = 1) -> SimpleNamespace:
+        time.sleep(self.latency)
+        return self._response(n)
+
+    async def agenerate(self, model: str, prompt: str, size: str, n: int = 1) -> SimpleNamespace:
+        await asyncio.sleep(self.latency)
+        return self._response(n)
+
+
+def fake_openai_clients(images: FakeImages) -> Tuple[SimpleNamespace, SimpleNamespace]:
+    sync_client = SimpleNamespace(images=SimpleNamespace(generate=images.generate))
+    async_client = SimpleNamespace(images=SimpleNamespace(generate=images.agenerate))
+    return sync_client, async_client
+
+
+# ---------- Fake Supabase ----------
+class FakeQuery:
+    """The subset of postgrest's query builder that sqlcommands uses, over in-memory rows."""
+
+    def __init__(self, db: "FakeSupabase", table: str):
+        self.db = db
+        self.table = table
+        self.columns = "*"
+        self.filters: List[Callable[[Dict[str, Any]], bool]] = []
+        self.orders: List[Tuple[str, bool]] = []
+        self.row_limit: Optional[int] = None
+        self.rows_to_insert: Optional[List[Dict[str, Any]]] = None
+        self.deleting = False
+
+    def select(self, columns: str = "*") -> "FakeQuery":
+        self.columns = columns
+        return self
+
+    def insert(self, rows: Any) -> "FakeQuery":
+        self.rows_to_insert = rows if isinstance(rows, list) else [rows]
+        return self
+
+    def delete(self) -> "FakeQuery":
+        self.deleting = True
+        return self
+
+    def eq(self, column: str, value: Any) -> "FakeQuery":
+        self.filters.append(lambda row: str(row.get(column)) == str(value))
+        return self
+
+    def match(self, values: Dict[str, Any]) -> "FakeQuery":
+        for column, value in values.items():
+            self.eq(column, value)
+        return self
+
+    def or_(self, expression: str) -> "FakeQuery":
+        # Only the (created_at, lesson_id) keyset filter built by get_lessons_page
+        created_at, lesson_id = re.search(r'created_at\.lt\."([^"]+)".*lesson_id\.lt\.(\d+)', expression).groups()
+        self.filters.append(lambda row: (row["created_at"], row["lesson_id"]) < (created_at, int(lesson_id)))
+        return self
+
+    def order(self, column: str, desc: bool = False) -> "FakeQuery":
+        self.orders.append((column, desc))
+        return self
+
+    def limit(self, count: int) -> "FakeQuery":
+        self.row_limit = count
+        return self
+
+    def execute(self) -> SimpleNamespace:
+        self.db.wait()
+        with self.db.lock:
+            if self.rows_to_insert is not None:
+                return SimpleNamespace(data=[self.db.insert(self.table, row) for row in self.rows_to_insert])
+            rows = [row for row in self.db.tables[self.table] if all(f(row) for f in self.filters)]
+            if self.deleting:
+                self.db.tables[self.table] = [row for row in self.db.tables[self.table] if row not in rows]
+                return SimpleNamespace(data=rows)
+            for column, desc in reversed(self.orders):
+                rows.sort(key=lambda row: row[column], reverse=desc)
+            rows = rows[: self.row_limit] if self.row_limit is not None else rows
+            return SimpleNamespace(data=[self.db.project(self.table, row, self.columns) for row in rows])
+
+
+class FakeRpc:
+    def __init__(self, db: "FakeSupabase", fn: str, params: Dict[str, Any]):
+        self.db = db
+        self.fn = fn
+        self.params = params
+
+    def execute(self) -> SimpleNamespace:
+        if self.fn != "create_lesson_with_steps":
+            raise RuntimeError(f"fake Supabase has no RPC {self.fn!r}")
+        self.db.wait()
+        job_id = self.params.get("p_job_id")
+        with self.db.lock:
+            saved = [row for row in self.db.tables["lessons"] if job_id is not None and row.get("job_id") == job_id]
+            if saved:
+                return SimpleNamespace(data={k: v for k, v in saved[0].items() if k != "job_id"})
+            lesson = self.db.insert("lessons", {
+                "lesson_name": self.params["p_lesson_name"],
+                "lesson_descriptions": self.params["p_lesson_descriptions"],
+                "lesson_level": self.params["p_lesson_level"],
+                "job_id": job_id,
+            })
+            for step in self.params["p_steps"]:
+                self.db.insert("steps", {**step, "lessons_id": lesson["lesson_id"]})
+        lesson.pop("job_id")  # the RPC's jsonb result leaves it out
+        return SimpleNamespace(data=lesson)
+
+
+class FakeBucket:
+    def __init__(self, db: "FakeSupabase"):
+        self.db = db
+
+    def upload(self, path: str, data: bytes, file_options: Optional[Dict[str, str]] = None) -> Dict[str, str]:
+        time.sleep(self.db.upload_latency)
+        with self.db.lock:
+            self.db.objects[path] = len(data)
+        return {"Key": path}
+
+
+class FakeSupabase:
+    """supabase.Client stand-in: table(), rpc() and storage.from_() over dicts, with per-call latency."""
+
+    def __init__(self, latency: float, upload_latency: float, seed_lessons: int, steps: int):
+        self.latency = latency
+        self.upload_latency = upload_latency
+        self.tables: Dict[str, List[Dict[str, Any]]] = {"users": [], "lessons": [], "steps": []}
+        self.objects: Dict[str, int] = {}
+        self.lock = threading.Lock()
+        self._ids = {"lessons": 0, "steps": 0, "users": 0}
+        self._clock = datetime(2025, 1, 1, tzinfo=timezone.utc)
+        self.storage = SimpleNamespace(from_=lambda bucket: FakeBucket(self))
+        for i in range(seed_lessons):
+            lesson = self.insert("lessons", {"lesson_name": f"Seed {i}", "lesson_descriptions": "seeded", "lesson_level": "1"})
+            for n in range(1, steps + 1):
+                self.insert("steps", {"lessons_id": lesson["lesson_id"], "step_number": n,
+                                      "step_description": f"Step {n}.", "image_path": f"seed/{i}/{n}.png"})
+
+    def wait(self) -> None:
+        time.sleep(self.latency)
+
+    def insert(self, table: str, row: Dict[str, Any]) -> Dict[str, Any]:
+        self._ids[table] += 1
+        self._clock += timedelta(milliseconds=1)
+        id_column = {"lessons": "lesson_id", "steps": "id", "users": "id"}[table]
+        row = {id_column: self._ids[table], "created_at": self._clock.isoformat(), **row}
+        self.tables[table].append(row)
+        return dict(row)
+
+    def project(self, table: str, row: Dict[str, Any], columns: str) -> Dict[str, Any]:
+        embedded = re.search(r"steps\(([^)]*)\)", columns)
+        plain = re.sub(r",?steps\([^)]*\)", "", columns)
+        out = dict(row) if plain.strip() == "*" else {c: row.get(c) for c in plain.split(",") if c}
+        if table == "lessons" and embedded:
+            step_columns = embedded.group(1).split(",")
+            out["steps"] = [
+                {c: step.get(c) for c in step_columns}
+                for step in self.tables["steps"] if step["lessons_id"] == row["lesson_id"]
+            ]
+        return out
+
+    def table(self, name: str) -> FakeQuery:
+        return FakeQuery(self, name)
+
+    def rpc(self, fn: str, params: Dict[str, Any]) -> FakeRpc:
+        return FakeRpc(self, fn, params)
+
+
+# ---------- Load driver ----------
+def percentile(samples: List[float], pct: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))]
+
+
+def report(name: str, latencies: List[float], failures: int, elapsed: float) -> Dict[str, Any]:
+    result = {
+        "requests": len(latencies) + failures,
+        "failures": failures,
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        **{f"p{p}_ms": round(percentile(latencies, p) * 1000, 1) for p in (50, 95, 99)},
+    }
+    print(f"{name:>14}: {result['requests']} requests, {failures} failed, {result['throughput_rps']} req/s, "
+          f"p50 {result['p50_ms']} ms, p95 {result['p95_ms']} ms, p99 {result['p99_ms']} ms")
+    return result
+
+
+def run_load(concurrency: int, count: int, request: Callable[[int], bool]) -> Tuple[List[float], int, float]:
+    latencies: List[float] = []
+    failures = 0
+    lock = threading.Lock()
+
+    def one(i: int) -> None:
+        nonlocal failures
+        started = time.perf_counter()
+        ok = request(i)
+        elapsed = time.perf_counter() - started
+        with lock:
+            if ok:
+                latencies.append(elapsed)
+            else:
+                failures += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(count)))
+    return latencies, failures, time.perf_counter() - started
+
+
+def main(argv: Optional[List[str]] = None) -> Dict[str, Any]:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lessons", type=int, default=20, help="/createLesson jobs to run end to end")
+    parser.add_argument("--reads", type=int, default=200, help="/getLessons requests")
+    parser.add_argument("--concurrency", type=int, default=4, help="client threads per phase")
+    parser.add_argument("--steps", type=int, default=6, help="steps per generated lesson")
+    parser.add_argument("--steps-latency", type=float, default=0.3, help="seconds per Gemini call")
+    parser.add_argument("--image-latency", type=float, default=0.5, help="seconds per gpt-image-1 call")
+    parser.add_argument("--image-kb", type=int, default=1500, help="decoded size of each fake image")
+    parser.add_argument("--db-latency", type=float, default=0.02, help="seconds per table/RPC call")
+    parser.add_argument("--upload-latency", type=float, default=0.05, help="seconds per storage upload")
+    parser.add_argument("--seed-lessons", type=int, default=200, help="lessons in the fake database up front")
+    parser.add_argument("--json", action="store_true", help="also print the results as one JSON object")
+    args = parser.parse_args(argv)
+
+    # Configure before the backend modules read their settings at import time
+    scratch = tempfile.mkdtemp(prefix="railroad-bench-")
+    os.environ.update(
+        SUPABASE_URL="http://127.0.0.1:9",
+        SUPABASE_SERVICE_ROLE="offline",
+        OPENAI_API_KEY="offline",
+        GEMINI_API_KEY="offline",
+        PIPELINE_MODE="direct",
+        CONTENT_CACHE_PATH=os.path.join(scratch, "content_cache.sqlite3"),
+        LESSON_JOB_WORKERS=str(args.concurrency),
+        LESSON_JOB_QUEUE_DEPTH=str(max(args.lessons, 1)),
+    )
+    socket.socket.connect = _no_network
+    socket.create_connection = _no_network
+
+    import server
+    import sqlcommands
+    from multi_tool_agent import generatesimages, generatesteps
+
+    genai_client = FakeGenaiClient(args.steps_latency, args.steps)
+    sync_images, async_images = fake_openai_clients(FakeImages(args.image_latency, args.image_kb * 1024))
+    supabase = FakeSupabase(args.db_latency, args.upload_latency, args.seed_lessons, args.steps)
+    generatesteps.get_client = lambda: genai_client
+    generatesimages.get_client = lambda: sync_images
+    generatesimages._get_async_client = lambda: async_images
+    sqlcommands.set_store(sqlcommands.SupabaseStore(client=supabase))
+
+    local = threading.local()
+
+    def client():
+        if not hasattr(local, "client"):
+            local.client = server.app.test_client()
+        return local.client
+
+    def create_lesson(i: int) -> bool:
+        # Unique topics, so every job runs the whole pipeline instead of the content cache
+        response = client().post("/createLesson", json={
+            "title": f"Bench {i}", "topic": f"topic {uuid.uuid4().hex}",
+            "level": "high school student", "description": "benchmark lesson",
+        })
+        if response.status_code != 202:
+            return False
+        job_id = response.get_json()["job_id"]
+        while True:
+            job = client().get(f"/lessonJobs/{job_id}").get_json()["job"]
+            if job["status"] in ("done", "failed"):
+                return job["status"] == "done"
+            time.sleep(0.01)
+
+    def get_lessons(i: int) -> bool:
+        # Mostly the first page, as the dashboard does, with some deeper pages mixed in
+        response = client().get("/getLessons")
+        if i % 4 == 0 and response.status_code == 200 and response.get_json()["next_cursor"]:
+            response = client().get("/getLessons", query_string={"cursor": response.get_json()["next_cursor"]})
+        return response.status_code == 200
+
+    print(f"Offline benchmark: {args.lessons} lessons x {args.steps} steps, {args.reads} reads, "
+          f"concurrency {args.concurrency}")
+    results = {
+        "createLesson": report("/createLesson", *run_load(args.concurrency, args.lessons, create_lesson)),
+        "getLessons": report("/getLessons", *run_load(args.concurrency, args.reads, get_lessons)),
+    }
+    server.lesson_jobs.shutdown()
+
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    results["peak_rss_mb"] = round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+    results["uploaded_objects"] = len(supabase.objects)
+    print(f"peak RSS {results['peak_rss_mb']} MB, {results['uploaded_objects']} objects uploaded")
+    if args.json:
+        print(json.dumps(results))
+    return results
+
+
+if __name__ == "__main__":
+    main()
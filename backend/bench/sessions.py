@@ -0,0 +1,61 @@
+# Per-request ADK setup benchmark: compares building a session service, session
+# and Runner for every request (the old run_agent_pipeline) with opening and
+# closing a session on the shared AgentPipeline. Reports setup time per request
+# and how much traced memory is still held after all requests finish.
+# Nothing is sent to a model, so no network or credentials are needed.
+#
+#   cd backend && python -m bench.sessions [requests]
+
+import os
+import sys
+import time
+import asyncio
+import tracemalloc
+
+os.environ.setdefault("GEMINI_API_KEY", "offline")
+os.environ.setdefault("OPENAI_API_KEY", "offline")
+
+from google.adk.runners import Runner
+from google.adk.sessions import InMemorySessionService
+
+from multi_tool_agent.agent import AgentPipeline, root_agent
+from multi_tool_agent.workspace import STATE_WORKSPACE
+
+
+async def per_call_setup(i: int, kept: list) -> None:
+    session_service = InMemorySessionService()
+    session = await session_service.create_session(
+        app_name="PipelineApp", user_id="blake", state={STATE_WORKSPACE: f"job_{i}"}
+    )
+    runner = Runner(app_name="PipelineApp", agent=root_agent, session_service=session_service)
+    kept.append((runner, session))  # the old code never deleted a session; keep it alive as the server would
+
+
+async def shared_setup(pipeline: AgentPipeline, i: int, kept: list) -> None:
+    user_id = f"job_{i}"
+    session = await pipeline.open_session(user_id, state={STATE_WORKSPACE: f"job_{i}"})
+    await pipeline.close_session(user_id, session.id)
+
+
+async def measure(label: str, setup, requests: int) -> None:
+    kept: list = []
+    tracemalloc.start()
+    started = time.perf_counter()
+    for i in range(requests):
+        await setup(i, kept)
+    elapsed = time.perf_counter() - started
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:>14}: {elapsed / requests * 1e6:8.1f} µs/request, "
+          f"{retained / 1024:8.1f} KiB retained, {peak / 1024:8.1f} KiB peak over {requests} requests")
+
+
+async def main(requests: int = 1000) -> None:
+    pipeline = AgentPipeline()
+    await measure("per-call", per_call_setup, requests)
+    await measure("shared", lambda i, kept: shared_setup(pipeline, i, kept), requests)
+    print(f"open sessions on the shared pipeline: {pipeline.session_count()}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000))
@@ -0,0 +1,60 @@
+# Startup-time benchmark: boots the Flask app in fresh interpreters with every
+# outbound connection blocked and dummy credentials, and reports how long
+# `import server` takes. Any network access during import fails the run.
+#
+#   cd backend && python -m bench.startup [runs]
+
+import os
+import sys
+import json
+import statistics
+import subprocess
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BUDGET_SECONDS = 1.0
+
+CHILD = r"""
+import json, socket, time
+
+def _no_network(*args, **kwargs):
+    raise RuntimeError("network access during startup")
+
+socket.socket.connect = _no_network
+socket.create_connection = _no_network
+
+started = time.perf_counter()
+import server
+server.app.test_client()  # build the WSGI app as the dev server would
+print(json.dumps({"seconds": time.perf_counter() - started}))
+"""
+
+
+def boot_once() -> float:
+    env = dict(
+        os.environ,
+        SUPABASE_URL="http://127.0.0.1:9",
+        SUPABASE_SERVICE_ROLE="offline",
+        OPENAI_API_KEY="offline",
+        GEMINI_API_KEY="offline",
+    )
+    out = subprocess.run(
+        [sys.executable, "-c", CHILD],
+        cwd=BACKEND_DIR, env=env, capture_output=True, text=True,
+    )
+    if out.returncode != 0:
+        sys.exit(f"❌ server failed to boot offline:\n{out.stderr}")
+    return json.loads(out.stdout.strip().splitlines()[-1])["seconds"]
+
+
+def main(runs: int = 5) -> None:
+    timings = [boot_once() for _ in range(runs)]
+    median = statistics.median(timings)
+    print(f"import server: median {median * 1000:.0f} ms, "
+          f"min {min(timings) * 1000:.0f} ms, max {max(timings) * 1000:.0f} ms over {runs} runs")
+    if median > BUDGET_SECONDS:
+        sys.exit(f"❌ startup over budget ({BUDGET_SECONDS:.1f}s)")
+    print("✅ startup within budget, no network used")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5)
@@ -0,0 +1,162 @@
+# Read-through cache for lesson listings.
+# Defaults to an in-process LRU with a TTL; set LESSON_CACHE_URL=redis://... to
+# share it between processes through any Redis-compatible server instead.
+
+import os
+import json
+import time
+import inspect
+import threading
+from collections import OrderedDict
+from functools import wraps
+from typing import Any, Awaitable, Callable, Optional, Protocol
+from dotenv import load_dotenv
+
+load_dotenv()
+
+LESSON_CACHE_URL = os.getenv("LESSON_CACHE_URL")                 # unset = in-process cache
+LESSON_CACHE_TTL = int(os.getenv("LESSON_CACHE_TTL", "300"))     # seconds
+LESSON_CACHE_SIZE = int(os.getenv("LESSON_CACHE_SIZE", "256"))   # entries (in-process only)
+
+
+class CacheBackend(Protocol):
+    def get(self, key: str) -> Optional[str]: ...
+    def set(self, key: str, value: str, ttl: Optional[int] = None) -> None: ...
+    def incr(self, key: str) -> int: ...
+
+
+class TTLCache:
+    """Thread-safe LRU; entries also expire `ttl` seconds after they are set."""
+
+    def __init__(self, maxsize: int = LESSON_CACHE_SIZE):
+        self._maxsize = maxsize
+        self._data: "OrderedDict[str, tuple[Optional[float], str]]" = OrderedDict()
+        self._counters: dict[str, int] = {}  # incr() keys, kept out of the LRU so they are never evicted
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            if key in self._counters:
+                return str(self._counters[key])
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at is not None and expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: str, ttl: Optional[int] = None) -> None:
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl if ttl else None, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self._maxsize:
+                self._data.popitem(last=False)
+
+    def incr(self, key: str) -> int:
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+            return self._counters[key]
+
+
+class RedisCache:
+    """Adapter over redis-py (or any client with the same get/set/incr API)."""
+
+    def __init__(self, url: str):
+        import redis  # optional dependency, only needed when LESSON_CACHE_URL is set
+
+        self._client = redis.Redis.from_url(url, decode_responses=True)
+
+    def get(self, key: str) -> Optional[str]:
+        return self._client.get(key)
+
+    def set(self, key: str, value: str, ttl: Optional[int] = None) -> None:
+        self._client.set(key, value, ex=ttl)
+
+    def incr(self, key: str) -> int:
+        return int(self._client.incr(key))
+
+
+class Cache:
+    """
+    Read-through cache keyed by function name and arguments. Writers call
+    invalidate(), which bumps a generation number that is part of every key,
+    so stale entries are never read again and simply age out. Methods are keyed
+    without `self`, so every store instance (sync or async) shares entries.
+    """
+
+    def __init__(self, backend: CacheBackend, namespace: str, ttl: int = LESSON_CACHE_TTL):
+        self.backend = backend
+        self.namespace = namespace
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    def _generation(self) -> str:
+        return self.backend.get(f"{self.namespace}:generation") or "0"
+
+    def invalidate(self) -> None:
+        self.backend.incr(f"{self.namespace}:generation")
+
+    def cached(self, fn: Callable[..., Any]) -> Callable[..., Any]:
+        """Decorator for functions whose arguments and results are JSON-serializable."""
+
+        skip = _skip_self(fn)
+
+        @wraps(fn)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            key = self._key(fn, args[skip:], kwargs)
+            hit = self._lookup(key)
+            if hit is not None:
+                return json.loads(hit)
+
+            result = fn(*args, **kwargs)
+            self.backend.set(key, json.dumps(result), self.ttl)
+            return result
+
+        return wrapper
+
+    def cached_async(self, fn: Callable[..., Awaitable[Any]]) -> Callable[..., Awaitable[Any]]:
+        """cached() for coroutine functions. Shares keys with cached(), so sync and async readers share entries."""
+
+        skip = _skip_self(fn)
+
+        @wraps(fn)
+        async def wrapper(*args: Any, **kwargs: Any) -> Any:
+            key = self._key(fn, args[skip:], kwargs)
+            hit = self._lookup(key)
+            if hit is not None:
+                return json.loads(hit)
+
+            result = await fn(*args, **kwargs)
+            self.backend.set(key, json.dumps(result), self.ttl)
+            return result
+
+        return wrapper
+
+    def _key(self, fn: Callable[..., Any], args: Any, kwargs: Any) -> str:
+        args_key = json.dumps([args, kwargs], sort_keys=True, default=str)
+        return f"{self.namespace}:{self._generation()}:{fn.__name__}:{args_key}"
+
+    def _lookup(self, key: str) -> Optional[str]:
+        hit = self.backend.get(key)
+        if hit is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return hit
+
+
+def _skip_self(fn: Callable[..., Any]) -> int:
+    # Leading positional arguments to leave out of the cache key
+    params = list(inspect.signature(fn).parameters)
+    return 1 if params and params[0] == "self" else 0
+
+
+def make_backend(url: Optional[str] = LESSON_CACHE_URL) -> CacheBackend:
+    return RedisCache(url) if url else TTLCache()
+
+
+lesson_cache = Cache(make_backend(), "lessons")
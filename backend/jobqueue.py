@@ -0,0 +1,338 @@
+# Durable lesson-job queue shared by the web tier and worker processes (worker.py).
+# Jobs, their progress and their event log live in one SQLite file, so lessons
+# survive a web or worker restart and any number of processes can share the work.
+# Workers claim a job with a lease and renew it while they run; a job whose lease
+# runs out (its worker crashed, or the job ran past LESSON_JOB_TIMEOUT and was
+# released) is claimed again, up to LESSON_JOB_MAX_ATTEMPTS.
+
+import os
+import json
+import time
+import uuid
+import asyncio
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+from dotenv import load_dotenv
+
+from cache import lesson_cache
+from jobs import QUEUED, RUNNING, DONE, FAILED, LESSON_JOB_QUEUE_DEPTH, LESSON_JOB_TTL, QueueFullError
+
+load_dotenv()
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+LESSON_QUEUE_PATH = os.getenv("LESSON_QUEUE_PATH", os.path.join(BACKEND_DIR, "lesson_jobs.sqlite3"))
+LESSON_JOB_LEASE = int(os.getenv("LESSON_JOB_LEASE", "60"))                # seconds a claim lasts without renewal
+LESSON_JOB_MAX_ATTEMPTS = int(os.getenv("LESSON_JOB_MAX_ATTEMPTS", "3"))  # claims before a job is failed
+LESSON_JOB_TIMEOUT = int(os.getenv("LESSON_JOB_TIMEOUT", "900"))          # seconds a worker may hold one job
+LESSON_QUEUE_POLL = float(os.getenv("LESSON_QUEUE_POLL", "0.25"))         # seconds between checks for new work/events
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS lesson_jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    stage TEXT,
+    progress TEXT NOT NULL,
+    args TEXT NOT NULL,
+    result TEXT,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    lease_owner TEXT,
+    lease_expires REAL,
+    created_at REAL NOT NULL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS lesson_jobs_status ON lesson_jobs (status, created_at);
+CREATE TABLE IF NOT EXISTS lesson_job_events (
+    job_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    event TEXT NOT NULL,
+    PRIMARY KEY (job_id, seq)
+);
+"""
+
+
+class JobQueue:
+    """The SQLite tables behind QueuedJobManager and the workers. Safe to share between threads."""
+
+    def __init__(self, path: str = LESSON_QUEUE_PATH, lease: int = LESSON_JOB_LEASE, max_attempts: int = LESSON_JOB_MAX_ATTEMPTS):
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(SCHEMA)
+
+    # ---------- Web tier ----------
+    def enqueue(self, args: List[Any], queue_depth: int = LESSON_JOB_QUEUE_DEPTH) -> str:
+        job_id = uuid.uuid4().hex
+        progress = {"steps_generated": 0, "images_done": 0, "uploaded": 0}
+        with self._transaction():
+            (queued,) = self._db.execute("SELECT COUNT(*) FROM lesson_jobs WHERE status = ?", (QUEUED,)).fetchone()
+            if queued >= queue_depth:
+                raise QueueFullError("Too many lessons are being generated, try again shortly")
+            self._db.execute(
+                "INSERT INTO lesson_jobs (id, status, progress, args, created_at) VALUES (?, ?, ?, ?, ?)",
+                (job_id, QUEUED, json.dumps(progress), json.dumps(args), time.time()),
+            )
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT id, status, stage, progress, result, error, created_at, finished_at FROM lesson_jobs WHERE id = ?",
+                (job_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        job_id, status, stage, progress, result, error, created_at, finished_at = row
+        return {
+            "job_id": job_id,
+            "status": status,
+            "stage": stage,
+            "progress": json.loads(progress),
+            "result": json.loads(result) if result else None,
+            "error": error,
+            "created_at": created_at,
+            "finished_at": finished_at,
+        }
+
+    def events(self, job_id: str, start: int) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT event FROM lesson_job_events WHERE job_id = ? AND seq >= ? ORDER BY seq", (job_id, start)
+            ).fetchall()
+        return [json.loads(event) for (event,) in rows]
+
+    def stats(self) -> Dict[str, int]:
+        counts = {QUEUED: 0, RUNNING: 0, DONE: 0, FAILED: 0}
+        with self._lock:
+            for status, count in self._db.execute("SELECT status, COUNT(*) FROM lesson_jobs GROUP BY status"):
+                counts[status] = count
+        return counts
+
+    def prune(self, ttl: int = LESSON_JOB_TTL) -> None:
+        """Forget finished jobs older than the TTL so the tables stay bounded."""
+        with self._transaction():
+            cutoff = time.time() - ttl
+            self._db.execute(
+                "DELETE FROM lesson_job_events WHERE job_id IN "
+                "(SELECT id FROM lesson_jobs WHERE finished_at IS NOT NULL AND finished_at < ?)",
+                (cutoff,),
+            )
+            self._db.execute("DELETE FROM lesson_jobs WHERE finished_at IS NOT NULL AND finished_at < ?", (cutoff,))
+
+    # ---------- Workers ----------
+    def claim(self, worker_id: str) -> Optional[Tuple[str, List[Any]]]:
+        """
+        Lease the oldest queued job, or one whose lease expired, to `worker_id`.
+        Returns (job_id, args), or None when there is nothing to do.
+        """
+        now = time.time()
+        with self._transaction():
+            # Jobs that keep outliving their lease (e.g. crash the worker every time) are given up on
+            for (job_id,) in self._db.execute(
+                "SELECT id FROM lesson_jobs WHERE status = ? AND lease_expires < ? AND attempts >= ?",
+                (RUNNING, now, self.max_attempts),
+            ).fetchall():
+                self._finish(job_id, FAILED, error=f"Lesson job abandoned after {self.max_attempts} attempts")
+
+            row = self._db.execute(
+                "SELECT id, args, attempts FROM lesson_jobs "
+                "WHERE status = ? OR (status = ? AND lease_expires < ?) ORDER BY created_at LIMIT 1",
+                (QUEUED, RUNNING, now),
+            ).fetchone()
+            if row is None:
+                return None
+            job_id, args, attempts = row
+            self._db.execute(
+                "UPDATE lesson_jobs SET status = ?, attempts = attempts + 1, lease_owner = ?, lease_expires = ? WHERE id = ?",
+                (RUNNING, worker_id, now + self.lease, job_id),
+            )
+            if attempts:
+                self._append(job_id, {"type": "progress", "stage": "retrying", "attempt": attempts + 1})
+        return job_id, json.loads(args)
+
+    def renew(self, job_id: str, worker_id: str) -> bool:
+        """Extend the lease; False if the job is no longer ours (it expired and was claimed again)."""
+        with self._lock:
+            cursor = self._db.execute(
+                "UPDATE lesson_jobs SET lease_expires = ? WHERE id = ? AND lease_owner = ? AND status = ?",
+                (time.time() + self.lease, job_id, worker_id, RUNNING),
+            )
+        return cursor.rowcount == 1
+
+    def release(self, job_id: str, worker_id: str) -> None:
+        """Give up the lease now, so the next claim() retries the job without waiting for it to expire."""
+        with self._lock:
+            self._db.execute(
+                "UPDATE lesson_jobs SET lease_expires = 0 WHERE id = ? AND lease_owner = ? AND status = ?",
+                (job_id, worker_id, RUNNING),
+            )
+
+    def update(self, job_id: str, stage: Optional[str] = None, **progress: int) -> None:
+        with self._transaction():
+            row = self._db.execute("SELECT stage, progress FROM lesson_jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                return
+            stage = stage or row[0]
+            merged = {**json.loads(row[1]), **progress}
+            self._db.execute("UPDATE lesson_jobs SET stage = ?, progress = ? WHERE id = ?", (stage, json.dumps(merged), job_id))
+            self._append(job_id, {"type": "progress", "stage": stage, **merged})
+
+    def emit(self, job_id: str, event: Dict[str, Any]) -> None:
+        with self._transaction():
+            self._append(job_id, event)
+
+    def complete(self, job_id: str, worker_id: str, result: Any) -> None:
+        with self._transaction():
+            if self._owns(job_id, worker_id):
+                self._finish(job_id, DONE, result=result)
+
+    def fail(self, job_id: str, worker_id: str, error: str) -> None:
+        with self._transaction():
+            if self._owns(job_id, worker_id):
+                self._finish(job_id, FAILED, error=error)
+
+    # ---------- Internals (caller holds the lock / transaction) ----------
+    def _transaction(self):
+        return _Transaction(self._db, self._lock)
+
+    def _owns(self, job_id: str, worker_id: str) -> bool:
+        row = self._db.execute("SELECT lease_owner, status FROM lesson_jobs WHERE id = ?", (job_id,)).fetchone()
+        return row is not None and row == (worker_id, RUNNING)
+
+    def _append(self, job_id: str, event: Dict[str, Any]) -> None:
+        self._db.execute(
+            "INSERT INTO lesson_job_events (job_id, seq, event) "
+            "SELECT ?, COALESCE(MAX(seq) + 1, 0), ? FROM lesson_job_events WHERE job_id = ?",
+            (job_id, json.dumps(event), job_id),
+        )
+
+    def _finish(self, job_id: str, status: str, result: Any = None, error: Optional[str] = None) -> None:
+        self._db.execute(
+            "UPDATE lesson_jobs SET status = ?, result = ?, error = ?, finished_at = ?, lease_owner = NULL WHERE id = ?",
+            (status, json.dumps(result) if result is not None else None, error, time.time(), job_id),
+        )
+        # Same closing events as jobs.Job, so /lessonJobs/<id>/events reads alike for both backends
+        self._append(job_id, {"type": "done", "lesson": result} if status == DONE else {"type": "error", "message": error})
+
+
+class _Transaction:
+    """BEGIN IMMEDIATE ... COMMIT under the queue's lock, so claims never race between processes."""
+
+    def __init__(self, db: sqlite3.Connection, lock: threading.Lock):
+        self._db = db
+        self._lock = lock
+
+    def __enter__(self) -> None:
+        self._lock.acquire()
+        self._db.execute("BEGIN IMMEDIATE")
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        try:
+            self._db.execute("ROLLBACK" if exc_type else "COMMIT")
+        finally:
+            self._lock.release()
+
+
+class QueuedJob:
+    """
+    Read-only view of a queued job with the same interface the routes use on jobs.Job
+    (status, result, error, finished, to_dict, wait_events, wait_events_async).
+    """
+
+    def __init__(self, manager: "QueuedJobManager", row: Dict[str, Any]):
+        self._manager = manager
+        self.id = row["job_id"]
+        self._row = row
+
+    @property
+    def status(self) -> str:
+        return self._row["status"]
+
+    @property
+    def result(self) -> Any:
+        return self._row["result"]
+
+    @property
+    def error(self) -> Optional[str]:
+        return self._row["error"]
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (DONE, FAILED)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {key: value for key, value in self._row.items() if key != "result"}
+
+    def wait_events(self, start: int, timeout: float) -> Tuple[List[Dict[str, Any]], bool]:
+        """Polls the queue every LESSON_QUEUE_POLL seconds, see jobs.Job.wait_events."""
+        deadline = time.monotonic() + timeout
+        while True:
+            events, finished = self._poll(start)
+            if events or finished or time.monotonic() >= deadline:
+                return events, finished
+            time.sleep(LESSON_QUEUE_POLL)
+
+    async def wait_events_async(self, start: int, timeout: float) -> Tuple[List[Dict[str, Any]], bool]:
+        deadline = time.monotonic() + timeout
+        while True:
+            events, finished = await asyncio.to_thread(self._poll, start)
+            if events or finished or time.monotonic() >= deadline:
+                return events, finished
+            await asyncio.sleep(LESSON_QUEUE_POLL)
+
+    def _poll(self, start: int) -> Tuple[List[Dict[str, Any]], bool]:
+        # Read the status first: a job that was finished then has all its events written
+        row = self._manager.queue.get(self.id)
+        if row is not None:
+            self._row = row
+            self._manager._observe(row)
+        return self._manager.queue.events(self.id, start), self.finished
+
+
+class QueuedJobManager:
+    """
+    JobManager's interface over JobQueue: submit() only records the job, and
+    worker processes (python worker.py) run it. Selected with LESSON_JOB_BACKEND=queue.
+    """
+
+    def __init__(self, queue: Optional[JobQueue] = None, queue_depth: int = LESSON_JOB_QUEUE_DEPTH, ttl: int = LESSON_JOB_TTL):
+        self.queue = queue or JobQueue()
+        self._queue_depth = queue_depth
+        self._ttl = ttl
+        self._seen_done: "OrderedDict[str, None]" = OrderedDict()  # recent finished job ids, bounded
+        self._lock = threading.Lock()
+
+    def submit(self, *args: Any) -> QueuedJob:
+        self.queue.prune(self._ttl)
+        job_id = self.queue.enqueue(list(args), self._queue_depth)
+        return QueuedJob(self, self.queue.get(job_id))
+
+    def get(self, job_id: str) -> Optional[QueuedJob]:
+        row = self.queue.get(job_id)
+        if row is None:
+            return None
+        self._observe(row)
+        return QueuedJob(self, row)
+
+    def stats(self) -> Dict[str, int]:
+        return self.queue.stats()
+
+    def shutdown(self, wait: bool = True) -> None:
+        """Nothing runs in this process; queued jobs stay in the queue for the workers."""
+
+    def _observe(self, row: Dict[str, Any]) -> None:
+        # Workers invalidate lesson_cache in their own process; unless the cache is
+        # shared (LESSON_CACHE_URL), drop this process's listings once a lesson lands.
+        if row["status"] != DONE:
+            return
+        with self._lock:
+            if row["job_id"] in self._seen_done:
+                return
+            self._seen_done[row["job_id"]] = None
+            if len(self._seen_done) > 1024:
+                self._seen_done.popitem(last=False)
+        lesson_cache.invalidate()
@@ -0,0 +1,255 @@
+# Background lesson-generation jobs.
+# /createLesson hands work to a JobManager and returns a job id straight away;
+# the frontend polls /lessonJobs/<job_id> for progress and the finished lesson,
+# or follows /lessonJobs/<job_id>/events to get steps and images as they land.
+
+import os
+import time
+import uuid
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# ---------- Config ----------
+LESSON_JOB_WORKERS = int(os.getenv("LESSON_JOB_WORKERS", "2"))          # lessons generated at once
+LESSON_JOB_QUEUE_DEPTH = int(os.getenv("LESSON_JOB_QUEUE_DEPTH", "8"))  # lessons allowed to wait
+LESSON_JOB_TTL = int(os.getenv("LESSON_JOB_TTL", "3600"))               # seconds a finished job stays pollable
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class QueueFullError(RuntimeError):
+    """Raised by JobManager.submit when LESSON_JOB_QUEUE_DEPTH jobs are already waiting."""
+
+
+def _resolve(waiter: "asyncio.Future[None]") -> None:
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+class Job:
+    def __init__(self):
+        self.id = uuid.uuid4().hex
+        self.status = QUEUED
+        self.stage: Optional[str] = None
+        self.progress: Dict[str, int] = {"steps_generated": 0, "images_done": 0, "uploaded": 0}
+        self.result: Any = None
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.events: List[Dict[str, Any]] = []  # append-only log streamed to /lessonJobs/<id>/events
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._async_waiters: List[Tuple[asyncio.AbstractEventLoop, "asyncio.Future[None]"]] = []
+
+    def update(self, stage: Optional[str] = None, **progress: int) -> None:
+        """Progress callback handed to the pipeline, e.g. job.update(images_done=3)."""
+        with self._lock:
+            if stage:
+                self.stage = stage
+            self.progress.update(progress)
+            self.events.append({"type": "progress", "stage": self.stage, **self.progress})
+            self._notify()
+
+    def emit(self, event: Dict[str, Any]) -> None:
+        """Event callback handed to the pipeline, e.g. {"type": "image", "step_number": 2, "url": ...}."""
+        with self._lock:
+            self.events.append(event)
+            self._notify()
+
+    def wait_events(self, start: int, timeout: float) -> Tuple[List[Dict[str, Any]], bool]:
+        """
+        Events from index `start` on, waiting up to `timeout` seconds if there are none yet.
+        Also returns whether the job has finished, after which no more events arrive.
+        """
+        with self._lock:
+            if len(self.events) <= start and not self.finished:
+                self._changed.wait(timeout)
+            return self.events[start:], self.finished
+
+    async def wait_events_async(self, start: int, timeout: float) -> Tuple[List[Dict[str, Any]], bool]:
+        """wait_events for coroutines: waits on the event loop instead of blocking a thread."""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if len(self.events) > start or self.finished:
+                return self.events[start:], self.finished
+            waiter = loop.create_future()
+            self._async_waiters.append((loop, waiter))
+        try:
+            await asyncio.wait_for(waiter, timeout)
+        except asyncio.TimeoutError:
+            pass
+        with self._lock:
+            return self.events[start:], self.finished
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (DONE, FAILED)
+
+    def _set(self, **fields: Any) -> None:
+        with self._lock:
+            for name, value in fields.items():
+                setattr(self, name, value)
+            if self.finished:
+                self.finished_at = time.time()
+                if self.status == DONE:
+                    self.events.append({"type": "done", "lesson": self.result})
+                else:
+                    self.events.append({"type": "error", "message": self.error})
+            self._notify()
+
+    def _notify(self) -> None:
+        # Caller holds self._lock. Wakes threads in wait_events and coroutines in
+        # wait_events_async, which may be on another thread's event loop.
+        self._changed.notify_all()
+        for loop, waiter in self._async_waiters:
+            loop.call_soon_threadsafe(_resolve, waiter)
+        self._async_waiters.clear()
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "job_id": self.id,
+                "status": self.status,
+                "stage": self.stage,
+                "progress": dict(self.progress),
+                "error": self.error,
+                "created_at": self.created_at,
+                "finished_at": self.finished_at,
+            }
+
+
+class _JobRegistry:
+    """Job bookkeeping shared by the threaded and asyncio managers."""
+
+    def __init__(self, run: Callable[..., Any], queue_depth: int, ttl: int):
+        self._run = run
+        self._queue_depth = queue_depth
+        self._ttl = ttl
+        self._jobs: Dict[str, Job] = {}
+        self._queued = 0
+        self._lock = threading.Lock()
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            counts = {QUEUED: 0, RUNNING: 0, DONE: 0, FAILED: 0}
+            for job in self._jobs.values():
+                counts[job.status] += 1
+            return counts
+
+    def _register(self) -> Job:
+        self._prune()
+        job = Job()
+        with self._lock:
+            if self._queued >= self._queue_depth:
+                raise QueueFullError("Too many lessons are being generated, try again shortly")
+            self._queued += 1
+            self._jobs[job.id] = job
+        return job
+
+    def _start(self, job: Job) -> None:
+        with self._lock:
+            self._queued -= 1
+        job._set(status=RUNNING)
+
+    def _fail(self, job: Job, e: Exception) -> None:
+        print(f"❌ Lesson job {job.id} failed: {e}")
+        job._set(status=FAILED, error=str(e))
+
+    def _prune(self) -> None:
+        """Forget finished jobs older than the TTL so the registry stays bounded."""
+        cutoff = time.time() - self._ttl
+        with self._lock:
+            expired = [
+                job_id for job_id, job in self._jobs.items()
+                if job.finished and job.finished_at < cutoff
+            ]
+            for job_id in expired:
+                del self._jobs[job_id]
+
+
+class JobManager(_JobRegistry):
+    """
+    Runs `run(job, *args, **kwargs)` on a bounded thread pool.
+    `run` is injected so the pipeline can be swapped for a stub in tests.
+    """
+
+    def __init__(
+        self,
+        run: Callable[..., Any],
+        workers: int = LESSON_JOB_WORKERS,
+        queue_depth: int = LESSON_JOB_QUEUE_DEPTH,
+        ttl: int = LESSON_JOB_TTL,
+    ):
+        super().__init__(run, queue_depth, ttl)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="lesson-job")
+
+    def submit(self, *args: Any, **kwargs: Any) -> Job:
+        job = self._register()
+        self._executor.submit(self._execute, job, args, kwargs)
+        return job
+
+    def shutdown(self, wait: bool = True) -> None:
+        self._executor.shutdown(wait=wait)
+
+    def _execute(self, job: Job, args, kwargs) -> None:
+        self._start(job)
+        try:
+            result = self._run(job, *args, **kwargs)
+            job._set(status=DONE, result=result)
+        except Exception as e:
+            self._fail(job, e)
+
+
+class AsyncJobManager(_JobRegistry):
+    """
+    Same contract as JobManager for the ASGI app: `run` is a coroutine function,
+    jobs are tasks on the server's event loop and a semaphore bounds how many run at once.
+    """
+
+    def __init__(
+        self,
+        run: Callable[..., Awaitable[Any]],
+        workers: int = LESSON_JOB_WORKERS,
+        queue_depth: int = LESSON_JOB_QUEUE_DEPTH,
+        ttl: int = LESSON_JOB_TTL,
+    ):
+        super().__init__(run, queue_depth, ttl)
+        self._workers = workers
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._tasks: Set["asyncio.Task[None]"] = set()  # strong refs so running jobs aren't garbage collected
+
+    def submit(self, *args: Any, **kwargs: Any) -> Job:
+        """Must be called from the event loop."""
+        job = self._register()
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self._workers)
+        task = asyncio.get_running_loop().create_task(self._execute(job, args, kwargs))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return job
+
+    async def shutdown(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def _execute(self, job: Job, args, kwargs) -> None:
+        async with self._semaphore:
+            self._start(job)
+            try:
+                result = await self._run(job, *args, **kwargs)
+                job._set(status=DONE, result=result)
+            except Exception as e:
+                self._fail(job, e)
@@ -0,0 +1,95 @@
+# Request/response helpers shared by the Flask app (server.py) and the ASGI app (asgi.py)
+
+import json
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+
+LESSONS_PAGE_SIZE = 50
+LESSONS_MAX_PAGE_SIZE = 100
+EVENTS_KEEPALIVE_SECONDS = 15
+
+
+def lesson_steps(
+    steps_array: List[str],
+    file_urls: List[Optional[str]],
+    thumbnail_urls: Optional[List[Optional[str]]] = None,
+) -> List[Dict[str, Any]]:
+    """Step rows for add_lesson_with_steps; upload results are ordered one-per-image, so image i belongs to step i."""
+    thumbnail_urls = thumbnail_urls or []
+    return [
+        {
+            "step_number": i + 1,
+            "step_description": step_description,
+            "image_path": file_urls[i] if i < len(file_urls) else None,
+            "thumbnail_path": thumbnail_urls[i] if i < len(thumbnail_urls) else None,
+        }
+        for i, step_description in enumerate(steps_array)
+    ]
+
+
+def with_steps(lesson: Dict[str, Any], steps: List[Dict[str, Any]]) -> Dict[str, Any]:
+    lesson['steps'] = [
+        {
+            "step_description": step["step_description"],
+            "image_path": step["image_path"],
+            "thumbnail_path": step["thumbnail_path"],
+        }
+        for step in steps
+    ]
+    return lesson
+
+
+def create_lesson_args(data: Mapping[str, Any]) -> Tuple[Any, ...]:
+    """(title, topic, level, description, force_regenerate) from a /createLesson body."""
+    return (
+        data.get('title'),
+        data.get('topic'),
+        data.get('level'),
+        data.get('description'),
+        # Skip the content cache and generate fresh steps and images
+        bool(data.get('force_regenerate', False)),
+    )
+
+
+def lessons_page_args(args: Mapping[str, str]) -> Tuple[int, Optional[str], bool]:
+    """
+    (limit, cursor, include_steps) from /getLessons?limit=N&cursor=<next_cursor>&summary=1
+    (summary leaves out the steps). Raises ValueError on a bad limit.
+    """
+    try:
+        limit = min(int(args.get('limit', LESSONS_PAGE_SIZE)), LESSONS_MAX_PAGE_SIZE)
+    except ValueError:
+        raise ValueError("limit must be a number")
+    if limit < 1:
+        raise ValueError("limit must be positive")
+    include_steps = args.get('summary', '0').lower() not in ('1', 'true')
+    return limit, args.get('cursor'), include_steps
+
+
+def wants_thumbnails(args: Mapping[str, str]) -> bool:
+    """/getLessons?images=thumbnail (the default) or images=full. Raises ValueError on anything else."""
+    images = args.get('images', 'thumbnail').lower()
+    if images not in ('thumbnail', 'full'):
+        raise ValueError("images must be 'thumbnail' or 'full'")
+    return images == 'thumbnail'
+
+
+def with_thumbnails(lessons: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Lessons whose steps show the thumbnail as image_path, with the full-size image
+    kept in full_image_path. Steps without a thumbnail keep their full image.
+    Returns copies: the input may be shared with lesson_cache.
+    """
+    return [
+        {
+            **lesson,
+            "steps": [
+                {**step, "image_path": step.get("thumbnail_path") or step.get("image_path"), "full_image_path": step.get("image_path")}
+                for step in lesson.get("steps") or []
+            ],
+        } if "steps" in lesson else lesson
+        for lesson in lessons
+    ]
+
+
+def sse_event(index: int, event: Dict[str, Any]) -> str:
+    return f"id: {index}\ndata: {json.dumps(event)}\n\n"
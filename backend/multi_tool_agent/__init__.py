@@ -1 +1,8 @@
-from . import agent
+# `adk web` looks for multi_tool_agent.agent; load it on first access rather than
+# at package import, so importing a light module like multi_tool_agent.workspace
+# doesn't pull in ADK and the model SDKs.
+def __getattr__(name):
+    if name == "agent":
+        from . import agent
+        return agent
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
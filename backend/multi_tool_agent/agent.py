@@ -1,25 +1,40 @@
 import asyncio
+import inspect
+import os
+import sys
+import time
 from google.adk.agents import Agent, SequentialAgent, ParallelAgent, LlmAgent
 from google.adk.runners import Runner
 from google.adk.sessions import InMemorySessionService
 from google.genai.types import Content, Part  # user message container
-import json
+import uuid
+import threading
+from collections import OrderedDict
+import weakref
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
 # Your tools (plain Python functions are auto-wrapped as FunctionTools by ADK)
-from .generatesteps import generate_steps
-from .generatesimages import generate_images
-
-steps_agent = Agent(
-    name="teaching_guide_agent",
-    model="gemini-2.5-flash",
-    description="Generates step-by-step plans for students.",
-    instruction=(
-        "You are a helpful teaching assistant. "
-        "When the user asks for a step-by-step plan, call the tool `generate_steps` "
-        "with (task, values, student) and return ONLY the resulting array of strings."
-    ),
-    tools=[generate_steps],
-    output_key="steps"
-)
+from .generatesteps import generate_steps, STEPS_MODEL
+from .generatesimages import generate_images, generate_images_async, image_cache_keys, pop_step_images, StepImage, IMAGE_CONCURRENCY, IMAGE_MODEL
+from .content_cache import content_key, get_image_cache, get_lesson_cache
+from .imagevariants import IMAGE_VARIANT_FORMAT, make_variants_async
+from .quality import QUALITY_STAGE, QualityBudget, refine_images, refine_step_image
+from .tracing import Span, span, traced
+from .workspace import job_workspace, STATE_WORKSPACE, STATE_STEPS, STATE_STEP_IMAGE_PREFIX
+
+# An ADK agent can only belong to one parent, so every pipeline gets its own instances
+def create_steps_agent() -> Agent:
+    return Agent(
+        name="teaching_guide_agent",
+        model="gemini-2.5-flash",
+        description="Generates step-by-step plans for students.",
+        instruction=(
+            "You are a helpful teaching assistant. "
+            "When the user asks for a step-by-step plan, call the tool `generate_steps` "
+            "with (task, values, student) and return ONLY the resulting array of strings."
+        ),
+        tools=[generate_steps],
+        output_key="steps"
+    )
 
 # Create a custom agent that processes individual steps
 class StepProcessorAgent(Agent):
@@ -58,36 +73,354 @@ def create_step_image_generator(step_number: int) -> Agent:
         tools=[generate_images],
     )
 
-# Create agents for the first 6 steps (adjust number as needed)
-step_image_generators = [create_step_image_generator(i) for i in range(1, 7)]
+AGENT_MAX_FANOUT = int(os.getenv("AGENT_MAX_FANOUT", "6"))  # image agents running at once in agents mode
 
-parallel_image_agent = ParallelAgent(
-    name="ParallelImageGenerator",
-    sub_agents=step_image_generators,
-    description="Generate images in parallel for individual steps from the array"
-)
+def create_image_stage(step_count: int, max_fanout: int = AGENT_MAX_FANOUT):
+    """
+    One image agent per step, 1..step_count. Up to `max_fanout` run in parallel;
+    longer lessons run as consecutive parallel chunks, so no step is ever dropped.
+    """
+    generators = [create_step_image_generator(i) for i in range(1, step_count + 1)]
+    chunks = [
+        ParallelAgent(
+            name=f"ParallelImageGenerator_{start + 1}",
+            sub_agents=generators[start:start + max_fanout],
+            description="Generate images in parallel for individual steps from the array"
+        )
+        for start in range(0, step_count, max_fanout)
+    ]
+    if len(chunks) == 1:
+        return chunks[0]
+    return SequentialAgent(
+        name="ChunkedImageGenerator",
+        sub_agents=chunks,
+        description=f"Generates step images {max_fanout} at a time."
+    )
 
-sequential_pipeline = SequentialAgent(
+# For `adk web` / `adk run`, which need one fixed tree. The server sizes the image
+# stage from the real step count instead (see AgentPipeline).
+root_agent = SequentialAgent(
     name="PipelineAgent",
-    sub_agents=[steps_agent, parallel_image_agent],
+    sub_agents=[create_steps_agent(), create_image_stage(AGENT_MAX_FANOUT)],
     description="Runs steps agent, then generates images in parallel for each step."
 )
 
-root_agent = sequential_pipeline
+# Sent as the user turn of the image stage; the steps themselves are already in the session history
+IMAGE_STAGE_MESSAGE = Content(parts=[Part(text="Generate the image for your step.")])
 
-async def main(topic, description, level):
-    app_name = "PipelineApp"
-    user_id = "blake"
-    session_service = InMemorySessionService()
+# --- Long-lived ADK pipeline ---
+PIPELINE_SESSION_TTL = int(os.getenv("PIPELINE_SESSION_TTL", "900"))   # seconds before a leftover session is evicted
+PIPELINE_SESSION_MAX = int(os.getenv("PIPELINE_SESSION_MAX", "64"))    # leftover sessions kept at most (oldest evicted first)
 
-    # 1. Setup Session
-    session = await session_service.create_session(
-        app_name=app_name,
-        user_id=user_id
-    )
+class AgentPipeline:
+    """
+    Runners and one session service shared by the runs on one event loop (see
+    get_agent_pipeline): `steps_runner` for the steps agent, then image_runner(n) for
+    a lesson with n steps, built once per step count. Each run gets its own
+    lightweight session, open from open_session() until close_session(). A session
+    whose delete failed is left behind and evicted once it outlives
+    PIPELINE_SESSION_TTL or PIPELINE_SESSION_MAX newer leftovers exist, so memory
+    stays flat under load; open sessions are never evicted.
+    """
+
+    def __init__(
+        self,
+        app_name: str = "PipelineApp",
+        max_sessions: int = PIPELINE_SESSION_MAX,
+        ttl: int = PIPELINE_SESSION_TTL,
+        max_fanout: int = AGENT_MAX_FANOUT,
+    ):
+        self.app_name = app_name
+        self.session_service = InMemorySessionService()
+        self.steps_runner = Runner(app_name=app_name, agent=create_steps_agent(), session_service=self.session_service)
+        self._max_fanout = max_fanout
+        self._image_runners: Dict[int, Runner] = {}
+        self._max_sessions = max_sessions
+        self._ttl = ttl
+        # (user_id, session_id) -> created_at, oldest first; `_open` are the ones still in use
+        self._sessions: "OrderedDict[Tuple[str, str], float]" = OrderedDict()
+        self._open: Set[Tuple[str, str]] = set()
+        self._lock = threading.Lock()
+
+    async def open_session(self, user_id: str, state: Optional[Dict[str, Any]] = None):
+        await self._evict()
+        session = await self.session_service.create_session(
+            app_name=self.app_name,
+            user_id=user_id,
+            state=state
+        )
+        with self._lock:
+            self._sessions[(user_id, session.id)] = time.monotonic()
+            self._open.add((user_id, session.id))
+        return session
+
+    async def close_session(self, user_id: str, session_id: str) -> None:
+        key = (user_id, session_id)
+        with self._lock:
+            self._open.discard(key)
+        await self.session_service.delete_session(app_name=self.app_name, user_id=user_id, session_id=session_id)
+        with self._lock:
+            self._sessions.pop(key, None)
+
+    def image_runner(self, step_count: int) -> Runner:
+        with self._lock:
+            if step_count not in self._image_runners:
+                stage = create_image_stage(step_count, self._max_fanout)
+                self._image_runners[step_count] = Runner(app_name=self.app_name, agent=stage, session_service=self.session_service)
+            return self._image_runners[step_count]
+
+    async def get_state(self, user_id: str, session_id: str) -> Dict[str, Any]:
+        session = await self.session_service.get_session(app_name=self.app_name, user_id=user_id, session_id=session_id)
+        return session.state if session else {}
+
+    def session_count(self) -> int:
+        with self._lock:
+            return len(self._sessions)
+
+    async def _evict(self) -> None:
+        cutoff = time.monotonic() - self._ttl
+        with self._lock:
+            leftover = [key for key in self._sessions if key not in self._open]
+            stale = [key for key in leftover if self._sessions[key] < cutoff]
+            overflow = len(leftover) - len(stale) - (self._max_sessions - 1)
+            if overflow > 0:
+                stale += [key for key in leftover if key not in stale][:overflow]
+        for user_id, session_id in stale:
+            print(f"⚠️  Evicting abandoned pipeline session {session_id}")
+            try:
+                await self.close_session(user_id, session_id)
+            except Exception as e:
+                print(f"⚠️  Could not evict pipeline session {session_id}: {e}")
+
+# ADK agents cache their resolved Gemini model, and with it an async HTTP client
+# bound to the loop that first used it, so a pipeline never outlives its loop:
+# under asgi.py every job shares one, under server.py each job's asyncio.run
+# builds its own.
+_pipelines: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, AgentPipeline]" = weakref.WeakKeyDictionary()
+_pipelines_lock = threading.Lock()
+
+def get_agent_pipeline() -> AgentPipeline:
+    """The running event loop's pipeline, built on first use."""
+    loop = asyncio.get_running_loop()
+    with _pipelines_lock:
+        if loop not in _pipelines:
+            _pipelines[loop] = AgentPipeline()
+        return _pipelines[loop]
+
+class StepImageMismatchError(RuntimeError):
+    """The pipeline did not produce exactly one image for each generated step."""
+
+# "direct": one generate_steps call, then one generate_images call per parsed step (no extractor LLMs)
+# "agents": the steps agent plus a ParallelAgent image stage per request, kept for latency/token comparisons
+PIPELINE_MODE = os.getenv("PIPELINE_MODE", "direct")
+
+def _report(progress: Optional[Callable[..., None]], **fields) -> None:
+    # progress is the job's update callback (see jobs.Job.update); None when run standalone
+    if progress:
+        progress(**fields)
+
+def _emit(on_event: Optional[Callable[[Dict[str, Any]], None]], event_type: str, **fields) -> None:
+    # on_event is the job's emit callback (see jobs.Job.emit), feeding /lessonJobs/<id>/events
+    if on_event:
+        on_event({"type": event_type, **fields})
+
+async def _upload(upload: Callable[[List[bytes], str], Any], images: List[bytes], ext: str) -> List[Dict[str, Any]]:
+    # upload is SupabaseStore.upload_images (blocking, run in a thread) under Flask,
+    # or the coroutine AsyncSupabaseStore.upload_images on the ASGI server's own loop
+    if inspect.iscoroutinefunction(upload):
+        return await upload(images, ext)
+    return await asyncio.to_thread(upload, images, ext)
+
+async def _upload_variants(
+    upload: Callable[[List[bytes], str], Any],
+    images: List[bytes],
+) -> List[Tuple[Optional[str], Optional[str]]]:
+    """
+    Re-encode each PNG into a compressed full-size image and a thumbnail (see
+    imagevariants) and upload both. Returns (url, thumbnail_url) per image, in order.
+    """
+    with span("images.variants", images=len(images)):
+        variants = await make_variants_async(images)
+    results = await _upload(upload, [full for full, _ in variants] + [thumb for _, thumb in variants], IMAGE_VARIANT_FORMAT)
+    count = len(variants)
+    return [(results[i]["url"], results[count + i]["url"]) for i in range(count)]
 
-    runner = Runner(app_name=app_name, agent=root_agent, session_service=session_service)
+def _label_step(step_number: int, step: str) -> str:
+    # generate_images reads the "Step N." label to title the image
+    return step if step.lstrip().lower().startswith("step") else f"Step {step_number}. {step}"
 
+async def run_direct_pipeline(
+    topic,
+    description,
+    level,
+    upload: Callable[[List[bytes], str], Any],
+    progress: Optional[Callable[..., None]] = None,
+    on_event: Optional[Callable[[Dict[str, Any]], None]] = None,
+    use_image_cache: bool = True,
+    quality: bool = QUALITY_STAGE,
+) -> Tuple[List[str], List[Optional[str]], List[Optional[str]]]:
+    _report(progress, stage="generating_steps")
+    steps_array = await asyncio.to_thread(generate_steps, topic, description, level)
+    print(f"Total Steps Generated: {len(steps_array)}")
+    _report(progress, stage="generating_images", steps_generated=len(steps_array))
+    _emit(on_event, "steps", steps=steps_array)
+
+    images_done = 0
+    uploaded = 0
+    # Shared by every step so OPENAI_IMAGE_CONCURRENCY caps the whole lesson
+    semaphore = asyncio.Semaphore(IMAGE_CONCURRENCY)
+    image_cache = get_image_cache()
+    budget = QualityBudget() if quality else None  # one budget for the whole lesson
+
+    async def render(step_number: int, step: str) -> List[Tuple[Optional[str], Optional[str]]]:
+        nonlocal images_done, uploaded
+        prompt = _label_step(step_number, step)
+        cache_keys = image_cache_keys(prompt, step_number)
+        hit = image_cache.lookup(cache_keys) if use_image_cache else None
+        if hit:
+            print(f"⚡ Reusing cached image for step {step_number}")
+            step_urls = [(hit["url"], hit.get("thumbnail_url"))]
+            images_done += 1
+        else:
+            images = await generate_images_async([prompt], 1, semaphore=semaphore)
+            if budget and images:
+                images = [await refine_step_image(step_number, prompt, images[0], budget, semaphore)]
+            images_done += 1
+            _report(progress, images_done=images_done)
+            # Upload each step as soon as it is rendered so it can be streamed right away
+            step_urls = await _upload_variants(upload, images)
+            for url, thumbnail_url in step_urls:
+                if url and use_image_cache:
+                    image_cache.put(cache_keys, url, thumbnail_url)
+
+        uploaded += sum(1 for url, _ in step_urls if url)
+        _report(progress, images_done=images_done, uploaded=uploaded)
+        for url, thumbnail_url in step_urls:
+            _emit(on_event, "image", step_number=step_number, url=url, thumbnail_url=thumbnail_url)
+        return step_urls
+
+    # One task per actual step, however many the model produced
+    results = await asyncio.gather(*(render(i, step) for i, step in enumerate(steps_array, 1)))
+    empty = [i for i, urls in enumerate(results, 1) if not urls]
+    if not steps_array or empty:
+        raise StepImageMismatchError(f"Expected images for {len(steps_array)} steps, got none for steps {empty}")
+
+    image_urls = [urls[0][0] for urls in results]
+    thumbnail_urls = [urls[0][1] for urls in results]
+    print(f"✅ SUCCESS: Generated {len(image_urls)} images for {len(steps_array)} steps")
+    return steps_array, image_urls, thumbnail_urls
+
+@traced("agent.main")
+async def main(
+    topic,
+    description,
+    level,
+    upload: Callable[[List[bytes], str], Any],
+    progress: Optional[Callable[..., None]] = None,
+    mode: str = PIPELINE_MODE,
+    job_id: Optional[str] = None,
+    force_regenerate: bool = False,
+    on_event: Optional[Callable[[Dict[str, Any]], None]] = None,
+    quality: bool = QUALITY_STAGE,
+) -> Tuple[List[str], List[Optional[str]], List[Optional[str]]]:
+    """
+    Generate a lesson, re-encode each image into a full-size and a thumbnail variant,
+    and hand their bytes and extension to `upload` (e.g. SupabaseStore.upload_images),
+    which returns one {"url", "error", ...} result per image, in order.
+    Returns (steps, image_urls, thumbnail_urls) with None for images that failed to upload.
+    A lesson already generated for the same inputs and models is served from the
+    content cache unless `force_regenerate` is set.
+    `on_event` receives {"type": "steps", "steps"} as soon as the steps exist and
+    {"type": "image", "step_number", "url", "thumbnail_url"} as each image is uploaded.
+    With `quality`, each new image goes through the critique/re-render stage in
+    quality.py, within that module's per-lesson time and cost budgets.
+    Raises StepImageMismatchError if any step ends up without an image.
+    """
+    started = time.perf_counter()
+    cache_key = content_key(topic, description, level, STEPS_MODEL, IMAGE_MODEL)
+    if not force_regenerate:
+        cached = get_lesson_cache().get(cache_key)
+        if cached:
+            count = len(cached["steps"])
+            _report(progress, stage="cached", steps_generated=count, images_done=count, uploaded=count)
+            # Lessons cached before thumbnails existed have none
+            thumbnail_urls = cached.get("thumbnail_urls") or [None] * count
+            _emit(on_event, "steps", steps=cached["steps"])
+            for i, (url, thumbnail_url) in enumerate(zip(cached["image_urls"], thumbnail_urls), 1):
+                _emit(on_event, "image", step_number=i, url=url, thumbnail_url=thumbnail_url)
+            print(f"⚡ Served lesson from content cache in {(time.perf_counter() - started) * 1000:.0f}ms")
+            return cached["steps"], cached["image_urls"], thumbnail_urls
+
+    if mode == "direct":
+        steps_array, image_urls, thumbnail_urls = await run_direct_pipeline(
+            topic, description, level, upload, progress, on_event, use_image_cache=not force_regenerate, quality=quality,
+        )
+    elif mode == "agents":
+        # The agents' generate_images tool writes to disk, so give this job its own folder
+        with job_workspace(job_id) as workspace:
+            steps_array, step_images = await run_agent_pipeline(topic, description, level, progress, workspace, on_event, job_id)
+            saved_images = pop_step_images(step_images)
+
+        if quality:
+            _report(progress, stage="checking_images")
+            prompts = {n: _label_step(n, steps_array[n - 1]) for n in saved_images}
+            saved_images = await refine_images(prompts, saved_images)
+
+        # The tool only leaves files behind, so these upload together once the run ends
+        _report(progress, stage="uploading")
+        step_urls = await _upload_variants(upload, list(saved_images.values()))
+        image_urls = [url for url, _ in step_urls]
+        thumbnail_urls = [thumbnail_url for _, thumbnail_url in step_urls]
+        for step_number, (url, thumbnail_url) in zip(saved_images, step_urls):
+            _emit(on_event, "image", step_number=step_number, url=url, thumbnail_url=thumbnail_url)
+    else:
+        raise ValueError(f"Unknown PIPELINE_MODE {mode!r}, expected 'direct' or 'agents'")
+
+    uploaded = sum(1 for url in image_urls if url)
+    _report(progress, uploaded=uploaded)
+    if uploaded < len(image_urls):
+        print(f"⚠️  {len(image_urls) - uploaded} of {len(image_urls)} images failed to upload")
+    elif steps_array and uploaded == len(steps_array):
+        # Only cache complete lessons, so a partial failure is retried next time
+        get_lesson_cache().put(cache_key, {"steps": steps_array, "image_urls": image_urls, "thumbnail_urls": thumbnail_urls})
+
+    print(f"⏱️  {mode} pipeline finished in {time.perf_counter() - started:.1f}s")
+    return steps_array, image_urls, thumbnail_urls
+
+async def run_agent_pipeline(
+    topic,
+    description,
+    level,
+    progress: Optional[Callable[..., None]] = None,
+    workspace: Optional[str] = None,
+    on_event: Optional[Callable[[Dict[str, Any]], None]] = None,
+    job_id: Optional[str] = None,
+) -> Tuple[List[str], Dict[int, StepImage]]:
+    """
+    Run the ADK pipeline and return (steps, {step_number: StepImage}) as recorded
+    by the tools in the session state. Raises StepImageMismatchError unless every
+    step 1..N has an image.
+    """
+    pipeline = get_agent_pipeline()
+    user_id = f"job_{job_id or uuid.uuid4().hex}"
+
+    # 1. Setup Session (generate_images reads its save folder from the state)
+    session = await pipeline.open_session(user_id, state={STATE_WORKSPACE: workspace} if workspace else None)
+    try:
+        return await _run_session(pipeline, user_id, session.id, topic, description, level, progress, on_event)
+    finally:
+        await pipeline.close_session(user_id, session.id)
+
+async def _run_session(
+    pipeline: AgentPipeline,
+    user_id: str,
+    session_id: str,
+    topic: str,
+    description: str,
+    level: str,
+    progress: Optional[Callable[..., None]],
+    on_event: Optional[Callable[[Dict[str, Any]], None]],
+) -> Tuple[List[str], Dict[int, StepImage]]:
     # 2. Prepare Input
     payload = {
         "task": topic,
@@ -96,116 +429,78 @@ async def main(topic, description, level):
     }
     user_msg = Content(parts=[Part(text=str(payload))])
 
-    # --- Result Collection Variables ---
-    generated_image_paths = []
-    
-    # 3. Run the Pipeline and Collect Events
+    # 3. Run the steps agent, then an image stage sized to the steps it produced,
+    # so a lesson costs one image agent per real step and none are dropped.
     print("Starting pipeline execution...")
+    _report(progress, stage="generating_steps")
+    with span("adk.run_agents") as stage:
+        await _run_agents(pipeline.steps_runner, user_id, session_id, user_msg, stage, progress, on_event)
+        steps_array: List[str] = (await pipeline.get_state(user_id, session_id)).get(STATE_STEPS) or []
+        if steps_array:
+            image_runner = pipeline.image_runner(len(steps_array))
+            await _run_agents(image_runner, user_id, session_id, IMAGE_STAGE_MESSAGE, stage, progress, on_event)
+
+    # 4. Retrieve Final State (run_agent_pipeline drops the session, whether or not this succeeded)
+    state = await pipeline.get_state(user_id, session_id)
+
+    step_images: Dict[int, StepImage] = {
+        record["step_number"]: record
+        for key, record in state.items()
+        if key.startswith(STATE_STEP_IMAGE_PREFIX)
+    }
+    _check_step_images(steps_array, step_images)
+    print(f"✅ SUCCESS: Generated {len(step_images)} images for {len(steps_array)} steps")
+    return steps_array, step_images
+
+async def _run_agents(
+    runner: Runner,
+    user_id: str,
+    session_id: str,
+    message: Content,
+    stage: Span,
+    progress: Optional[Callable[..., None]],
+    on_event: Optional[Callable[[Dict[str, Any]], None]],
+) -> None:
+    # The tools record typed results in the session state,
+    # so events are only watched for progress, never parsed for results.
+    images_done = 0
     async for event in runner.run_async(
         user_id=user_id,
-        session_id=session.id,
-        new_message=user_msg
+        session_id=session_id,
+        new_message=message
     ):
-        # Debug: Print all events to see what's happening
-        print(f"Event: {event.author} | Branch: {event.branch} | Finish: {getattr(event, 'finish_reason', 'N/A')}")
-        
-        # Safely extract content
-        result_content = None
-        if hasattr(event, 'content') and event.content:
-            if hasattr(event.content, 'parts') and event.content.parts:
-                # Look for text in the parts
-                for part in event.content.parts:
-                    if hasattr(part, 'text') and part.text:
-                        result_content = part.text
-                        print(f"Content: {result_content[:100]}...")
-                        break
-            elif hasattr(event.content, 'text') and event.content.text:
-                # Direct text access
-                result_content = event.content.text
-                print(f"Content (direct): {result_content[:100]}...")
-
-        # Check for successful final output from step image generators
-        # Look for function response events instead of direct agent responses
-        if (
-            event.branch and 
-            event.author and event.author.startswith('step_image_generator_') and 
-            getattr(event, 'finish_reason', None) == 'STOP'
-        ):
-            # Check if this is a function call response (the actual image generation result)
-            if hasattr(event, 'content') and event.content and hasattr(event.content, 'parts'):
-                for part in event.content.parts:
-                    # Look for function response parts that contain the generated image paths
-                    if hasattr(part, 'function_response') and part.function_response:
-                        try:
-                            # Extract the result from the function response
-                            if hasattr(part.function_response, 'response'):
-                                result_data = part.function_response.response
-                                if isinstance(result_data, list):
-                                    generated_image_paths.extend(result_data)
-                                    print(f"✅ Collected image paths from {event.author}: {result_data}")
-                                elif isinstance(result_data, str):
-                                    # Sometimes the result might be a JSON string
-                                    try:
-                                        paths = json.loads(result_data)
-                                        generated_image_paths.extend(paths)
-                                        print(f"✅ Collected image paths from {event.author}: {paths}")
-                                    except:
-                                        print(f"⚠️  Couldn't parse result from {event.author}: {result_data}")
-                        except Exception as e:
-                            print(f"❌ Error extracting function response from {event.author}: {e}")
-            
-            # If no function response found, this might be the function call itself
-            if result_content:
-                try:
-                    paths = json.loads(result_content)
-                    generated_image_paths.extend(paths)
-                    print(f"✅ Collected image paths from {event.author}: {paths}")
-                except json.JSONDecodeError as e:
-                    print(f"❌ Error parsing JSON from {event.author}: {e}")
-                    print(f"Raw content: {result_content}")
-                except Exception as e:
-                    print(f"❌ Unexpected error from {event.author}: {e}")
-            else:
-                print(f"⚠️  Function call detected from {event.author}, waiting for function response...")
-
-    # 4. Retrieve Final State
-    state = await session_service.get_session(
-        app_name=app_name,
-        user_id=user_id,
-        session_id=session.id
-    )
-    
-    saved_steps_str = state.state.get("steps")
-
-    # 5. Print Final Results
-    print("\n" + "="*50)
-    print("--- Final Results ---")
-    print("="*50)
-    
-    if saved_steps_str:
-        steps_array = json.loads(saved_steps_str)
-        print(f"Total Steps Generated: {len(steps_array)}")
-        for i, step in enumerate(steps_array, 1):
-            print(f"  Step {i}: {step}")
-    else:
-        print("No steps found in state")
-    
-    print(f"\n--- Generated Images ---")
-    print(f"Total Images Collected: {len(generated_image_paths)}")
-    for i, path in enumerate(generated_image_paths, 1):
-        print(f"  Image {i}: {path}")
-
-    # Check if we have the right number of images
-    if saved_steps_str:
-        expected_images = len(json.loads(saved_steps_str))
-        actual_images = len(generated_image_paths)
-        if actual_images == expected_images:
-            print(f"✅ SUCCESS: Generated {actual_images} images for {expected_images} steps")
-        else:
-            print(f"⚠️  MISMATCH: Expected {expected_images} images, got {actual_images}")
-    
-    return steps_array if saved_steps_str else []
+        # Tokens spent by the agents' own LLM calls; the tools count theirs in their own spans
+        if event.usage_metadata:
+            stage.add(
+                input_tokens=event.usage_metadata.prompt_token_count,
+                output_tokens=event.usage_metadata.candidates_token_count,
+            )
+        state_delta = event.actions.state_delta if event.actions else {}
+        if STATE_STEPS in state_delta:
+            streamed_steps = state_delta[STATE_STEPS]
+            _report(progress, stage="generating_images", steps_generated=len(streamed_steps))
+            _emit(on_event, "steps", steps=streamed_steps)
+        rendered = sum(1 for key in state_delta if key.startswith(STATE_STEP_IMAGE_PREFIX))
+        if rendered:
+            images_done += rendered
+            _report(progress, images_done=images_done)
+
+def _check_step_images(steps_array: List[str], step_images: Dict[int, StepImage]) -> None:
+    # Exactly one rendered step per generated step, numbered 1..N, or the lesson is unusable
+    expected = set(range(1, len(steps_array) + 1))
+    rendered = {n for n, record in step_images.items() if record["paths"]}
+    if not steps_array or rendered != expected:
+        missing = sorted(expected - rendered)
+        unexpected = sorted(rendered - expected)
+        raise StepImageMismatchError(
+            f"Expected images for {len(steps_array)} steps, got {len(rendered)} "
+            f"(missing {missing}, unexpected {unexpected})"
+        )
 
 
 if __name__ == "__main__":
-    asyncio.run(main("algebra", "basic algebraic operations", "high school student"))
\ No newline at end of file
+    # python -m multi_tool_agent.agent [direct|agents]
+    mode = sys.argv[1] if len(sys.argv) > 1 else PIPELINE_MODE
+    # Standalone runs skip storage and just report the image sizes
+    upload = lambda images, ext: [{"url": f"<{len(image)} byte {ext}>", "error": None} for image in images]
+    asyncio.run(main("algebra", "basic algebraic operations", "high school student", upload=upload, mode=mode))
\ No newline at end of file
@@ -0,0 +1,168 @@
+# Persistent, content-addressed caches for generated lesson content.
+# Entries live in a local SQLite file keyed by a hash of the normalized
+# generation inputs, so a repeated request costs no tokens and no renders.
+
+import os
+import re
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+from functools import lru_cache
+from typing import Any, Dict, Optional, Tuple
+from dotenv import load_dotenv
+
+from .workspace import BACKEND_DIR
+
+load_dotenv()
+
+CONTENT_CACHE_PATH = os.getenv("CONTENT_CACHE_PATH", os.path.join(BACKEND_DIR, "content_cache.sqlite3"))
+LESSON_CACHE_MAX_ENTRIES = int(os.getenv("LESSON_CONTENT_CACHE_MAX_ENTRIES", "500"))
+LESSON_CACHE_MAX_AGE = int(os.getenv("LESSON_CONTENT_CACHE_MAX_AGE_DAYS", "30")) * 86400
+IMAGE_CACHE_MAX_ENTRIES = int(os.getenv("IMAGE_CACHE_MAX_ENTRIES", "5000"))
+IMAGE_CACHE_MAX_AGE = int(os.getenv("IMAGE_CACHE_MAX_AGE_DAYS", "30")) * 86400
+IMAGE_CACHE_SIMILARITY = os.getenv("IMAGE_CACHE_SIMILARITY", "1") == "1"  # match near-identical step text too
+
+
+def normalize(text: str) -> str:
+    return " ".join(str(text).lower().split())
+
+
+def content_key(*parts: Any) -> str:
+    """sha256 over the normalized parts, e.g. content_key(topic, description, level, model)."""
+    raw = json.dumps([normalize(part) for part in parts])
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+# A leading "Step 2.", "Step 2" or "2." / "2)" label; a bare number has to be followed
+# by its separator and a space so "3/4 + 1/4" or "2.5 - x" keep their first term
+_STEP_LABEL = re.compile(r"^\s*(?:step\s*\d+\s*[.:)]?|\d+[.:)])(?:\s+|$)", re.IGNORECASE)
+
+
+def similarity_text(step: str) -> str:
+    """
+    Step text without its "Step N." label and without case or whitespace
+    differences. Operators, digits and punctuation are kept: in a math step they
+    are the content. The step number itself is kept separately because it is
+    drawn as the image header.
+    """
+    return normalize(_STEP_LABEL.sub("", str(step), count=1))
+
+
+class ContentStore:
+    """
+    One SQLite table of key -> JSON value. Evicts least recently used rows once
+    there are more than `max_entries`, and rows older than `max_age` seconds.
+    Safe to share between threads and between processes using the same file.
+    """
+
+    def __init__(self, table: str, max_entries: int, max_age: int, path: str = CONTENT_CACHE_PATH):
+        self.table = table
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            f"CREATE TABLE IF NOT EXISTS {table} ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL, last_used REAL NOT NULL)"
+        )
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                f"SELECT value FROM {self.table} WHERE key = ? AND created_at >= ?",
+                (key, now - self.max_age),
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._db.execute(f"UPDATE {self.table} SET last_used = ? WHERE key = ?", (now, key))
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, key: str, value: Dict[str, Any]) -> None:
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, created_at, last_used) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), now, now),
+            )
+            self._evict(now)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._db.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            (entries,) = self._db.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()
+        return {"hits": self.hits, "misses": self.misses, "entries": entries}
+
+    def _evict(self, now: float) -> None:
+        self._db.execute(f"DELETE FROM {self.table} WHERE created_at < ?", (now - self.max_age,))
+        self._db.execute(
+            f"DELETE FROM {self.table} WHERE key NOT IN "
+            f"(SELECT key FROM {self.table} ORDER BY last_used DESC LIMIT ?)",
+            (self.max_entries,),
+        )
+
+
+@lru_cache(maxsize=None)
+def get_lesson_cache() -> ContentStore:
+    """
+    Finished lessons, {"steps": [...], "image_urls": [...], "thumbnail_urls": [...]},
+    keyed by content_key(topic, description, level, models).
+    """
+    return ContentStore("lessons", LESSON_CACHE_MAX_ENTRIES, LESSON_CACHE_MAX_AGE)
+
+
+class ImageCache:
+    """
+    Uploaded step images: {"url", "thumbnail_url"} keyed by the exact enhanced-prompt hash,
+    plus an optional similarity key (see similarity_text) so steps that differ
+    only by their label, case or whitespace reuse the same render.
+    """
+
+    def __init__(self, store: ContentStore, similarity: bool = IMAGE_CACHE_SIMILARITY):
+        self.store = store
+        self.similarity = similarity
+        self.exact_hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def lookup(self, keys: Tuple[str, str]) -> Optional[Dict[str, Optional[str]]]:
+        exact_key, similar_key = keys
+        hit = self.store.get(f"exact:{exact_key}")
+        counter = "exact_hits"
+        if hit is None and self.similarity:
+            hit = self.store.get(f"similar:{similar_key}")
+            counter = "similar_hits"
+        with self._lock:
+            if hit is None:
+                self.misses += 1
+                return None
+            setattr(self, counter, getattr(self, counter) + 1)
+        return hit
+
+    def put(self, keys: Tuple[str, str], url: str, thumbnail_url: Optional[str] = None) -> None:
+        exact_key, similar_key = keys
+        entry = {"url": url, "thumbnail_url": thumbnail_url}
+        self.store.put(f"exact:{exact_key}", entry)
+        if self.similarity:
+            self.store.put(f"similar:{similar_key}", entry)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            counters = {"exact_hits": self.exact_hits, "similar_hits": self.similar_hits, "misses": self.misses}
+        return {**counters, "entries": self.store.stats()["entries"]}
+
+
+@lru_cache(maxsize=None)
+def get_image_cache() -> ImageCache:
+    return ImageCache(ContentStore("images", IMAGE_CACHE_MAX_ENTRIES, IMAGE_CACHE_MAX_AGE))
@@ -1,39 +1,154 @@
 # generatesimages.py - FIXED
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI, APIConnectionError, InternalServerError, RateLimitError
 from dotenv import load_dotenv
 import os
+import re
 import base64
-from typing import List, Optional
+import random
+import asyncio
+import weakref
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple, TypedDict
 import time
 import hashlib
+from google.adk.tools.tool_context import ToolContext
+from .workspace import GENERATED_DIR, STATE_WORKSPACE, step_image_key
+from .content_cache import content_key, similarity_text
+from .tracing import Span, span
 
 # Load environment variables from .env
 load_dotenv()
 
-API_KEY = os.getenv("OPENAI_API_KEY")
-if not API_KEY:
-    raise ValueError("No OPENAI_API key found in .env or environment")
 
-client = OpenAI(api_key=API_KEY)
+def _api_key() -> str:
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        raise ValueError("No OPENAI_API key found in .env or environment")
+    return api_key
+
+
+@lru_cache(maxsize=None)
+def get_client() -> OpenAI:
+    # Built on first use so importing this module never needs a key or the network
+    return OpenAI(api_key=_api_key(), timeout=IMAGE_TIMEOUT)
+
+# --- Async generation settings ---
+IMAGE_CONCURRENCY = int(os.getenv("OPENAI_IMAGE_CONCURRENCY", "4"))    # in-flight gpt-image-1 requests per lesson
+IMAGE_MAX_RETRIES = int(os.getenv("OPENAI_IMAGE_MAX_RETRIES", "4"))    # retries after a 429, 5xx, timeout or connection error
+IMAGE_TIMEOUT = float(os.getenv("OPENAI_IMAGE_TIMEOUT", "180"))        # seconds per request; gpt-image-1 often takes a minute
+IMAGE_BACKOFF_BASE = float(os.getenv("OPENAI_IMAGE_BACKOFF_BASE", "1.0"))
+IMAGE_BACKOFF_MAX = float(os.getenv("OPENAI_IMAGE_BACKOFF_MAX", "20.0"))
+
+# Errors worth another attempt: 429s, 5xx responses, timeouts (a subclass of
+# APIConnectionError) and dropped connections. Anything else is the request's fault.
+_RETRYABLE = (RateLimitError, InternalServerError, APIConnectionError)
+
+# AsyncOpenAI's connection pool belongs to the event loop it was first used on,
+# and every lesson job runs its own loop, so keep one client per loop.
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, AsyncOpenAI]" = weakref.WeakKeyDictionary()
+
+class StepImage(TypedDict):
+    """What generate_images records in the session state for each step it renders."""
+    step_number: int
+    paths: List[str]
+
+IMAGE_MODEL: str = "gpt-image-1"
+SIZE: str = "1024x1024"
+SAVE_DIR: str = GENERATED_DIR  # used when no job workspace is set in the session state
+
+
+def _get_async_client() -> AsyncOpenAI:
+    loop = asyncio.get_running_loop()
+    if loop not in _async_clients:
+        # Transient errors are retried below, where the backoff happens outside the semaphore
+        _async_clients[loop] = AsyncOpenAI(api_key=_api_key(), max_retries=0, timeout=IMAGE_TIMEOUT)
+    return _async_clients[loop]
+
+
+def _extract_step_number(original_prompt: str, fallback: int) -> int:
+    # Try multiple regex patterns to catch different formats
+    patterns = [
+        r'Step (\d+)\.',           # "Step 1."
+        r'Step (\d+):',            # "Step 1:"
+        r'Step (\d+)\s',           # "Step 1 "
+        r'(\d+)\.',                # Just "1." at the start
+    ]
+
+    for pattern in patterns:
+        step_match = re.search(pattern, original_prompt)
+        if step_match:
+            return int(step_match.group(1))
+
+    # Fallback if no step number found
+    return fallback
+
+
+def _enhance_prompt(original_prompt: str, extracted_step_num: int) -> str:
+    # Enhance the prompt to REQUIRE step number text in the image
+    return (
+        f"IMPORTANT: You MUST include the exact text 'Step {extracted_step_num}' prominently at the top of the image in large, bold, readable text. "
+        f"Create a clear educational illustration that shows 'Step {extracted_step_num}' as a header. "
+        f"Below that header, create a visual representation of: {original_prompt}. "
+        f"The image should be educational, clean, and suitable for a high school algebra student. "
+        f"Make sure 'Step {extracted_step_num}' is the most prominent text element in the image, clearly visible and easy to read. "
+        f"Use a clean, educational design with good contrast so the step number stands out."
+    )
+
+
+def image_cache_keys(original_prompt: str, fallback: int) -> Tuple[str, str]:
+    """(exact, similar) keys for content_cache.ImageCache: the rendered prompt, model and size."""
+    extracted_step_num = _extract_step_number(original_prompt, fallback)
+    exact = hashlib.sha256(f"{IMAGE_MODEL}|{SIZE}|{_enhance_prompt(original_prompt, extracted_step_num)}".encode()).hexdigest()
+    similar = content_key(IMAGE_MODEL, SIZE, extracted_step_num, similarity_text(original_prompt))
+    return exact, similar
+
+
+def _count_response(stage: Span, response) -> None:
+    stage.add(images=len(response.data or []))
+    usage = getattr(response, "usage", None)  # gpt-image-1 reports token usage, older models don't
+    if usage:
+        stage.add(input_tokens=usage.input_tokens, output_tokens=usage.output_tokens)
+
+
+def _decode_images(response) -> List[bytes]:
+    # b64_json is decoded straight into memory, nothing touches the filesystem
+    return [base64.b64decode(img.b64_json) for img in response.data if img.b64_json]
+
+
+def _save_images(response, extracted_step_num: int, timestamp: int, save_dir: str) -> List[str]:
+    generated_files = []
+    for idx, img in enumerate(response.data):
+        # Decode and save with regex-based naming convention
+        if img.b64_json:
+            img_bytes = base64.b64decode(img.b64_json)
+
+            # Create clean filename using regex-extracted step number
+            # Format: step_##_timestamp_imagenum.png (zero-padded for sorting)
+            file_path = os.path.join(save_dir, f"step_{extracted_step_num:02d}_{timestamp}_{idx+1}.png")
+
+            with open(file_path, "wb") as f:
+                f.write(img_bytes)
+            generated_files.append(file_path)
+            print(f"✅ Saved image: {file_path}")
+    return generated_files
 
 
 def generate_images(
     prompts: List[str], # Required: This is the only parameter the LLM agent will supply
-    n_images: int       # Required: The LLM agent MUST supply this value (e.g., 1)
+    n_images: int,      # Required: The LLM agent MUST supply this value (e.g., 1)
+    tool_context: Optional[ToolContext] = None,  # Injected by ADK, never seen by the LLM
 ) -> List[str]:
     """
     Generate images using gpt-image-1, save locally, and return file paths.
     
     The ADK forces the agent to explicitly call this with prompts (the steps)
     and n_images (the desired number of images per step).
+    Files go to the job workspace stored in the session state, if there is one,
+    and each step's files are recorded there as a StepImage under step_image_key(n).
     """
-    
-    # --- FIXED PARAMETERS (Hardcoded to avoid ADK Validation Error) ---
-    SIZE: str = "1024x1024"
-    SAVE_DIR: str = "generated_images"
-    # -----------------------------------------------------------------
 
-    os.makedirs(SAVE_DIR, exist_ok=True)
+    save_dir = (tool_context.state.get(STATE_WORKSPACE) if tool_context else None) or SAVE_DIR
+    os.makedirs(save_dir, exist_ok=True)
     generated_files = []
 
     # Create a unique identifier for this batch to avoid overwrites
@@ -43,68 +158,109 @@ def generate_images(
     # calls this function with prompts=[single_step] and n_images=X.
     for i, original_prompt in enumerate(prompts):
         print(f"Generating {n_images} image(s) for step: {original_prompt[:100]}...")
-        
-        # Extract step number using regex - more robust approach
-        import re
-        
-        # Try multiple regex patterns to catch different formats
-        patterns = [
-            r'Step (\d+)\.',           # "Step 1."
-            r'Step (\d+):',            # "Step 1:"
-            r'Step (\d+)\s',           # "Step 1 "
-            r'(\d+)\.',                # Just "1." at the start
-        ]
-        
-        extracted_step_num = None
-        for pattern in patterns:
-            step_match = re.search(pattern, original_prompt)
-            if step_match:
-                extracted_step_num = int(step_match.group(1))
-                break
-        
-        # Fallback if no step number found
-        if extracted_step_num is None:
-            extracted_step_num = i + 1
-        
+
+        extracted_step_num = _extract_step_number(original_prompt, i + 1)
         print(f"Detected step number: {extracted_step_num}")
-        
-        # Enhance the prompt to REQUIRE step number text in the image
-        enhanced_prompt = (
-            f"IMPORTANT: You MUST include the exact text 'Step {extracted_step_num}' prominently at the top of the image in large, bold, readable text. "
-            f"Create a clear educational illustration that shows 'Step {extracted_step_num}' as a header. "
-            f"Below that header, create a visual representation of: {original_prompt}. "
-            f"The image should be educational, clean, and suitable for a high school algebra student. "
-            f"Make sure 'Step {extracted_step_num}' is the most prominent text element in the image, clearly visible and easy to read. "
-            f"Use a clean, educational design with good contrast so the step number stands out."
-        )
 
+        enhanced_prompt = _enhance_prompt(original_prompt, extracted_step_num)
         print(f"Enhanced prompt: {enhanced_prompt[:150]}...")
 
         # Call the OpenAI API once, asking for 'n_images' at the same time
-        response = client.images.generate(
-            model="gpt-image-1",
-            prompt=enhanced_prompt,
-            size=SIZE,
-            n=n_images # Use the value supplied by the agent
-        )
-
-        for idx, img in enumerate(response.data):
-            # Decode and save with regex-based naming convention
-            if img.b64_json:
-                img_bytes = base64.b64decode(img.b64_json)
-                
-                # Create clean filename using regex-extracted step number
-                # Format: step_##_timestamp_imagenum.png (zero-padded for sorting)
-                file_path = os.path.join(SAVE_DIR, f"step_{extracted_step_num:02d}_{timestamp}_{idx+1}.png")
-                
-                with open(file_path, "wb") as f:
-                    f.write(img_bytes)
-                generated_files.append(file_path)
-                print(f"✅ Saved image: {file_path}")
+        with span("openai.images_generate") as stage:
+            response = get_client().images.generate(
+                model=IMAGE_MODEL,
+                prompt=enhanced_prompt,
+                size=SIZE,
+                n=n_images # Use the value supplied by the agent
+            )
+            _count_response(stage, response)
+
+        with span("images.decode_save"):
+            step_files = _save_images(response, extracted_step_num, timestamp, save_dir)
+        generated_files.extend(step_files)
+        if tool_context:
+            record: StepImage = {"step_number": extracted_step_num, "paths": step_files}
+            tool_context.state[step_image_key(extracted_step_num)] = record
 
     return generated_files
 
 
+async def _generate_with_backoff(enhanced_prompt: str, n_images: int, semaphore: asyncio.Semaphore):
+    with span("openai.images_generate") as stage:
+        return await _generate_with_retries(enhanced_prompt, n_images, semaphore, stage)
+
+
+async def _generate_with_retries(enhanced_prompt: str, n_images: int, semaphore: asyncio.Semaphore, stage: Span):
+    async_client = _get_async_client()
+    for attempt in range(IMAGE_MAX_RETRIES + 1):
+        async with semaphore:
+            try:
+                response = await async_client.images.generate(
+                    model=IMAGE_MODEL,
+                    prompt=enhanced_prompt,
+                    size=SIZE,
+                    n=n_images,
+                )
+                _count_response(stage, response)
+                return response
+            except _RETRYABLE as e:
+                if attempt == IMAGE_MAX_RETRIES:
+                    raise
+                response = getattr(e, "response", None)  # connection errors have none
+                retry_after = response.headers.get("retry-after") if response is not None else None
+                reason = "Rate limited by" if isinstance(e, RateLimitError) else f"{type(e).__name__} from"
+        # Back off outside the semaphore so other steps can use the slot meanwhile.
+        # Full jitter keeps retries from concurrent lessons from lining up again.
+        ceiling = min(IMAGE_BACKOFF_MAX, IMAGE_BACKOFF_BASE * 2 ** attempt)
+        delay = random.uniform(0, ceiling)
+        try:
+            delay = max(delay, float(retry_after)) if retry_after else delay
+        except ValueError:
+            pass
+        print(f"⚠️  {reason} gpt-image-1, retrying in {delay:.1f}s (attempt {attempt + 1}/{IMAGE_MAX_RETRIES})")
+        stage.add(retries=1)
+        await asyncio.sleep(delay)
+
+
+async def generate_images_async(
+    prompts: List[str],
+    n_images: int,
+    semaphore: Optional[asyncio.Semaphore] = None,
+) -> List[bytes]:
+    """
+    Async, in-memory variant of generate_images: every prompt is requested
+    concurrently and the decoded PNG bytes are returned instead of file paths.
+    Pass a shared `semaphore` to cap in-flight requests across several calls,
+    otherwise one sized by OPENAI_IMAGE_CONCURRENCY is used for this call.
+    """
+    semaphore = semaphore or asyncio.Semaphore(IMAGE_CONCURRENCY)
+
+    async def render(i: int, original_prompt: str) -> List[bytes]:
+        extracted_step_num = _extract_step_number(original_prompt, i + 1)
+        print(f"Generating {n_images} image(s) for step {extracted_step_num}: {original_prompt[:100]}...")
+        response = await _generate_with_backoff(_enhance_prompt(original_prompt, extracted_step_num), n_images, semaphore)
+        with span("images.decode"):
+            return _decode_images(response)
+
+    results = await asyncio.gather(*(render(i, prompt) for i, prompt in enumerate(prompts)))
+    return [image for images in results for image in images]
+
+
+def pop_step_images(step_images: Dict[int, StepImage]) -> Dict[int, bytes]:
+    """
+    Read back and delete the PNGs generate_images recorded for each step,
+    keeping the first image of every step, ordered by step number.
+    """
+    images = {}
+    for step_number in sorted(step_images):
+        paths = step_images[step_number]["paths"]
+        with open(paths[0], "rb") as f:
+            images[step_number] = f.read()
+        for path in paths:
+            os.remove(path)
+    return images
+
+
 if __name__ == "__main__":
     sentences = [
         "A highly detailed, photorealistic image of a futuristic train arriving at a misty, neon-lit station.",
@@ -113,4 +269,4 @@ if __name__ == "__main__":
     images = generate_images(sentences, n_images=3)
 
     for path in images:
-        print(path)
\ No newline at end of file
+        print(path)
@@ -2,12 +2,30 @@
 from google import genai
 from google.genai import types
 from dotenv import load_dotenv
+from functools import lru_cache
+from typing import Optional
+from google.adk.tools.tool_context import ToolContext
+from .workspace import STATE_STEPS
+from .tracing import span
 import os, json
 
 load_dotenv()
-client = genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
 
-def generate_steps(task: str, values: str, student: str) -> list[str]:
+STEPS_MODEL = "gemini-2.5-flash"
+
+
+@lru_cache(maxsize=None)
+def get_client() -> genai.Client:
+    # Built on first use so importing this module never needs a key or the network
+    return genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
+
+
+def generate_steps(
+    task: str,
+    values: str,
+    student: str,
+    tool_context: Optional[ToolContext] = None,  # Injected by ADK, never seen by the LLM
+) -> list[str]:
     prompt = (
         f"Create a step-by-step plan to solve a problem relating to {task} using {values}. "
         f"Write it so a {student} can understand it. "
@@ -16,24 +34,32 @@ def generate_steps(task: str, values: str, student: str) -> list[str]:
         "\"Step 1.\", \"Step 2.\", etc."
     )
 
-    resp = client.models.generate_content(
-        model="gemini-2.5-flash",
-        contents=prompt,
-        config=types.GenerateContentConfig(
-            response_mime_type="application/json",
-            response_schema={
-                "type": "object",
-                "properties": {"steps": {"type": "array", "items": {"type": "string"}}},
-                "required": ["steps"],
-            },
-        ),
-    )
+    with span("gemini.generate_steps") as stage:
+        resp = get_client().models.generate_content(
+            model=STEPS_MODEL,
+            contents=prompt,
+            config=types.GenerateContentConfig(
+                response_mime_type="application/json",
+                response_schema={
+                    "type": "object",
+                    "properties": {"steps": {"type": "array", "items": {"type": "string"}}},
+                    "required": ["steps"],
+                },
+            ),
+        )
+        usage = resp.usage_metadata
+        if usage:
+            stage.add(input_tokens=usage.prompt_token_count, output_tokens=usage.candidates_token_count)
 
     data = json.loads(resp.text)
+    if tool_context:
+        # The pipeline reads the parsed list from state instead of re-parsing the agent's reply
+        tool_context.state[STATE_STEPS] = data["steps"]
     return data["steps"]  # <- this is just the array of strings
 
 
-result = generate_steps("algebra", "basic algebraic operations", "high school student")  #Example usage
-print(len(result))
-for i in result:
-    print(i)
+if __name__ == "__main__":
+    result = generate_steps("algebra", "basic algebraic operations", "high school student")  #Example usage
+    print(len(result))
+    for i in result:
+        print(i)
@@ -0,0 +1,84 @@
+# Post-processing between image generation and upload.
+# gpt-image-1 returns ~2 MB 1024x1024 PNGs; each one is re-encoded into a compressed
+# full-size variant and a small thumbnail before it is stored, so lesson pages
+# download a fraction of the bytes. Encoding is CPU-bound, so it runs in a process
+# pool instead of on the event loop (or the GIL of the web process).
+
+import io
+import os
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from typing import List, Tuple
+from dotenv import load_dotenv
+
+load_dotenv()
+
+IMAGE_VARIANT_FORMAT = os.getenv("IMAGE_VARIANT_FORMAT", "webp").lower()   # "webp" or "avif" (needs Pillow built with libavif)
+IMAGE_VARIANT_QUALITY = int(os.getenv("IMAGE_VARIANT_QUALITY", "80"))
+THUMBNAIL_SIZE = int(os.getenv("THUMBNAIL_SIZE", "320"))                   # longest side, pixels
+IMAGE_VARIANT_WORKERS = int(os.getenv("IMAGE_VARIANT_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+
+def make_variants(png: bytes, fmt: str, quality: int, thumbnail_size: int) -> Tuple[bytes, bytes]:
+    """(full-size, thumbnail) encodings of one PNG. Runs in a pool process."""
+    from PIL import Image  # only the pool processes need Pillow loaded
+
+    with Image.open(io.BytesIO(png)) as image:
+        image.load()
+        full = _encode(image, fmt, quality)
+        image.thumbnail((thumbnail_size, thumbnail_size))
+        thumbnail = _encode(image, fmt, quality)
+    return full, thumbnail
+
+
+def _encode(image, fmt: str, quality: int) -> bytes:
+    out = io.BytesIO()
+    image.save(out, format=fmt.upper(), quality=quality)
+    return out.getvalue()
+
+
+class UndecodableImage(ValueError):
+    """The bytes are not an image Pillow can read, as opposed to the pool itself failing."""
+
+
+def preview(png: bytes, size: int) -> Tuple[float, bytes]:
+    """
+    (grayscale contrast, small PNG) of one image for the quality stage. Runs in a
+    pool process. Raises UndecodableImage when Pillow can't read `png`.
+    """
+    from PIL import Image, ImageStat
+
+    try:
+        image = Image.open(io.BytesIO(png))
+        image.load()
+    except OSError as e:  # includes UnidentifiedImageError and truncated files
+        raise UndecodableImage(str(e)) from None
+    with image:
+        image.thumbnail((size, size))
+        contrast = ImageStat.Stat(image.convert("L")).stddev[0]  # near 0 for a blank or single-colour image
+        out = io.BytesIO()
+        image.save(out, format="PNG")
+    return contrast, out.getvalue()
+
+
+@lru_cache(maxsize=None)
+def get_variant_pool() -> ProcessPoolExecutor:
+    # spawn, not fork: the server process runs threads (job pool, uploads) that fork would copy mid-flight
+    return ProcessPoolExecutor(max_workers=IMAGE_VARIANT_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+
+
+async def make_variants_async(images: List[bytes]) -> List[Tuple[bytes, bytes]]:
+    """make_variants for each image on the process pool, in order."""
+    loop = asyncio.get_running_loop()
+    pool = get_variant_pool()
+    return list(await asyncio.gather(*(
+        loop.run_in_executor(pool, make_variants, image, IMAGE_VARIANT_FORMAT, IMAGE_VARIANT_QUALITY, THUMBNAIL_SIZE)
+        for image in images
+    )))
+
+
+async def preview_async(png: bytes, size: int) -> Tuple[float, bytes]:
+    """preview() on the process pool."""
+    return await asyncio.get_running_loop().run_in_executor(get_variant_pool(), preview, png, size)
@@ -0,0 +1,198 @@
+# Optional quality stage between image generation and upload (QUALITY_STAGE=1).
+# This is zen_agent's critic/refiner loop made fit for the real pipeline: the
+# critic looks at the rendered image (not a URL), and the refiner re-renders with
+# gpt-image-1, the critique folded into the prompt.
+#
+# Each step image first gets a free local check (blank or undecodable images fail
+# straight away), then a Gemini critique of a small preview. Only failing images
+# are re-rendered, at most QUALITY_MAX_ROUNDS times each. Every lesson has a time
+# and a cost budget shared by its steps; a call that doesn't fit is never started,
+# and one still running when the time is up is cancelled, so the stage adds at most
+# QUALITY_TIME_BUDGET seconds to a lesson. Steps keep their latest image either way.
+
+import os
+import json
+import time
+import asyncio
+from typing import Dict, Optional, Tuple
+from dotenv import load_dotenv
+from google.genai import types
+
+from .generatesteps import get_client
+from .generatesimages import generate_images_async
+from .imagevariants import UndecodableImage, preview_async
+from .tracing import registry, span
+
+load_dotenv()
+
+QUALITY_STAGE = os.getenv("QUALITY_STAGE", "0") == "1"
+QUALITY_CRITIC_MODEL = os.getenv("QUALITY_CRITIC_MODEL", "gemini-2.5-flash")
+QUALITY_MAX_ROUNDS = int(os.getenv("QUALITY_MAX_ROUNDS", "2"))               # re-renders per step at most
+QUALITY_TIME_BUDGET = float(os.getenv("QUALITY_TIME_BUDGET", "45"))           # seconds per lesson
+QUALITY_COST_BUDGET = float(os.getenv("QUALITY_COST_BUDGET", "0.25"))         # USD per lesson
+QUALITY_RENDER_COST = float(os.getenv("QUALITY_RENDER_COST", "0.042"))        # USD per 1024x1024 gpt-image-1 render
+QUALITY_CRITIQUE_COST = float(os.getenv("QUALITY_CRITIQUE_COST", "0.0005"))   # USD per critique of one preview
+QUALITY_PREVIEW_SIZE = int(os.getenv("QUALITY_PREVIEW_SIZE", "384"))          # px; Gemini bills up to 384px as one tile
+QUALITY_MIN_CONTRAST = float(os.getenv("QUALITY_MIN_CONTRAST", "6"))          # grayscale std dev; below is a blank image
+
+CRITIC_PROMPT = """You are a constructive critic reviewing an image for one step of a tutorial.
+
+Step the image illustrates:
+{step}
+
+Check that the image shows "Step {step_number}" as a clear header, that it depicts this step
+coherently, and that any text or math in it is legible and correct. If the step is a mathematical
+operation or equation, the image should be a simple, clear visual representation of it.
+
+Fail the image only for clear, actionable problems (wrong or garbled content, missing header,
+unreadable text). Do not fail it for purely stylistic preferences; it only has to be functionally
+complete. Return JSON: {{"pass": true or false, "critique": concise fixes, empty when passing}}."""
+
+
+class QualityBudget:
+    """
+    Time and estimated spend left for one lesson's quality stage, shared by its steps.
+    The clock starts when the first image reaches the stage.
+    """
+
+    def __init__(self, seconds: float = QUALITY_TIME_BUDGET, dollars: float = QUALITY_COST_BUDGET):
+        self.seconds = seconds
+        self.dollars = dollars
+        self.spent = 0.0
+        self._deadline: Optional[float] = None
+
+    def remaining(self) -> float:
+        if self._deadline is None:
+            self._deadline = time.monotonic() + self.seconds
+        return self._deadline - time.monotonic()
+
+    def reserve(self, cost: float) -> Optional[str]:
+        """Claim `cost` for the next call. Returns the budget ("time" or "cost") that ran out instead, if any."""
+        if self.remaining() <= 0:
+            return "time"
+        if self.spent + cost > self.dollars:
+            return "cost"
+        self.spent += cost
+        registry.inc("lesson_quality_cost_dollars_total", {}, cost, help="Estimated spend of the image quality stage.")
+        return None
+
+
+async def _critique(step_number: int, prompt: str, preview: bytes) -> Tuple[bool, str]:
+    with span("gemini.critique") as stage:
+        resp = await get_client().aio.models.generate_content(
+            model=QUALITY_CRITIC_MODEL,
+            contents=[
+                types.Part.from_bytes(data=preview, mime_type="image/png"),
+                CRITIC_PROMPT.format(step=prompt, step_number=step_number),
+            ],
+            config=types.GenerateContentConfig(
+                response_mime_type="application/json",
+                response_schema={
+                    "type": "object",
+                    "properties": {"pass": {"type": "boolean"}, "critique": {"type": "string"}},
+                    "required": ["pass"],
+                },
+            ),
+        )
+        usage = resp.usage_metadata
+        if usage:
+            stage.add(input_tokens=usage.prompt_token_count, output_tokens=usage.candidates_token_count)
+
+    verdict = json.loads(resp.text)
+    return bool(verdict.get("pass")), verdict.get("critique") or ""
+
+
+async def _check(step_number: int, prompt: str, image: bytes, budget: QualityBudget) -> Tuple[Optional[bool], str]:
+    """
+    (passed, critique) for one image, or (None, budget) when the budget ran out
+    before a verdict. The local contrast check runs first and costs nothing.
+    Only an image Pillow can't read fails; other errors (a broken process pool,
+    say) are raised, so the step keeps its image instead of paying for re-renders.
+    """
+    try:
+        contrast, preview = await asyncio.wait_for(preview_async(image, QUALITY_PREVIEW_SIZE), budget.remaining())
+    except asyncio.TimeoutError:
+        return None, "time"
+    except UndecodableImage:
+        return False, "The image could not be decoded. Render it again."
+    if contrast < QUALITY_MIN_CONTRAST:
+        return False, "The image is blank or nearly a single colour. Draw the described content clearly."
+
+    exhausted = budget.reserve(QUALITY_CRITIQUE_COST)
+    if exhausted:
+        return None, exhausted
+    try:
+        return await asyncio.wait_for(_critique(step_number, prompt, preview), budget.remaining())
+    except asyncio.TimeoutError:
+        return None, "time"
+
+
+async def refine_step_image(
+    step_number: int,
+    prompt: str,
+    image: bytes,
+    budget: QualityBudget,
+    semaphore: Optional[asyncio.Semaphore] = None,
+) -> bytes:
+    """
+    Critique `image` and re-render it until it passes, QUALITY_MAX_ROUNDS re-renders
+    are spent or `budget` runs out. Returns the latest render. Never raises for
+    critic or render failures: the stage is optional, so the step keeps its image.
+    """
+    outcome = "passed"
+    with span("quality.step") as stage:
+        for round_number in range(QUALITY_MAX_ROUNDS + 1):
+            try:
+                passed, critique = await _check(step_number, prompt, image, budget)
+            except Exception as e:
+                print(f"⚠️  Quality check failed for step {step_number}, keeping its image: {e}")
+                outcome = "critic_error"
+                break
+            stage.add(checks=1)
+            if passed is None:
+                outcome = f"{critique}_budget"
+                break
+            if passed:
+                outcome = "passed" if round_number == 0 else "fixed"
+                break
+            if round_number == QUALITY_MAX_ROUNDS:
+                outcome = "max_rounds"
+                break
+
+            exhausted = budget.reserve(QUALITY_RENDER_COST)
+            if exhausted:
+                outcome = f"{exhausted}_budget"
+                break
+            print(f"🔁 Re-rendering step {step_number}: {critique[:120]}")
+            revised = f"{prompt} Fix these problems found in the previous attempt: {critique}"
+            try:
+                images = await asyncio.wait_for(generate_images_async([revised], 1, semaphore=semaphore), budget.remaining())
+            except asyncio.TimeoutError:
+                outcome = "time_budget"
+                break
+            except Exception as e:
+                print(f"⚠️  Re-render failed for step {step_number}, keeping its image: {e}")
+                outcome = "render_error"
+                break
+            stage.add(rerenders=1)
+            if images:
+                image = images[0]
+
+    registry.inc("lesson_quality_steps_total", {"outcome": outcome},
+                 help="Step images through the quality stage, by how they left it.")
+    return image
+
+
+async def refine_images(
+    prompts: Dict[int, str],
+    images: Dict[int, bytes],
+    budget: Optional[QualityBudget] = None,
+    semaphore: Optional[asyncio.Semaphore] = None,
+) -> Dict[int, bytes]:
+    """refine_step_image for every {step_number: image}, concurrently, under one budget."""
+    budget = budget or QualityBudget()
+    refined = await asyncio.gather(*(
+        refine_step_image(step_number, prompts[step_number], image, budget, semaphore)
+        for step_number, image in images.items()
+    ))
+    return dict(zip(images, refined))
@@ -0,0 +1,239 @@
+# In-process latency tracing for the lesson pipeline.
+# Code wraps each stage in span("stage.name") (or @traced); every span feeds
+# process-wide Prometheus metrics, and spans that run inside a job's trace()
+# are also summarized in one JSON log line when the job finishes.
+# Nothing is sent anywhere: /metrics renders the registry as Prometheus text.
+
+import json
+import time
+import inspect
+import threading
+import contextvars
+from contextlib import contextmanager
+from functools import wraps
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+# Seconds; wide enough for a 200ms insert and a 2-minute lesson
+BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Registry:
+    """Counters and histograms keyed by metric name and label set."""
+
+    def __init__(self, buckets: Tuple[float, ...] = BUCKETS):
+        self.buckets = buckets
+        self._counters: Dict[str, Dict[Labels, float]] = {}
+        self._histograms: Dict[str, Dict[Labels, List[float]]] = {}  # per-bucket counts, then sum, then count
+        self._help: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name: str, labels: Dict[str, str], value: float = 1, help: str = "") -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._help.setdefault(name, help)
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, labels: Dict[str, str], value: float, help: str = "") -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._help.setdefault(name, help)
+            series = self._histograms.setdefault(name, {})
+            counts = series.setdefault(key, [0.0] * (len(self.buckets) + 2))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            counts[-2] += value
+            counts[-1] += 1
+
+    def render(self) -> str:
+        """Prometheus text exposition format (version 0.0.4)."""
+        lines: List[str] = []
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                lines += [f"# HELP {name} {self._help[name]}", f"# TYPE {name} counter"]
+                for key, value in sorted(series.items()):
+                    lines.append(f"{name}{_labels(key)} {_number(value)}")
+            for name, series in sorted(self._histograms.items()):
+                lines += [f"# HELP {name} {self._help[name]}", f"# TYPE {name} histogram"]
+                for key, counts in sorted(series.items()):
+                    for bound, count in zip(self.buckets, counts):
+                        lines.append(f"{name}_bucket{_labels(key, le=_number(bound))} {_number(count)}")
+                    lines.append(f"{name}_bucket{_labels(key, le='+Inf')} {_number(counts[-1])}")
+                    lines.append(f"{name}_sum{_labels(key)} {counts[-2]:.6f}")
+                    lines.append(f"{name}_count{_labels(key)} {_number(counts[-1])}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(key: Labels, **extra: str) -> str:
+    pairs = list(key) + list(extra.items())
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(value)
+
+
+registry = Registry()
+
+
+class Span:
+    """One timed stage. `counts` are totals such as tokens, images, bytes or retries."""
+
+    def __init__(self, name: str, counts: Dict[str, int]):
+        self.name = name
+        self.counts = dict(counts)
+        self.error: Optional[str] = None
+        self.duration = 0.0
+
+    def add(self, **counts: int) -> None:
+        for key, value in counts.items():
+            self.counts[key] = self.counts.get(key, 0) + (value or 0)
+
+
+class Trace:
+    """Spans recorded while one lesson job runs, summarized by log_line()."""
+
+    def __init__(self, job_id: str):
+        self.job_id = job_id
+        self.started = time.perf_counter()
+        self.spans: List[Span] = []
+        self._lock = threading.Lock()
+
+    def record(self, span: Span) -> None:
+        with self._lock:
+            self.spans.append(span)
+
+    def summary(self) -> Dict[str, Dict[str, Any]]:
+        stages: Dict[str, Dict[str, Any]] = {}
+        with self._lock:
+            for span in self.spans:
+                stage = stages.setdefault(span.name, {"calls": 0, "errors": 0, "total_ms": 0.0, "max_ms": 0.0})
+                stage["calls"] += 1
+                stage["errors"] += 1 if span.error else 0
+                stage["total_ms"] = round(stage["total_ms"] + span.duration * 1000, 1)
+                stage["max_ms"] = round(max(stage["max_ms"], span.duration * 1000), 1)
+                for key, value in span.counts.items():
+                    stage[key] = stage.get(key, 0) + value
+        return stages
+
+    def log_line(self, status: str) -> str:
+        return json.dumps({
+            "event": "lesson_trace",
+            "job_id": self.job_id,
+            "status": status,
+            "total_ms": round((time.perf_counter() - self.started) * 1000, 1),
+            "stages": self.summary(),
+        })
+
+
+_current_trace: "contextvars.ContextVar[Optional[Trace]]" = contextvars.ContextVar("lesson_trace", default=None)
+
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+
+@contextmanager
+def use_trace(trace_: Optional[Trace]) -> Iterator[None]:
+    """Attach spans recorded on this thread to `trace_`, e.g. inside a thread pool worker."""
+    token = _current_trace.set(trace_)
+    try:
+        yield
+    finally:
+        _current_trace.reset(token)
+
+
+@contextmanager
+def trace(job_id: str) -> Iterator[Trace]:
+    """
+    Collect every span recorded in this context (including asyncio tasks and
+    asyncio.to_thread calls started from it) and print one JSON line when done.
+    """
+    job_trace = Trace(job_id)
+    status = "done"
+    try:
+        with use_trace(job_trace):
+            yield job_trace
+    except BaseException:
+        status = "failed"
+        raise
+    finally:
+        elapsed = time.perf_counter() - job_trace.started
+        registry.inc("lesson_jobs_total", {"status": status}, help="Lesson jobs finished, by outcome.")
+        registry.observe("lesson_job_duration_seconds", {"status": status}, elapsed,
+                         help="Wall time of a lesson job from start to saved lesson.")
+        print(job_trace.log_line(status), flush=True)
+
+
+@contextmanager
+def span(name: str, **counts: int) -> Iterator[Span]:
+    """Time one stage; call .add(retries=1, images=2, ...) on the yielded span to count work."""
+    current = Span(name, counts)
+    started = time.perf_counter()
+    try:
+        yield current
+    except BaseException as e:
+        current.error = type(e).__name__
+        raise
+    finally:
+        current.duration = time.perf_counter() - started
+        _record(current)
+
+
+def _record(current: Span) -> None:
+    labels = {"stage": current.name}
+    registry.observe("lesson_stage_duration_seconds", labels, current.duration,
+                     help="Duration of one pipeline stage call.")
+    if current.error:
+        registry.inc("lesson_stage_errors_total", {**labels, "error": current.error},
+                     help="Pipeline stage calls that raised.")
+    for key, value in current.counts.items():
+        registry.inc(f"lesson_stage_{key}_total", labels, value, help=f"{key.capitalize()} counted by pipeline stages.")
+    job_trace = current_trace()
+    if job_trace:
+        job_trace.record(current)
+
+
+def traced(name: str) -> Callable[[Callable[..., Any]], Callable[..., Any]]:
+    """Decorator form of span() for plain and coroutine functions."""
+
+    def decorate(fn: Callable[..., Any]) -> Callable[..., Any]:
+        if inspect.iscoroutinefunction(fn):
+            @wraps(fn)
+            async def async_wrapper(*args: Any, **kwargs: Any) -> Any:
+                with span(name):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @wraps(fn)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+
+    return decorate
+
+
+def bind(fn: Callable[..., Any]) -> Callable[..., Any]:
+    """Wrap `fn` to record its spans into the caller's trace when run on another thread."""
+    job_trace = current_trace()
+
+    @wraps(fn)
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        with use_trace(job_trace):
+            return fn(*args, **kwargs)
+
+    return wrapper
+
+
+def render_metrics() -> str:
+    return registry.render()
@@ -0,0 +1,33 @@
+# Per-job scratch directories for the ADK pipeline, whose generate_images tool
+# still writes PNGs to disk. Each lesson job gets its own folder under
+# GENERATED_DIR, so concurrent jobs never see (or delete) each other's images.
+
+import os
+import shutil
+import uuid
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+GENERATED_DIR = os.path.join(BACKEND_DIR, "generated_images")
+
+# Session state keys shared by the ADK tools and agent.run_agent_pipeline
+STATE_WORKSPACE = "workspace"        # set by the pipeline: where generate_images saves files
+STATE_STEPS = "step_list"            # set by generate_steps: the parsed List[str] of steps
+STATE_STEP_IMAGE_PREFIX = "step_image:"  # set by generate_images, one key per step (see step_image_key)
+
+
+def step_image_key(step_number: int) -> str:
+    # One key per step, so parallel image agents never overwrite each other's results
+    return f"{STATE_STEP_IMAGE_PREFIX}{step_number}"
+
+
+@contextmanager
+def job_workspace(job_id: Optional[str] = None) -> Iterator[str]:
+    """Create GENERATED_DIR/job_<id> for one job and remove it when the job is done."""
+    path = os.path.join(GENERATED_DIR, f"job_{job_id or uuid.uuid4().hex}")
+    os.makedirs(path, exist_ok=True)
+    try:
+        yield path
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
@@ -1,4 +1,6 @@
 # Part of agent.py --> Follow https://google.github.io/adk-docs/get-started/quickstart/ to learn the setup
+# Standalone ADK experiment. The pipeline's version of this critique/refine loop,
+# over real rendered images and with time and cost budgets, is quality.py.
 
 import asyncio
 import os
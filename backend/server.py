@@ -1,68 +1,139 @@
-import asyncio
-from multi_tool_agent.agent import main
-from flask import Flask, request, jsonify
-from sqlcommands import verify_user, add_lesson, upload_directory, add_step, clear_generated_images, get_lessons, get_steps
+import os
+from flask import Flask, Response, request, jsonify, stream_with_context
+from werkzeug.middleware.proxy_fix import ProxyFix
+from sqlcommands import get_store
+from auth import TRUSTED_PROXY_HOPS, authenticate
 from flask_cors import CORS  # to allow frontend requests
+from jobs import JobManager, QueueFullError, DONE
+from jobqueue import QueuedJobManager
+from worker import build_lesson
+from cache import lesson_cache
+from multi_tool_agent.content_cache import get_image_cache, get_lesson_cache
+from multi_tool_agent.tracing import render_metrics, traced
+from lessons import EVENTS_KEEPALIVE_SECONDS, create_lesson_args, lessons_page_args, sse_event, wants_thumbnails, with_thumbnails
 
 app = Flask(__name__)
 CORS(app)  # enable CORS for all routes
+if TRUSTED_PROXY_HOPS:
+    # Behind nginx or another proxy: take the client address from X-Forwarded-For (auth.py)
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXY_HOPS)
 
 @app.route('/login', methods=['POST'])
 def login():
-    data = request.get_json()
-    print(data)
+    data = request.get_json(silent=True) or {}
     username = data.get('username')
     password = data.get('password')
+    if not username or not password:
+        return jsonify({"success": False, "message": "Invalid credentials"}), 401
 
-    AppUser = verify_user(username, password)
+    # Rate limited per user and per IP, and recent logins are answered from memory (auth.py)
+    AppUser, retry_after = authenticate(get_store().verify_user, username, password, request.remote_addr)
+    if retry_after:
+        return jsonify({"success": False, "message": "Too many login attempts"}), 429, {"Retry-After": str(retry_after)}
 
     if AppUser:
         return jsonify({"success": True, "role": AppUser["role"]})
     else:
         return jsonify({"success": False, "message": "Invalid credentials"}), 401
 
+# "threads": lessons run on this process's JobManager pool.
+# "queue": lessons go to the durable queue in jobqueue.py and `python worker.py` processes run them.
+LESSON_JOB_BACKEND = os.getenv("LESSON_JOB_BACKEND", "threads")
+lesson_jobs = QueuedJobManager() if LESSON_JOB_BACKEND == "queue" else JobManager(build_lesson)
+
 @app.route('/createLesson', methods=['POST'])
+@traced("server.enqueue_lesson")
 def create_lesson():
     data = request.get_json()
 
-    title = data.get('title')
-    topic = data.get('topic')
-    level = data.get('level')
-    description = data.get('description')
+    try:
+        job = lesson_jobs.submit(*create_lesson_args(data))
+    except QueueFullError as e:
+        return jsonify({"success": False, "message": str(e)}), 503
 
-    lesson, error = add_lesson(title, description, level)
-    if error:
-        return jsonify({"success": False, "message": error}), 400
-    
-    lesson_id = lesson['lesson_id']
+    return jsonify({"success": True, "message": "Lesson creation started", "job_id": job.id}), 202
 
-    steps_array = asyncio.run(main(topic, description, level))
+@app.route('/lessonJobs/<job_id>', methods=['GET'])
+def get_lesson_job(job_id):
+    job = lesson_jobs.get(job_id)
+    if job is None:
+        return jsonify({"success": False, "message": "Unknown job"}), 404
 
-    # Upload images and get their URL's
-    file_urls = upload_directory()
-    clear_generated_images()
+    body = {"success": True, "job": job.to_dict()}
+    if job.status == DONE:
+        body["lesson"] = job.result
+    return jsonify(body)
 
-    lesson['steps'] = []
+@app.route('/lessonJobs/<job_id>/lesson', methods=['GET'])
+def get_lesson_job_result(job_id):
+    job = lesson_jobs.get(job_id)
+    if job is None:
+        return jsonify({"success": False, "message": "Unknown job"}), 404
+    if job.status != DONE:
+        return jsonify({"success": False, "message": job.error or "Lesson not ready", "job": job.to_dict()}), 409 if job.error else 202
 
-    for i, file_url in enumerate(file_urls):
-        step_description = steps_array[i] if i < len(steps_array) else "Step description missing"
-        add_step(lesson_id, i + 1, step_description, file_url)
-        lesson['steps'].append({
-            "step_description": step_description,
-            "image_path": file_url
-        })
-
-    return jsonify({"success": True, "message": "Lesson created successfully", "lesson": lesson})
+    return jsonify({"success": True, "message": "Lesson created successfully", "lesson": job.result})
 
 @app.route('/getLessons', methods=['GET'])
 def getLessons():
-    lessons = get_lessons()
-    for lesson in lessons:
-        lesson_id = lesson['lesson_id']
-        steps = get_steps(lesson_id)
-        lesson['steps'] = steps
+    try:
+        lessons, next_cursor = get_store().get_lessons_page(*lessons_page_args(request.args))
+        thumbnails = wants_thumbnails(request.args)
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+
+    # Thumbnails unless ?images=full, so listing pages stay light
+    if thumbnails:
+        lessons = with_thumbnails(lessons)
+
+    # Pages come from lesson_cache; the ETag lets an unchanged dashboard get a bodyless 304
+    response = jsonify({"lessons": lessons, "next_cursor": next_cursor})
+    response.add_etag()
+    return response.make_conditional(request)
+
+@app.route('/lessonJobs/<job_id>/events', methods=['GET'])
+def stream_lesson_job(job_id):
+    """
+    Server-Sent Events for one job: "steps" as soon as the steps exist, "image" as
+    each step's image is uploaded, "progress" updates, then "done" (with the lesson)
+    or "error". Reconnects resume after the Last-Event-ID header.
+    """
+    job = lesson_jobs.get(job_id)
+    if job is None:
+        return jsonify({"success": False, "message": "Unknown job"}), 404
+
+    start = request.headers.get('Last-Event-ID', -1, type=int) + 1
+
+    def stream():
+        index = start
+        while True:
+            events, finished = job.wait_events(index, EVENTS_KEEPALIVE_SECONDS)
+            for event in events:
+                yield sse_event(index, event)
+                index += 1
+            if finished:
+                return
+            if not events:
+                yield ": keep-alive\n\n"
+
+    return Response(
+        stream_with_context(stream()),
+        mimetype='text/event-stream',
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.route('/cacheStats', methods=['GET'])
+def cache_stats():
+    return jsonify({
+        "lesson_listings": {"hits": lesson_cache.hits, "misses": lesson_cache.misses},
+        "lessons": get_lesson_cache().stats(),
+        "images": get_image_cache().stats(),
+    })
 
-    return jsonify({"lessons": lessons})
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Stage latencies, token/image/retry counts and job outcomes in Prometheus text format."""
+    return Response(render_metrics(), mimetype="text/plain; version=0.0.4")
 
 if __name__ == '__main__':
     app.run(debug=True)
@@ -0,0 +1,9 @@
+-- Each step stores the URL of its thumbnail next to the full-size image, so
+-- /getLessons can serve thumbnails by default (see multi_tool_agent/imagevariants.py).
+-- Steps created before this column existed keep a null thumbnail and fall back
+-- to their full image.
+--
+-- Apply once in the Supabase SQL editor (or psql), then re-apply
+-- create_lesson_with_steps.sql so the RPC writes the new column.
+
+alter table public.steps add column if not exists thumbnail_path text;
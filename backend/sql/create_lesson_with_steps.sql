@@ -0,0 +1,60 @@
+-- Inserts a lesson and all of its steps in one transaction, so /createLesson
+-- persists a lesson in a single PostgREST round-trip and never leaves an
+-- orphaned lesson row behind. Called by sqlcommands.add_lesson_with_steps.
+-- With p_job_id set it is idempotent: a job that was already saved gets its
+-- existing lesson back and nothing is inserted.
+--
+-- Apply once in the Supabase SQL editor (or psql) before starting the server,
+-- after add_step_thumbnails.sql and lessons_job_id.sql.
+
+-- The version without p_job_id would otherwise stay behind as an overload
+drop function if exists public.create_lesson_with_steps(text, text, text, jsonb);
+
+create or replace function public.create_lesson_with_steps(
+    p_lesson_name text,
+    p_lesson_descriptions text,
+    p_lesson_level text,
+    p_steps jsonb,
+    p_job_id text default null
+) returns jsonb
+language plpgsql
+as $$
+declare
+    new_lesson public.lessons%rowtype;
+begin
+    insert into public.lessons (lesson_name, lesson_descriptions, lesson_level, job_id)
+    values (p_lesson_name, p_lesson_descriptions, p_lesson_level, p_job_id)
+    on conflict (job_id) do nothing
+    returning * into new_lesson;
+
+    if not found then
+        -- This job's lesson is already saved (nulls never conflict, so p_job_id is set)
+        select * into new_lesson from public.lessons where job_id = p_job_id;
+        return jsonb_build_object(
+            'lesson_id', new_lesson.lesson_id,
+            'created_at', new_lesson.created_at,
+            'lesson_name', new_lesson.lesson_name,
+            'lesson_descriptions', new_lesson.lesson_descriptions,
+            'lesson_level', new_lesson.lesson_level
+        );
+    end if;
+
+    insert into public.steps (lessons_id, step_number, step_description, image_bucket, image_path, thumbnail_path)
+    select
+        new_lesson.lesson_id,
+        (s ->> 'step_number')::int,
+        s ->> 'step_description',
+        s ->> 'image_bucket',
+        s ->> 'image_path',
+        s ->> 'thumbnail_path'
+    from jsonb_array_elements(p_steps) as s;
+
+    return jsonb_build_object(
+        'lesson_id', new_lesson.lesson_id,
+        'created_at', new_lesson.created_at,
+        'lesson_name', new_lesson.lesson_name,
+        'lesson_descriptions', new_lesson.lesson_descriptions,
+        'lesson_level', new_lesson.lesson_level
+    );
+end;
+$$;
@@ -0,0 +1,10 @@
+-- Each lesson records the generation job that created it, so saving the same
+-- job twice (a worker that lost its lease racing the worker that reclaimed the
+-- job, or a retried RPC call) returns the existing lesson instead of a duplicate.
+-- Lessons created before this column existed, or by add_lesson, keep a null job_id.
+--
+-- Apply once in the Supabase SQL editor (or psql), then re-apply
+-- create_lesson_with_steps.sql so the RPC takes the job id.
+
+alter table public.lessons add column if not exists job_id text;
+create unique index if not exists lessons_job_id_key on public.lessons (job_id);
@@ -0,0 +1,8 @@
+-- create_account relies on this index to reject a second account for the same
+-- email: the insert fails with unique_violation (23505) instead of the code
+-- checking first, which two concurrent sign-ups could both pass.
+--
+-- Apply once in the Supabase SQL editor (or psql). It fails if duplicate emails
+-- already exist; remove those rows first.
+
+create unique index if not exists users_email_key on public.users (email);
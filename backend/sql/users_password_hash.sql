@@ -0,0 +1,9 @@
+-- Passwords move from plaintext users.password to scrypt hashes in
+-- users.password_hash (see auth.py). Existing rows keep working: on a user's next
+-- successful login the server writes the hash and clears the plaintext column.
+-- New accounts only ever store the hash, so password has to allow nulls.
+--
+-- Apply once in the Supabase SQL editor (or psql) before starting the server.
+
+alter table public.users add column if not exists password_hash text;
+alter table public.users alter column password drop not null;
@@ -1,12 +1,23 @@
-#  assume plaintext passwords (test-only) and no RLS.
+#  passwords are stored as scrypt hashes (auth.py); assumes no RLS.
 # If you enable RLS later, use a service role key here (server-only).
 
 import os
+import json
+import time
+import base64
 import uuid
-import shutil
+import random
+import threading
+import httpx
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional, TypedDict, Tuple, Dict, Any, List
-from supabase import create_client, Client
+from supabase import create_client, Client, ClientOptions
+from postgrest.exceptions import APIError
 from dotenv import load_dotenv
+from multi_tool_agent.tracing import bind, registry, span, traced
+from cache import lesson_cache
+from auth import hash_password, off_thread, verify_credentials
 
 # ---------- Load .env ----------
 load_dotenv(dotenv_path=".env")  # loads variables from .env into os.environ
@@ -14,14 +25,61 @@ load_dotenv(dotenv_path=".env")  # loads variables from .env into os.environ
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_SERVICE_ROLE = os.getenv("SUPABASE_SERVICE_ROLE")
 BUCKET_NAME = "aiImages"
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-GENERATED_DIR = os.path.join(BASE_DIR, "generated_images")
+UPLOAD_CONCURRENCY = int(os.getenv("UPLOAD_CONCURRENCY", "8"))  # parallel storage uploads
+UPLOAD_MAX_RETRIES = int(os.getenv("UPLOAD_MAX_RETRIES", "3"))  # retries per file on transient errors
 
-if not SUPABASE_URL or not SUPABASE_SERVICE_ROLE:
-    raise RuntimeError("Missing SUPABASE_URL or SUPABASE_SERVICE_ROLE in .env")
+# ---------- Connection settings ----------
+# One pooled HTTP transport per store: connections are kept alive between queries
+# and shared by every thread (or task) using it. Keep-alive is kept shorter than
+# typical load balancer idle timeouts so a reused connection is rarely already closed.
+SUPABASE_POOL_SIZE = int(os.getenv("SUPABASE_POOL_SIZE", "20"))                # open connections per store
+SUPABASE_KEEPALIVE = float(os.getenv("SUPABASE_KEEPALIVE", "30"))              # seconds an idle connection is kept
+SUPABASE_CONNECT_TIMEOUT = float(os.getenv("SUPABASE_CONNECT_TIMEOUT", "5"))   # seconds
+SUPABASE_TIMEOUT = float(os.getenv("SUPABASE_TIMEOUT", "30"))                  # seconds to read, write or wait for a connection
+SUPABASE_HTTP2 = os.getenv("SUPABASE_HTTP2", "0") == "1"                       # needs the h2 package
+SUPABASE_MAX_RETRIES = int(os.getenv("SUPABASE_MAX_RETRIES", "2"))             # retries per query on transient errors
 
-# ---------- Supabase client ----------
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE)
+# PostgREST codes for a database that is briefly unreachable or busy, plus
+# Postgres serialization failures and deadlocks; anything else is the query's fault
+RETRYABLE_POSTGREST_CODES = {"PGRST000", "PGRST001", "PGRST002", "PGRST003", "40001", "40P01"}
+
+def transport_options(
+    pool_size: int = SUPABASE_POOL_SIZE,
+    keepalive: float = SUPABASE_KEEPALIVE,
+    connect_timeout: float = SUPABASE_CONNECT_TIMEOUT,
+    timeout: float = SUPABASE_TIMEOUT,
+) -> Dict[str, Any]:
+    """httpx.Client / httpx.AsyncClient arguments for a store's connection pool."""
+    return {
+        "limits": httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size, keepalive_expiry=keepalive),
+        "timeout": httpx.Timeout(timeout, connect=connect_timeout),
+        "http2": SUPABASE_HTTP2,
+        "follow_redirects": True,
+    }
+
+class RetryPolicy:
+    """How often a failed call is retried, with jittered exponential backoff between tries."""
+
+    def __init__(self, retries: int, base_delay: float = 0.5, max_delay: float = 8.0):
+        self.retries = retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, attempt: int) -> float:
+        return min(self.max_delay, self.base_delay * 2 ** attempt) + random.uniform(0, self.base_delay)
+
+def _is_retryable_query(e: Exception, idempotent: bool) -> bool:
+    # Connection failures are safe to retry even for writes: the request never left
+    if isinstance(e, (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)):
+        return True
+    if not idempotent:
+        return False
+    if isinstance(e, httpx.TransportError):
+        return True
+    return isinstance(e, APIError) and e.code in RETRYABLE_POSTGREST_CODES
+
+def _count_retry(operation: str) -> None:
+    registry.inc("supabase_retries_total", {"operation": operation}, help="Supabase calls retried after a transient error.")
 
 # ---------- Types ----------
 class AppUser(TypedDict):
@@ -30,197 +88,395 @@ class AppUser(TypedDict):
     name: Optional[str]
     role: int
 
-# ---------- Users ----------
-def verify_user(email: str, password: str) -> Optional[AppUser]:
-    """Lookup a user by email, plaintext password (test), and role."""
-    res = (
-        supabase.table("users")
-        .select("id,email,name,role")
-        .match({"email": email, "password": password})
-        .limit(1)
-        .execute()
-    )
-    rows = res.data or []
-    return rows[0] if rows else None  # type: ignore
-
-def create_account(email: str, password: str, name: str, role: int) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
-    """Insert a new user. Returns (user_dict, error)."""
-    exists = supabase.table("users").select("id").eq("email", email).limit(1).execute()
-    if exists.data:
-        return None, "Email already registered"
-
-    result = (
-        supabase.table("users")
-        .insert({"email": email, "password": password, "name": name, "role": role})
-        .execute()
-    )
-    if not result.data:
-        return None, "Failed to create user"
-    # Fetch the newly created user by email
-    user = (
-        supabase.table("users")
-        .select("id,email,name,role,created_at")
-        .eq("email", email)
-        .limit(1)
-        .execute()
-    )
-    if not user.data:
-        return None, "Failed to fetch created user"
-    return user.data[0], None
-
-# ---------- Lessons ----------
-def get_lessons(user_id: Optional[str] = None) -> List[Dict[str, Any]]:
-    q = supabase.table("lessons").select(
-        "lesson_id,created_at,lesson_name,lesson_descriptions,lesson_level"
-    )
+class UploadResult(TypedDict):
+    source: str                 # file name, or "image N" for in-memory uploads
+    object_name: Optional[str]  # name in the bucket
+    url: Optional[str]          # public URL, None if the upload failed
+    error: Optional[str]
+
+# ---------- Queries ----------
+# Builders shared by SupabaseStore and asqlcommands.AsyncSupabaseStore: postgrest's
+# sync and async clients build queries the same way, only execute() differs.
+LESSON_COLUMNS = "lesson_id,created_at,lesson_name,lesson_descriptions,lesson_level"
+STEP_COLUMNS = "step_number,image_path,thumbnail_path,step_description"
+APP_USER_COLUMNS = "id,email,name,role"
+USER_COLUMNS = f"{APP_USER_COLUMNS},created_at"
+UNIQUE_VIOLATION = "23505"  # Postgres error code
+
+def _encode_cursor(lesson: Dict[str, Any]) -> str:
+    raw = json.dumps([lesson["created_at"], lesson["lesson_id"]])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def _decode_cursor(cursor: str) -> Tuple[str, int]:
+    # The cursor comes from the client and ends up in a PostgREST filter string, so
+    # both parts are parsed and re-serialized rather than passed through
+    created_at, lesson_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    return datetime.fromisoformat(created_at).isoformat(), int(lesson_id)
+
+def _credentials_query(db: Any, email: str) -> Any:
+    # password is only read from rows not yet upgraded to password_hash (sql/users_password_hash.sql)
+    return db.table("users").select(f"{APP_USER_COLUMNS},password,password_hash").eq("email", email).limit(1)
+
+def _password_update(db: Any, user_id: str, password_hash: str) -> Any:
+    return db.table("users").update({"password_hash": password_hash, "password": None}).eq("id", user_id)
+
+def _lessons_query(db: Any) -> Any:
+    q = db.table("lessons").select(LESSON_COLUMNS)
     # if user_id: q = q.eq("owner_id", user_id)
-    return q.order("created_at", desc=True).execute().data or []
+    return q.order("created_at", desc=True)
+
+def _lessons_page_query(db: Any, limit: int, cursor: Optional[str], include_steps: bool) -> Any:
+    columns = f"{LESSON_COLUMNS},steps({STEP_COLUMNS})" if include_steps else LESSON_COLUMNS
+    q = db.table("lessons").select(columns)
+
+    if cursor:
+        try:
+            created_at, lesson_id = _decode_cursor(cursor)
+        except Exception:
+            raise ValueError("Invalid cursor")
+        q = q.or_(f'created_at.lt."{created_at}",and(created_at.eq."{created_at}",lesson_id.lt.{lesson_id})')
+
+    # Fetch one extra row to learn whether another page exists
+    return q.order("created_at", desc=True).order("lesson_id", desc=True).limit(limit + 1)
 
-def get_steps(lesson_id: int) -> List[Dict[str, Any]]:
-    res = (
-        supabase.table("steps")
-        .select("lessons_id,step_number,image_path,step_description")
+def _lessons_page(rows: List[Dict[str, Any]], limit: int, include_steps: bool) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    lessons = rows[:limit]
+    if include_steps:
+        for lesson in lessons:
+            lesson["steps"] = sorted(lesson.get("steps") or [], key=lambda step: step["step_number"])
+
+    next_cursor = _encode_cursor(lessons[-1]) if len(rows) > limit else None
+    return lessons, next_cursor
+
+def _steps_query(db: Any, lesson_id: int) -> Any:
+    return (
+        db.table("steps")
+        .select(f"lessons_id,{STEP_COLUMNS}")
         .eq("lessons_id", lesson_id)
         .order("step_number", desc=False)
-        .execute()
-    )
-    return res.data or []
-
-def add_lesson(
-    lesson_name: str,
-    lesson_description: str,
-    lesson_level: str,
-) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
-    insert_lesson = (
-        supabase.table("lessons")
-        .insert({
-            "lesson_name": lesson_name,
-            "lesson_descriptions": lesson_description,
-            "lesson_level": lesson_level,
-        })
-        .execute()
     )
-    if not insert_lesson.data:
-        return None, "Failed to create lesson"
-    # Fetch the newly created lesson by its id
-    lesson_id = insert_lesson.data[0]["lesson_id"]
-    lesson = (
-        supabase.table("lessons")
-        .select("lesson_id,created_at,lesson_name,lesson_descriptions,lesson_level")
-        .eq("lesson_id", lesson_id)
-        .limit(1)
-        .execute()
-    )
-    if not lesson.data:
-        return None, "Failed to fetch created lesson"
-    
-    return lesson.data[0], None
-
-# ---------- Steps ----------
-def add_steps(
-    lesson_id: int,
-    steps: List[Dict[str, Any]],
-) -> Tuple[List[Dict[str, Any]], Optional[str]]:
-    if not steps:
-        return [], None
-
-    payload: List[Dict[str, Any]] = []
-    for s in steps:
-        payload.append({
-            "lessons_id": lesson_id,
+
+# Inserts return the new rows (Prefer: return=representation), so a write never needs
+# a follow-up select; _only() trims them to the columns a caller would have selected.
+def _only(row: Dict[str, Any], columns: str) -> Dict[str, Any]:
+    return {column: row.get(column) for column in columns.split(",")}
+
+def _user_insert(db: Any, email: str, password_hash: str, name: str, role: int) -> Any:
+    return db.table("users").insert({"email": email, "password_hash": password_hash, "name": name, "role": role})
+
+def _account_error(e: APIError) -> str:
+    # Duplicates are caught by the users_email_key index (sql/users_email_unique.sql),
+    # not a pre-check that two concurrent sign-ups could both pass
+    if e.code == UNIQUE_VIOLATION:
+        return "Email already registered"
+    return e.message or "Failed to create user"
+
+def _lesson_insert(db: Any, lesson_name: str, lesson_description: str, lesson_level: str) -> Any:
+    return db.table("lessons").insert({
+        "lesson_name": lesson_name,
+        "lesson_descriptions": lesson_description,
+        "lesson_level": lesson_level,
+    })
+
+def _create_lesson_rpc(
+    db: Any, lesson_name: str, lesson_description: str, lesson_level: str, steps: List[Dict[str, Any]], job_id: Optional[str],
+) -> Any:
+    params = {
+        "p_lesson_name": lesson_name,
+        "p_lesson_descriptions": lesson_description,
+        "p_lesson_level": lesson_level,
+        "p_steps": _step_rows(steps),
+    }
+    if job_id is not None:
+        params["p_job_id"] = job_id
+    return db.rpc("create_lesson_with_steps", params)
+
+def _step_rows(steps: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    return [
+        {
             "step_number": int(s["step_number"]),
             "step_description": s["step_description"],
+            "image_bucket": BUCKET_NAME,
             "image_path": s.get("image_path"),
-        })
+            "thumbnail_path": s.get("thumbnail_path"),
+        }
+        for s in steps
+    ]
 
-    res = (
-        supabase.table("steps")
-        .insert(payload)
-        .execute()
-    )
-    if getattr(res, "error", None) or not res.data:
-        error_message = getattr(res, "message", "Failed to insert steps")
-        return [], error_message
-
-    return sorted(res.data, key=lambda x: x["step_number"]), None
-
-def add_step(
-    lesson_id: int,
-    step_number: int,
-    step_description: str,
-    step_image: Optional[str] = None,
-) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
-    res = (
-        supabase.table("steps")
-        .insert({
-            "lessons_id": lesson_id,
-            "step_number": int(step_number),
-            "step_description": step_description,
-            "image_bucket": "aiImages",
-            "image_path": step_image,
-        })
-        .execute()
-    )
-    if not res.data:
-        error_message = getattr(res, "message", "Failed to insert step")
-        return None, error_message
-    rows = res.data or []
-    return (rows[0] if rows else None), None
+def _steps_insert(db: Any, lesson_id: int, steps: List[Dict[str, Any]]) -> Any:
+    return db.table("steps").insert([{"lessons_id": lesson_id, **row} for row in _step_rows(steps)])
 
-def upload_directory():
-    uploaded_files = []
+def public_url(object_name: str, url: Optional[str] = None) -> str:
+    """Public bucket URL, built locally instead of a get_public_url call per file."""
+    return f"{(url or SUPABASE_URL).rstrip('/')}/storage/v1/object/public/{BUCKET_NAME}/{object_name}"
 
-    if not os.path.exists(GENERATED_DIR):
-        print(f"⚠️ Directory not found: {GENERATED_DIR}")
-        return uploaded_files
+def _is_transient(e: Exception) -> bool:
+    # Network errors (timeouts, resets) are worth retrying, as are storage errors
+    # with a 429 or 5xx status: storage3's StorageApiError/StorageException carry it.
+    # Anything else, a bug or bad credentials included, fails straight away.
+    if isinstance(e, httpx.TransportError):
+        return True
+    status = getattr(e, "status", None)
+    if status is None and e.args and isinstance(e.args[0], dict):
+        status = e.args[0].get("statusCode")
+    try:
+        status = int(status)
+    except (TypeError, ValueError):
+        return False
+    return status == 429 or status >= 500
 
-    for filename in os.listdir(GENERATED_DIR):
-        filepath = os.path.join(GENERATED_DIR, filename)
+def _object_name(ext: str) -> Tuple[str, Dict[str, str]]:
+    # Unique filename to avoid collisions, and the file options to upload it with.
+    # upsert: a retry after a timeout that storage completed anyway would otherwise
+    # get a 409 for an object that is already there.
+    content_type = f"image/{'jpeg' if ext == 'jpg' else ext}"
+    return f"{uuid.uuid4()}.{ext}", {"content-type": content_type, "upsert": "true"}
 
-        # Skip non-files
-        if not os.path.isfile(filepath):
-            continue
+# ---------- Store ----------
+class SupabaseStore:
+    """
+    Every database and storage call, over one Supabase client and its pooled
+    keep-alive HTTP transport. Thread-safe, so the web tier's request threads,
+    the job pool and the upload pool all share connections. Pass `client` to run
+    over an existing (or fake) supabase.Client instead of building one.
+    """
+
+    def __init__(
+        self,
+        url: Optional[str] = SUPABASE_URL,
+        key: Optional[str] = SUPABASE_SERVICE_ROLE,
+        *,
+        client: Optional[Client] = None,
+        retry: Optional[RetryPolicy] = None,
+        upload_retry: Optional[RetryPolicy] = None,
+        upload_concurrency: int = UPLOAD_CONCURRENCY,
+        **transport: Any,
+    ):
+        self.url = url
+        self.retry = retry or RetryPolicy(SUPABASE_MAX_RETRIES)
+        self.upload_retry = upload_retry or RetryPolicy(UPLOAD_MAX_RETRIES)
+        self._http: Optional[httpx.Client] = None
+        if client is None:
+            if not url or not key:
+                raise RuntimeError("Missing SUPABASE_URL or SUPABASE_SERVICE_ROLE in .env")
+            self._http = httpx.Client(**transport_options(**transport))
+            client = create_client(url, key, ClientOptions(httpx_client=self._http))
+        self.client = client
+        # Uploads fan out over this pool; they all go through the shared transport
+        self._upload_pool = ThreadPoolExecutor(max_workers=upload_concurrency, thread_name_prefix="storage-upload")
+
+    def close(self) -> None:
+        self._upload_pool.shutdown(wait=True)
+        if self._http is not None:
+            self._http.close()
 
-        # Restrict to common image extensions
-        if not filename.lower().endswith((".png", ".jpg", ".jpeg", ".gif", ".webp")):
-            continue
+    def _execute(self, query: Any, operation: str, idempotent: bool = True) -> Any:
+        """query.execute() with self.retry; writes are only retried if the request never went out."""
+        for attempt in range(self.retry.retries + 1):
+            try:
+                return query.execute()
+            except Exception as e:
+                if attempt == self.retry.retries or not _is_retryable_query(e, idempotent):
+                    raise
+                _count_retry(operation)
+                time.sleep(self.retry.delay(attempt))
 
-        # Generate unique filename to avoid collisions
-        ext = filename.split(".")[-1]
-        unique_name = f"{uuid.uuid4()}.{ext}"
+    # ---------- Users ----------
+    @traced("supabase.verify_user")
+    def verify_user(self, email: str, password: str) -> Optional[AppUser]:
+        """Lookup a user by email and check the password against its hash, hashing on auth's pool."""
+        rows = self._execute(_credentials_query(self.client, email), "verify_user").data or []
+        row = rows[0] if rows else None
+        ok, new_hash = off_thread(verify_credentials, password, row)
+        if not ok:
+            return None
+        if new_hash:
+            # Plaintext row or an older work factor: store a current hash
+            self._execute(_password_update(self.client, row["id"], new_hash), "verify_user")
+        return _only(row, APP_USER_COLUMNS)  # type: ignore
 
+    @traced("supabase.create_account")
+    def create_account(self, email: str, password: str, name: str, role: int) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+        """Insert a new user, with a hashed password, in one round trip. Returns (user_dict, error)."""
+        password_hash = off_thread(hash_password, password)
         try:
-            with open(filepath, "rb") as f:
-                supabase.storage.from_(BUCKET_NAME).upload(unique_name, f)
-            
-            # Get public URL
-            public_url = supabase.storage.from_(BUCKET_NAME).get_public_url(unique_name)
-            uploaded_files.append(public_url)
-            print(f"✅ Uploaded {filename} → {public_url}")
+            res = self._execute(_user_insert(self.client, email, password_hash, name, role), "create_account", idempotent=False)
+        except APIError as e:
+            return None, _account_error(e)
+        if not res.data:
+            return None, "Failed to create user"
+        return _only(res.data[0], USER_COLUMNS), None
 
-        except Exception as e:
-            print(f"❌ Failed to upload {filename}: {e}")
+    # ---------- Lessons ----------
+    # Reads below are served through lesson_cache; every write calls
+    # lesson_cache.invalidate() so the next read goes back to the database.
+    @traced("supabase.get_lessons")
+    @lesson_cache.cached
+    def get_lessons(self, user_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        return self._execute(_lessons_query(self.client), "get_lessons").data or []
 
-    return uploaded_files
+    @traced("supabase.get_lessons_page")
+    @lesson_cache.cached
+    def get_lessons_page(
+        self,
+        limit: int = 50,
+        cursor: Optional[str] = None,
+        include_steps: bool = True,
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """
+        One page of lessons, newest first, in a single query: steps are embedded
+        through the steps.lessons_id foreign key instead of one get_steps per lesson.
+        Keyset-paginated on (created_at, lesson_id); pass the returned cursor back to
+        get the next page, it is None on the last one. Raises ValueError on a bad cursor.
+        """
+        query = _lessons_page_query(self.client, limit, cursor, include_steps)
+        return _lessons_page(self._execute(query, "get_lessons_page").data or [], limit, include_steps)
 
+    @traced("supabase.get_steps")
+    @lesson_cache.cached
+    def get_steps(self, lesson_id: int) -> List[Dict[str, Any]]:
+        return self._execute(_steps_query(self.client, lesson_id), "get_steps").data or []
 
-def clear_generated_images():
-    """
-    Recursively deletes all files and folders inside generated_images.
-    Keeps the generated_images folder itself.
-    """
-    if not os.path.exists(GENERATED_DIR):
-        print(f"⚠️ Directory not found: {GENERATED_DIR}")
-        return
+    @traced("supabase.add_lesson")
+    def add_lesson(
+        self,
+        lesson_name: str,
+        lesson_description: str,
+        lesson_level: str,
+    ) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+        insert_lesson = self._execute(
+            _lesson_insert(self.client, lesson_name, lesson_description, lesson_level), "add_lesson", idempotent=False,
+        )
+        if not insert_lesson.data:
+            return None, "Failed to create lesson"
+
+        lesson_cache.invalidate()
+        return _only(insert_lesson.data[0], LESSON_COLUMNS), None
 
-    for item in os.listdir(GENERATED_DIR):
-        path = os.path.join(GENERATED_DIR, item)
+    @traced("supabase.add_lesson_with_steps")
+    def add_lesson_with_steps(
+        self,
+        lesson_name: str,
+        lesson_description: str,
+        lesson_level: str,
+        steps: List[Dict[str, Any]],
+        job_id: Optional[str] = None,
+    ) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+        """
+        Persist a lesson and all of its steps together. Uses the
+        create_lesson_with_steps RPC (sql/create_lesson_with_steps.sql) so it is
+        one round-trip and atomic; if that function isn't installed, falls back to
+        add_lesson + one bulk add_steps and deletes the lesson if the steps fail.
+        With a `job_id` the RPC saves each job at most once (and so can be retried):
+        saving it again returns the lesson it already created.
+        """
         try:
-            if os.path.isfile(path) or os.path.islink(path):
-                os.unlink(path)  # remove file or symlink
-            elif os.path.isdir(path):
-                shutil.rmtree(path)  # remove folder and its contents
-        except Exception as e:
-            print(f"❌ Failed to delete {path}: {e}")
-
-    print(f"✅ Cleared contents of {GENERATED_DIR}")
+            rpc = _create_lesson_rpc(self.client, lesson_name, lesson_description, lesson_level, steps, job_id)
+            res = self._execute(rpc, "add_lesson_with_steps", idempotent=job_id is not None)
+            if not res.data:
+                return None, "Failed to create lesson"
+            lesson_cache.invalidate()
+            return res.data, None
+        except APIError as e:
+            if e.code != "PGRST202":  # PostgREST: function not found
+                return None, e.message or "Failed to create lesson"
+            print("⚠️ create_lesson_with_steps RPC missing, apply sql/create_lesson_with_steps.sql")
+
+        lesson, error = self.add_lesson(lesson_name, lesson_description, lesson_level)
+        if error:
+            return None, error
+        try:
+            _, error = self.add_steps(lesson["lesson_id"], steps)
+        except APIError as e:
+            error = e.message or "Failed to insert steps"
+        if error:
+            # Don't leave an orphaned lesson without its steps
+            self._execute(self.client.table("lessons").delete().eq("lesson_id", lesson["lesson_id"]), "add_lesson_with_steps")
+            lesson_cache.invalidate()
+            return None, error
+        return lesson, None
+
+    # ---------- Steps ----------
+    @traced("supabase.add_steps")
+    def add_steps(
+        self,
+        lesson_id: int,
+        steps: List[Dict[str, Any]],
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        if not steps:
+            return [], None
+
+        res = self._execute(_steps_insert(self.client, lesson_id, steps), "add_steps", idempotent=False)
+        if getattr(res, "error", None) or not res.data:
+            error_message = getattr(res, "message", "Failed to insert steps")
+            return [], error_message
+
+        lesson_cache.invalidate()
+        return sorted(res.data, key=lambda x: x["step_number"]), None
+
+    @traced("supabase.add_step")
+    def add_step(
+        self,
+        lesson_id: int,
+        step_number: int,
+        step_description: str,
+        step_image: Optional[str] = None,
+        step_thumbnail: Optional[str] = None,
+    ) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+        step = {"step_number": step_number, "step_description": step_description,
+                "image_path": step_image, "thumbnail_path": step_thumbnail}
+        res = self._execute(_steps_insert(self.client, lesson_id, [step]), "add_step", idempotent=False)
+        if not res.data:
+            error_message = getattr(res, "message", "Failed to insert step")
+            return None, error_message
+        lesson_cache.invalidate()
+        rows = res.data or []
+        return (rows[0] if rows else None), None
+
+    # ---------- Storage ----------
+    def _upload_one(self, source: str, data: bytes, ext: str) -> UploadResult:
+        object_name, file_options = _object_name(ext)
+
+        with span("supabase.upload", bytes=len(data)) as stage:
+            for attempt in range(self.upload_retry.retries + 1):
+                try:
+                    self.client.storage.from_(BUCKET_NAME).upload(object_name, data, file_options)
+                    url = public_url(object_name, self.url)
+                    print(f"✅ Uploaded {source} → {url}")
+                    return {"source": source, "object_name": object_name, "url": url, "error": None}
+                except Exception as e:
+                    if attempt == self.upload_retry.retries or not _is_transient(e):
+                        print(f"❌ Failed to upload {source}: {e}")
+                        stage.add(failures=1)
+                        return {"source": source, "object_name": None, "url": None, "error": str(e)}
+                    stage.add(retries=1)
+                    time.sleep(self.upload_retry.delay(attempt))
+
+    def upload_many(self, items: List[Tuple[str, bytes, str]]) -> List[UploadResult]:
+        """
+        Upload (source, data, ext) items in parallel over the store's upload pool.
+        Results come back in the same order as `items`, one per item, failures included.
+        """
+        upload_one = bind(self._upload_one)  # pool threads record into the calling job's trace
+        return list(self._upload_pool.map(lambda item: upload_one(*item), items))
+
+    def upload_images(self, images: List[bytes], ext: str = "png") -> List[UploadResult]:
+        """Upload in-memory image bytes straight to storage. Results are in the same order as `images`."""
+        return self.upload_many([(f"image {i}", data, ext) for i, data in enumerate(images, 1)])
+
+_store: Optional[SupabaseStore] = None
+_store_lock = threading.Lock()
+
+def get_store() -> SupabaseStore:
+    """The process-wide store, built on first use so importing this module never needs credentials or the network."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = SupabaseStore()
+        return _store
+
+def set_store(store: SupabaseStore) -> None:
+    """Replace the process-wide store, e.g. with one over a fake client (bench/offline.py)."""
+    global _store
+    with _store_lock:
+        _store = store
@@ -0,0 +1,24 @@
+# Unit tests for the backend. Nothing here needs keys or the network: model and
+# Supabase clients are the fakes from bench/offline.py or small stubs.
+#
+#   pip install -r requirements-dev.txt
+#   cd backend && python -m pytest tests
+
+import os
+import sys
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)  # the backend modules import each other as top-level names
+
+
+@pytest.fixture(autouse=True)
+def fresh_lesson_cache():
+    # Cached listings are keyed without the store, so one test's pages must not reach the next
+    from cache import lesson_cache
+
+    lesson_cache.invalidate()
+    yield
+    lesson_cache.invalidate()
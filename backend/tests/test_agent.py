@@ -0,0 +1,87 @@
+import asyncio
+import types
+
+import pytest
+
+from multi_tool_agent.agent import AgentPipeline, StepImageMismatchError, _check_step_images, get_agent_pipeline
+
+
+def record(n, paths=("step.png",)):
+    return {"step_number": n, "paths": list(paths)}
+
+
+def test_one_image_per_step_passes():
+    _check_step_images(["a", "b"], {1: record(1), 2: record(2)})
+
+
+@pytest.mark.parametrize("images", [
+    {1: record(1)},                              # missing step 2
+    {1: record(1), 2: record(2, paths=())},      # step 2 rendered nothing
+    {1: record(1), 2: record(2), 3: record(3)},  # a step that doesn't exist
+])
+def test_missing_or_extra_images_fail(images):
+    with pytest.raises(StepImageMismatchError):
+        _check_step_images(["a", "b"], images)
+
+
+def test_no_steps_fail():
+    with pytest.raises(StepImageMismatchError):
+        _check_step_images([], {})
+
+
+class FakeSessions:
+    def __init__(self, fail_deletes=False):
+        self.live = set()
+        self.fail_deletes = fail_deletes
+
+    async def create_session(self, app_name, user_id, state=None):
+        session = types.SimpleNamespace(id=f"s{len(self.live)}_{user_id}")
+        self.live.add(session.id)
+        return session
+
+    async def delete_session(self, app_name, user_id, session_id):
+        if self.fail_deletes:
+            raise RuntimeError("delete failed")
+        self.live.discard(session_id)
+
+
+def pipeline(sessions, **kwargs):
+    pipeline = AgentPipeline(**kwargs)
+    pipeline.session_service = sessions
+    return pipeline
+
+
+def test_open_sessions_are_never_evicted():
+    async def run():
+        p = pipeline(FakeSessions(), max_sessions=2, ttl=0)
+        opened = [await p.open_session(f"u{n}") for n in range(4)]
+        return p, opened
+
+    p, opened = asyncio.run(run())
+    assert p.session_service.live == {s.id for s in opened}
+    assert p.session_count() == 4
+
+
+def test_leftover_sessions_are_evicted():
+    async def run():
+        sessions = FakeSessions(fail_deletes=True)
+        p = pipeline(sessions, max_sessions=2, ttl=0)
+        first = await p.open_session("u1")
+        with pytest.raises(RuntimeError):
+            await p.close_session("u1", first.id)
+        sessions.fail_deletes = False
+        await p.open_session("u2")
+        return sessions, first
+
+    sessions, first = asyncio.run(run())
+    assert first.id not in sessions.live
+
+
+def test_each_event_loop_gets_its_own_pipeline():
+    async def twice():
+        return get_agent_pipeline(), get_agent_pipeline()
+
+    a1, a2 = asyncio.run(twice())
+    b1, _ = asyncio.run(twice())
+    assert a1 is a2
+    assert a1 is not b1
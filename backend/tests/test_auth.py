@@ -0,0 +1,102 @@
+import pytest
+
+import auth
+from auth import RateLimiter, check_password, hash_password, needs_rehash, verify_credentials
+
+
+@pytest.fixture(autouse=True)
+def fresh_login_state(monkeypatch):
+    monkeypatch.setattr(auth, "login_limiter", RateLimiter(burst=3, per_minute=6))
+    monkeypatch.setattr(auth, "client_limiter", RateLimiter(burst=10, per_minute=60))
+    monkeypatch.setattr(auth, "login_cache", auth.LoginCache())
+
+
+def test_rate_limiter_allows_burst_then_reports_wait():
+    limiter = RateLimiter(burst=2, per_minute=60)
+    assert limiter.acquire("k") is None
+    assert limiter.acquire("k") is None
+    wait = limiter.acquire("k")
+    assert wait is not None and 0 < wait <= 1.0
+    assert limiter.acquire("other") is None
+
+
+def test_rate_limiter_takes_no_token_when_any_key_is_empty():
+    limiter = RateLimiter(burst=1, per_minute=60)
+    limiter.acquire("user")
+    assert limiter.acquire("user", "ip") is not None
+    assert limiter.acquire("ip") is None  # the refused attempt didn't spend it
+
+
+def test_rate_limiter_refund_gives_token_back():
+    limiter = RateLimiter(burst=1, per_minute=1)
+    limiter.acquire("k")
+    limiter.refund("k")
+    assert limiter.acquire("k") is None
+
+
+def test_rate_limiter_drops_least_recent_keys():
+    limiter = RateLimiter(burst=1, per_minute=1, max_keys=2)
+    for key in ("a", "b", "c"):
+        limiter.acquire(key)
+    assert limiter.acquire("a") is None  # forgotten, so it starts full again
+    assert limiter.acquire("c") is not None
+
+
+def test_only_failed_logins_use_up_the_limit():
+    users = {"ana@school": "right"}
+
+    def verify_user(email, password):
+        return {"role": 1} if users.get(email) == password else None
+
+    for _ in range(10):
+        user, wait = auth.authenticate(verify_user, "ana@school", "right", "10.0.0.1")
+        assert user and wait is None
+
+    for _ in range(3):
+        assert auth.authenticate(verify_user, "bo@school", "wrong", "10.0.0.1") == (None, None)
+    user, wait = auth.authenticate(verify_user, "bo@school", "wrong", "10.0.0.1")
+    assert user is None and wait >= 1
+
+    # Same address, different user: the shared client bucket is larger
+    users["cy@school"] = "right"
+    assert auth.authenticate(verify_user, "cy@school", "right", "10.0.0.1")[0] == {"role": 1}
+
+
+def test_cached_login_skips_verification():
+    calls = []
+
+    def verify_user(email, password):
+        calls.append(email)
+        return {"role": 2}
+
+    auth.authenticate(verify_user, "ana@school", "pw", None)
+    auth.authenticate(verify_user, "ana@school", "pw", None)
+    assert calls == ["ana@school"]
+    auth.authenticate(verify_user, "ana@school", "other", None)
+    assert len(calls) == 2
+
+
+def test_password_hash_round_trip():
+    stored = hash_password("secret", n=2 ** 10)
+    assert check_password("secret", stored)
+    assert not check_password("Secret", stored)
+    assert not check_password("secret", None)
+    assert needs_rehash(stored) == (auth.PASSWORD_HASH_N != 2 ** 10)
+
+
+@pytest.mark.parametrize("stored", [
+    "scrypt$lots$8$1$c2FsdA==$ZGlnZXN0",          # non-numeric n
+    "scrypt$1024$8$1$not base64!$ZGlnZXN0",        # bad salt
+    "scrypt$1024$8$1$c2FsdA==$%%%",                # bad digest
+    "scrypt$1000$8$1$c2FsdA==$ZGlnZXN0",           # n not a power of two
+    f"scrypt${2 ** 40}$8$1$c2FsdA==$ZGlnZXN0",     # beyond scrypt's limits
+    "bcrypt$whatever",
+])
+def test_unusable_hashes_fail_instead_of_raising(stored):
+    assert check_password("secret", stored) is False
+
+
+def test_plaintext_rows_are_upgraded_on_success():
+    ok, new_hash = verify_credentials("secret", {"password": "secret", "password_hash": None})
+    assert ok and check_password("secret", new_hash)
+    assert verify_credentials("nope", {"password": "secret", "password_hash": None}) == (False, None)
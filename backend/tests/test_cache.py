@@ -0,0 +1,74 @@
+import asyncio
+import time
+
+from cache import Cache, TTLCache
+
+
+def counting_cache():
+    cache = Cache(TTLCache(), "test", ttl=60)
+    calls = []
+
+    @cache.cached
+    def lessons(limit):
+        calls.append(limit)
+        return [{"limit": limit}]
+
+    return cache, lessons, calls
+
+
+def test_repeated_reads_are_served_from_cache():
+    cache, lessons, calls = counting_cache()
+    assert lessons(5) == lessons(5) == [{"limit": 5}]
+    assert calls == [5]
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_arguments_are_part_of_the_key():
+    _, lessons, calls = counting_cache()
+    lessons(5)
+    lessons(10)
+    assert calls == [5, 10]
+
+
+def test_invalidate_forces_fresh_reads():
+    cache, lessons, calls = counting_cache()
+    lessons(5)
+    cache.invalidate()
+    lessons(5)
+    assert calls == [5, 5]
+
+
+def test_methods_share_entries_across_instances_and_sync_async():
+    cache = Cache(TTLCache(), "test", ttl=60)
+    calls = []
+
+    class Store:
+        @cache.cached
+        def get_steps(self, lesson_id):
+            calls.append("sync")
+            return [lesson_id]
+
+    class AsyncStore:
+        @cache.cached_async
+        async def get_steps(self, lesson_id):
+            calls.append("async")
+            return [lesson_id]
+
+    assert Store().get_steps(1) == [1]
+    assert Store().get_steps(1) == [1]
+    assert asyncio.run(AsyncStore().get_steps(1)) == [1]
+    assert calls == ["sync"]
+
+
+def test_ttl_cache_expires_and_evicts_least_recent():
+    backend = TTLCache(maxsize=2)
+    backend.set("short", "1", ttl=1)
+    backend._data["short"] = (time.monotonic() - 1, "1")  # already past its TTL
+    assert backend.get("short") is None
+
+    backend.set("a", "1")
+    backend.set("b", "2")
+    backend.get("a")
+    backend.set("c", "3")
+    assert backend.get("b") is None
+    assert backend.get("a") == "1" and backend.get("c") == "3"
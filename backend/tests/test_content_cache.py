@@ -0,0 +1,16 @@
+import pytest
+
+from multi_tool_agent.content_cache import similarity_text
+
+
+def test_similarity_ignores_label_case_and_spacing():
+    assert similarity_text("Step 2. Solve  x + 3 = 5") == similarity_text("step 2: solve x + 3 = 5")
+
+
+@pytest.mark.parametrize("a, b", [
+    ("Step 2. Solve x + 3 = 5", "Step 2. Solve x - 3 = 5"),
+    ("3/4 + 1/4", "3*4 - 1*4"),
+    ("2.5 - x", "5 - x"),
+])
+def test_similarity_keeps_operators_and_digits(a, b):
+    assert similarity_text(a) != similarity_text(b)
@@ -0,0 +1,87 @@
+import os
+import time
+
+import pytest
+
+from jobs import DONE, FAILED, QUEUED, RUNNING, QueueFullError
+from jobqueue import JobQueue
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return JobQueue(path=os.path.join(tmp_path, "jobs.sqlite3"), lease=60, max_attempts=2)
+
+
+def expire_lease(queue, job_id):
+    with queue._lock:
+        queue._db.execute("UPDATE lesson_jobs SET lease_expires = ? WHERE id = ?", (time.time() - 1, job_id))
+
+
+def test_claims_oldest_job_once(queue):
+    first = queue.enqueue(["a"])
+    second = queue.enqueue(["b"])
+
+    assert queue.claim("w1") == (first, ["a"])
+    assert queue.claim("w2") == (second, ["b"])
+    assert queue.claim("w3") is None
+    assert queue.get(first)["status"] == RUNNING
+
+
+def test_enqueue_respects_queue_depth(queue):
+    queue.enqueue(["a"], queue_depth=1)
+    with pytest.raises(QueueFullError):
+        queue.enqueue(["b"], queue_depth=1)
+    queue.claim("w1")  # running jobs no longer count as waiting
+    queue.enqueue(["b"], queue_depth=1)
+
+
+def test_complete_records_result_and_done_event(queue):
+    job_id = queue.enqueue(["a"])
+    queue.claim("w1")
+    queue.update(job_id, "saving", uploaded=3)
+    queue.complete(job_id, "w1", {"lesson_id": 7})
+
+    row = queue.get(job_id)
+    assert row["status"] == DONE and row["result"] == {"lesson_id": 7}
+    assert row["progress"]["uploaded"] == 3
+    assert queue.events(job_id, 0)[-1] == {"type": "done", "lesson": {"lesson_id": 7}}
+
+
+def test_expired_lease_is_reclaimed_and_old_owner_is_ignored(queue):
+    job_id = queue.enqueue(["a"])
+    queue.claim("w1")
+    assert queue.claim("w2") is None  # still leased
+
+    expire_lease(queue, job_id)
+    assert queue.claim("w2") == (job_id, ["a"])
+    assert not queue.renew(job_id, "w1")
+    assert queue.renew(job_id, "w2")
+
+    queue.complete(job_id, "w1", {"lesson_id": 1})  # stale owner: no effect
+    assert queue.get(job_id)["status"] == RUNNING
+    assert {"type": "progress", "stage": "retrying", "attempt": 2} in queue.events(job_id, 0)
+
+
+def test_job_fails_after_max_attempts(queue):
+    job_id = queue.enqueue(["a"])
+    queue.claim("w1")
+    expire_lease(queue, job_id)
+    queue.claim("w2")
+    expire_lease(queue, job_id)
+
+    assert queue.claim("w3") is None
+    row = queue.get(job_id)
+    assert row["status"] == FAILED
+    assert "after 2 attempts" in row["error"]
+
+
+def test_prune_drops_old_finished_jobs(queue):
+    done = queue.enqueue(["a"])
+    queue.claim("w1")
+    queue.complete(done, "w1", {})
+    waiting = queue.enqueue(["b"])
+
+    time.sleep(0.01)
+    queue.prune(ttl=0)
+    assert queue.get(done) is None and queue.events(done, 0) == []
+    assert queue.get(waiting)["status"] == QUEUED
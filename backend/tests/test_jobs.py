@@ -0,0 +1,87 @@
+import threading
+import time
+
+import pytest
+
+from jobs import DONE, FAILED, QUEUED, RUNNING, JobManager, QueueFullError
+
+
+def wait_finished(job, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not job.finished and time.monotonic() < deadline:
+        job.wait_events(len(job.events), 0.05)
+    assert job.finished, f"job still {job.status}"
+
+
+def test_runs_job_and_records_result_and_events():
+    def run(job, topic):
+        job.update(stage="generating_steps", steps_generated=2)
+        job.emit({"type": "steps", "steps": ["a", "b"]})
+        return {"topic": topic}
+
+    manager = JobManager(run, workers=1)
+    job = manager.submit("algebra")
+    wait_finished(job)
+    manager.shutdown()
+
+    assert job.status == DONE
+    assert job.result == {"topic": "algebra"}
+    types = [event["type"] for event in job.events]
+    assert types == ["progress", "steps", "done"]
+    assert job.events[-1]["lesson"] == {"topic": "algebra"}
+
+
+def test_failed_job_reports_its_error():
+    def run(job):
+        raise RuntimeError("no steps")
+
+    manager = JobManager(run, workers=1)
+    job = manager.submit()
+    wait_finished(job)
+    manager.shutdown()
+
+    assert job.status == FAILED
+    assert job.error == "no steps"
+    assert job.events[-1] == {"type": "error", "message": "no steps"}
+
+
+def test_queue_depth_counts_waiting_jobs_only():
+    release = threading.Event()
+    started = threading.Event()
+
+    def run(job):
+        started.set()
+        release.wait(5)
+
+    manager = JobManager(run, workers=1, queue_depth=1)
+    running = manager.submit()
+    assert started.wait(5)
+    waiting = manager.submit()  # the one free queue slot
+    with pytest.raises(QueueFullError):
+        manager.submit()
+    assert manager.stats()[RUNNING] == 1 and manager.stats()[QUEUED] == 1
+
+    release.set()
+    wait_finished(running)
+    wait_finished(waiting)
+    manager.submit()  # slots free up once jobs start
+    manager.shutdown()
+
+
+def test_finished_jobs_are_forgotten_after_ttl():
+    manager = JobManager(lambda job: None, workers=1, ttl=0)
+    old = manager.submit()
+    wait_finished(old)
+    time.sleep(0.01)
+    manager.submit()  # pruning happens on submit
+    manager.shutdown()
+    assert manager.get(old.id) is None
+
+
+def test_finished_jobs_stay_pollable_within_ttl():
+    manager = JobManager(lambda job: None, workers=1, ttl=3600)
+    old = manager.submit()
+    wait_finished(old)
+    manager.submit()
+    manager.shutdown()
+    assert manager.get(old.id) is old
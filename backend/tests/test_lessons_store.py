@@ -0,0 +1,72 @@
+import base64
+import json
+
+import pytest
+
+from bench.offline import FakeSupabase
+from sqlcommands import RetryPolicy, SupabaseStore, _decode_cursor, _encode_cursor
+
+
+@pytest.fixture
+def store():
+    fake = FakeSupabase(latency=0, upload_latency=0, seed_lessons=7, steps=2)
+    return SupabaseStore(client=fake, retry=RetryPolicy(0)), fake
+
+
+def test_cursor_round_trip():
+    lesson = {"created_at": "2025-01-01T00:00:00.001000+00:00", "lesson_id": 42}
+    assert _decode_cursor(_encode_cursor(lesson)) == ("2025-01-01T00:00:00.001000+00:00", 42)
+
+
+def test_pages_cover_every_lesson_once_newest_first(store):
+    store, fake = store
+    seen, cursor = [], None
+    while True:
+        page, cursor = store.get_lessons_page(limit=3, cursor=cursor)
+        seen.extend(lesson["lesson_id"] for lesson in page)
+        assert all([s["step_number"] for s in lesson["steps"]] == [1, 2] for lesson in page)
+        if cursor is None:
+            break
+    assert seen == sorted((row["lesson_id"] for row in fake.tables["lessons"]), reverse=True)
+
+
+def test_last_full_page_has_no_cursor(store):
+    store, _ = store
+    page, cursor = store.get_lessons_page(limit=7)
+    assert len(page) == 7 and cursor is None
+
+
+def test_bad_cursor_is_a_value_error(store):
+    store, _ = store
+    with pytest.raises(ValueError):
+        store.get_lessons_page(cursor="not-a-cursor")
+
+
+@pytest.mark.parametrize("created_at", [
+    '2025-01-01",lesson_id.gt.0)',  # would rewrite the or_() filter
+    "yesterday",
+    17,
+])
+def test_cursor_timestamp_must_be_iso(store, created_at):
+    store, _ = store
+    cursor = base64.urlsafe_b64encode(json.dumps([created_at, 1]).encode()).decode()
+    with pytest.raises(ValueError):
+        store.get_lessons_page(cursor=cursor)
+
+
+def test_new_lesson_invalidates_cached_pages(store):
+    store, _ = store
+    first, _ = store.get_lessons_page(limit=1, include_steps=False)
+    lesson, error = store.add_lesson_with_steps("New", "desc", "1", [{"step_number": 1, "step_description": "Step 1."}])
+    assert error is None
+    latest, _ = store.get_lessons_page(limit=1, include_steps=False)
+    assert latest[0]["lesson_id"] == lesson["lesson_id"] != first[0]["lesson_id"]
+
+
+def test_saving_a_job_twice_returns_the_same_lesson(store):
+    store, fake = store
+    steps = [{"step_number": 1, "step_description": "Step 1."}]
+    first, _ = store.add_lesson_with_steps("New", "desc", "1", steps, job_id="job-1")
+    again, _ = store.add_lesson_with_steps("New", "desc", "1", steps, job_id="job-1")
+    assert again["lesson_id"] == first["lesson_id"]
+    assert sum(1 for row in fake.tables["lessons"] if row.get("job_id") == "job-1") == 1
@@ -0,0 +1,66 @@
+from types import SimpleNamespace
+
+import httpx
+import pytest
+
+from sqlcommands import RetryPolicy, SupabaseStore, _is_transient
+
+
+class StorageError(Exception):
+    """Shaped like storage3's StorageApiError: the HTTP status on .status."""
+
+    def __init__(self, status):
+        super().__init__(f"storage error {status}")
+        self.status = status
+
+
+class FlakyBucket:
+    """Fails the first upload with `error`, after the object was (possibly) stored."""
+
+    def __init__(self, error):
+        self.error = error
+        self.calls = []
+
+    def upload(self, path, data, file_options=None):
+        self.calls.append((path, file_options))
+        if len(self.calls) == 1 and self.error is not None:
+            raise self.error
+        return {"Key": path}
+
+
+def store_over(bucket):
+    client = SimpleNamespace(storage=SimpleNamespace(from_=lambda name: bucket))
+    return SupabaseStore("http://supabase.test", client=client, upload_retry=RetryPolicy(2, base_delay=0))
+
+
+@pytest.mark.parametrize("error, transient", [
+    (httpx.ReadTimeout("timed out"), True),
+    (httpx.ConnectError("reset"), True),
+    (StorageError(503), True),
+    (StorageError(429), True),
+    (Exception({"statusCode": "502"}), True),
+    (StorageError(409), False),
+    (StorageError(400), False),
+    (TypeError("bug"), False),
+    (ValueError("bad key"), False),
+])
+def test_only_network_and_server_errors_are_transient(error, transient):
+    assert _is_transient(error) is transient
+
+
+def test_retry_after_timeout_reuses_the_name_with_upsert():
+    bucket = FlakyBucket(httpx.ReadTimeout("timed out"))
+    [result] = store_over(bucket).upload_images([b"png"])
+
+    assert result["error"] is None and result["url"].endswith(result["object_name"])
+    (first, options), (second, _) = bucket.calls
+    assert first == second == result["object_name"]
+    assert options["upsert"] == "true"
+
+
+def test_non_transient_error_is_not_retried():
+    bucket = FlakyBucket(TypeError("bug"))
+    [result] = store_over(bucket).upload_images([b"png"])
+
+    assert result["url"] is None and "bug" in result["error"]
+    assert len(bucket.calls) == 1
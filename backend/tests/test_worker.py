@@ -0,0 +1,45 @@
+import os
+import threading
+
+import pytest
+
+import worker
+from jobqueue import JobQueue
+
+
+def test_lost_lease_stops_the_job_before_saving(tmp_path):
+    queue = JobQueue(path=os.path.join(tmp_path, "jobs.sqlite3"), lease=60)
+    job = worker.QueueJobHandle(queue, queue.enqueue(["a"]))
+    job.update(stage="generating_images")
+
+    job.lease_lost.set()
+    with pytest.raises(worker.LeaseLostError):
+        job.update(stage="saving")
+
+
+def test_keep_lease_flags_a_lost_lease(tmp_path):
+    queue = JobQueue(path=os.path.join(tmp_path, "jobs.sqlite3"), lease=0)
+    job_id = queue.enqueue(["a"])
+    queue.claim("w1")
+    queue.claim("w2")  # lease=0, so it has already expired and w2 takes over
+
+    job = worker.QueueJobHandle(queue, job_id)
+    stop = threading.Event()
+    worker._keep_lease(queue, job, "w1", stop)
+    assert job.lease_lost.is_set()
+
+
+def test_job_past_timeout_is_released_for_another_worker(tmp_path):
+    queue = JobQueue(path=os.path.join(tmp_path, "jobs.sqlite3"), lease=1)
+    job_id = queue.enqueue(["a"])
+    queue.claim("w1")
+
+    job = worker.QueueJobHandle(queue, job_id)
+    stop = threading.Event()
+    keeper = threading.Thread(target=worker._keep_lease, args=(queue, job, "w1", stop, 0))
+    keeper.start()
+    assert job.lease_lost.wait(5)
+    stop.set()  # the job stopped, so the worker doesn't need restarting
+    keeper.join(5)
+
+    assert queue.claim("w2") == (job_id, ["a"])
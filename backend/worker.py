@@ -0,0 +1,184 @@
+# Lesson generation workers, separate from the web tier.
+# With LESSON_JOB_BACKEND=queue the server only records /createLesson requests in
+# the durable queue (jobqueue.py); these processes claim them and run the pipeline,
+# so generation scales across cores and workers restart without touching the web tier.
+#
+#   cd backend && python worker.py [processes]
+#
+# A supervisor process keeps `processes` workers alive, restarting any that die;
+# a job held by a worker that died is picked up again once its lease expires.
+# Leases are renewed from a side thread, so a job that hangs would keep its lease
+# forever: after LESSON_JOB_TIMEOUT the worker releases it for another attempt, and
+# if the job still hasn't stopped one lease later the worker process exits.
+
+import os
+import sys
+import time
+import uuid
+import signal
+import asyncio
+import threading
+import multiprocessing
+from typing import Any, Dict, Optional
+from dotenv import load_dotenv
+
+from sqlcommands import get_store
+from lessons import lesson_steps, with_steps
+from jobqueue import JobQueue, LESSON_JOB_TIMEOUT, LESSON_QUEUE_POLL
+from multi_tool_agent.tracing import trace
+
+load_dotenv()
+
+LESSON_WORKER_PROCESSES = int(os.getenv("LESSON_WORKER_PROCESSES", str(os.cpu_count() or 1)))
+
+
+def build_lesson(job, title, topic, level, description, force_regenerate=False):
+    """
+    Generate, upload and persist one lesson. `job` is anything with id, update() and
+    emit(): a jobs.Job on the server's thread pool, or a QueueJobHandle in a worker.
+    """
+    # Imported on first job so the web tier boots without loading ADK and the model SDKs
+    from multi_tool_agent.agent import main
+
+    store = get_store()
+
+    # Every stage below records spans into this job's trace, logged as one JSON line at the end
+    with trace(job.id):
+        # Images go from gpt-image-1 to storage in memory; main returns their URL's
+        steps_array, file_urls, thumbnail_urls = asyncio.run(main(
+            topic, description, level,
+            upload=store.upload_images, progress=job.update, job_id=job.id, force_regenerate=force_regenerate,
+            on_event=job.emit,
+        ))
+
+        # Lesson and steps land together, so a failure can't leave an orphaned lesson.
+        # A worker that lost its lease stops at this update (QueueJobHandle raises
+        # LeaseLostError), and the job id makes a save that races the new owner a no-op.
+        job.update(stage="saving")
+        steps = lesson_steps(steps_array, file_urls, thumbnail_urls)
+        lesson, error = store.add_lesson_with_steps(title, description, level, steps, job_id=job.id)
+        if error:
+            raise RuntimeError(error)
+
+    job.update(stage="done")
+    return with_steps(lesson, steps)
+
+
+class LeaseLostError(RuntimeError):
+    """The job's lease expired and another worker may have claimed it."""
+
+
+class QueueJobHandle:
+    """
+    The job.update / job.emit callbacks build_lesson expects, written to the queue.
+    Once `lease_lost` is set they raise LeaseLostError, so the job stops at its next
+    progress report instead of saving a lesson its new owner is also building.
+    """
+
+    def __init__(self, queue, job_id: str):
+        self.queue = queue
+        self.id = job_id
+        self.lease_lost = threading.Event()
+
+    def update(self, stage: Optional[str] = None, **progress: int) -> None:
+        self._check_lease()
+        self.queue.update(self.id, stage, **progress)
+
+    def emit(self, event: Dict[str, Any]) -> None:
+        self._check_lease()
+        self.queue.emit(self.id, event)
+
+    def _check_lease(self) -> None:
+        if self.lease_lost.is_set():
+            raise LeaseLostError(f"Lost the lease on job {self.id}")
+
+
+def _keep_lease(queue, job: QueueJobHandle, worker_id: str, stop: threading.Event, timeout: float = LESSON_JOB_TIMEOUT) -> None:
+    # Renew well before expiry; if the lease was lost the job is someone else's now
+    deadline = time.monotonic() + timeout
+    while not stop.wait(queue.lease / 3):
+        if time.monotonic() >= deadline:
+            print(f"⚠️  Job {job.id} ran past {timeout:.0f}s, releasing it for another attempt")
+            queue.release(job.id, worker_id)
+            job.lease_lost.set()
+            break
+        if not queue.renew(job.id, worker_id):
+            print(f"⚠️  Worker {worker_id} lost the lease on job {job.id}")
+            job.lease_lost.set()
+            return
+    else:
+        return  # the job finished
+
+    # A job that is merely slow stops at its next progress report. One that is stuck
+    # (a call that never returns) would hold this worker forever, so exit and let
+    # the supervisor start a fresh process.
+    if not stop.wait(queue.lease):
+        print(f"❌ Job {job.id} is stuck, restarting worker {worker_id}")
+        os._exit(1)
+
+
+def run_worker(stop: Optional[threading.Event] = None) -> None:
+    """Claim and run jobs until `stop` is set (or forever)."""
+    queue = JobQueue()
+    worker_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+    stop = stop or threading.Event()
+    print(f"👷 Worker {worker_id} started")
+
+    while not stop.is_set():
+        claimed = queue.claim(worker_id)
+        if claimed is None:
+            stop.wait(LESSON_QUEUE_POLL)
+            continue
+
+        job_id, args = claimed
+        print(f"👷 Worker {worker_id} running job {job_id}")
+        job = QueueJobHandle(queue, job_id)
+        lease_done = threading.Event()
+        threading.Thread(target=_keep_lease, args=(queue, job, worker_id, lease_done), daemon=True).start()
+        try:
+            result = build_lesson(job, *args)
+            queue.complete(job_id, worker_id, result)
+        except LeaseLostError as e:
+            print(f"⚠️  Abandoning lesson job {job_id}: {e}")
+        except Exception as e:
+            print(f"❌ Lesson job {job_id} failed: {e}")
+            queue.fail(job_id, worker_id, str(e))
+        finally:
+            lease_done.set()
+
+
+def _worker_process() -> None:
+    # SIGTERM from the supervisor lets the current job finish, then the worker exits
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # the supervisor handles Ctrl+C
+    run_worker(stop)
+
+
+def supervise(processes: int = LESSON_WORKER_PROCESSES) -> None:
+    """Keep `processes` workers running until SIGINT/SIGTERM, restarting any that exit."""
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stopping.set())
+    signal.signal(signal.SIGINT, lambda *_: stopping.set())
+
+    workers = {}
+    print(f"🚂 Starting {processes} lesson worker process(es)")
+    while not stopping.is_set():
+        for slot in range(processes):
+            worker = workers.get(slot)
+            if worker is None or not worker.is_alive():
+                if worker is not None:
+                    print(f"⚠️  Worker process {worker.pid} exited with {worker.exitcode}, restarting")
+                workers[slot] = multiprocessing.Process(target=_worker_process, name=f"lesson-worker-{slot}")
+                workers[slot].start()
+        stopping.wait(1.0)
+
+    print("🛑 Stopping lesson workers")
+    for worker in workers.values():
+        worker.terminate()
+    for worker in workers.values():
+        worker.join()
+
+
+if __name__ == "__main__":
+    supervise(int(sys.argv[1]) if len(sys.argv) > 1 else LESSON_WORKER_PROCESSES)
@@ -21,8 +21,11 @@ const TeacherDashboard = () => {
     const navigate = useNavigate();
     const [isCreatingLesson, setIsCreatingLesson] = useState(false);
     const [isWaitingOnLessonCreation, setIsWaitingOnLessonCreation] = useState(false);
+    // Steps and images of the lesson being generated, shown as they arrive
+    const [lessonPreview, setLessonPreview] = useState(null);
     // ... (All your existing state and handler functions remain unchanged)
     const [lessons, setLessons] = useState(null);
+    const [nextCursor, setNextCursor] = useState(null);
     
     const [selectedLesson, setSelectedLesson] = useState(null);
     const [currentStepIndex, setCurrentStepIndex] = useState(0);
@@ -48,13 +51,22 @@ const TeacherDashboard = () => {
         }
     };
 
+    // /getLessons is paginated; pass the previous page's next_cursor to get the next one
+    const fetchLessons = (cursor = null) => {
+        const query = cursor ? `?cursor=${encodeURIComponent(cursor)}` : '';
+        fetch(`http://localhost:5000/getLessons${query}`) // Adjust the URL as needed
+            .then(response => response.json())
+            .then(data => {
+                setLessons(prevLessons => cursor ? [...prevLessons, ...data.lessons] : data.lessons);
+                setNextCursor(data.next_cursor);
+            })
+            .catch(error => console.error('Error fetching lessons:', error));
+    };
+
     useEffect(() => {
         if (lessons !== null) return;
         // Fetch lessons from the backend API
-        fetch('http://localhost:5000/getLessons') // Adjust the URL as needed
-            .then(response => response.json())
-            .then(data => setLessons(data.lessons))
-            .catch(error => console.error('Error fetching lessons:', error));
+        fetchLessons();
     }, []);
 
     let content;
@@ -70,7 +82,11 @@ const TeacherDashboard = () => {
                 <div className="step-navigation">
                     <button className="nav-arrow prev" onClick={handlePreviousStep} disabled={currentStepIndex === 0}>◄</button>
                     <div className="lessonStepItem">
-                        {currentStep.image_path && <img className="stepImage" src={currentStep.image_path} alt={`Visual for ${currentStep.step_description}`} />}
+                        {currentStep.image_path && (
+                            <a href={currentStep.full_image_path || currentStep.image_path} target="_blank" rel="noreferrer">
+                                <img className="stepImage" src={currentStep.image_path} alt={`Visual for ${currentStep.step_description}`} />
+                            </a>
+                        )}
                         <p className="stepText">{currentStep.step_description}</p>
                     </div>
                     <button className="nav-arrow next" onClick={handleNextStep} disabled={currentStepIndex === totalSteps - 1}>►</button>
@@ -99,6 +115,14 @@ const TeacherDashboard = () => {
                         </div>
                     ))}
                 </div>
+
+                {nextCursor && (
+                    <div className="createButton-container">
+                        <button className="login-button" onClick={() => fetchLessons(nextCursor)}>
+                            <span>Load More Lessons</span>
+                        </button>
+                    </div>
+                )}
         
                 {!isCreatingLesson && (
                     <div className="createButton-container">
@@ -110,7 +134,7 @@ const TeacherDashboard = () => {
                 )}
 
                 {isCreatingLesson && (
-                    <form className="createLessonForm" onSubmit={(e) => handleCreateLessonSubmissionButton(e, setLessons, setIsCreatingLesson, setIsWaitingOnLessonCreation)}>
+                    <form className="createLessonForm" onSubmit={(e) => handleCreateLessonSubmissionButton(e, setLessons, setIsCreatingLesson, setIsWaitingOnLessonCreation, setLessonPreview)}>
                         <div className="welcome-header">
                             <h3>Create a New Lesson</h3>
                             <div className="header-line"></div>
@@ -134,6 +158,18 @@ const TeacherDashboard = () => {
                                 <div className="button-shine"></div>
                             </button>
                         </div>
+                        {lessonPreview && (
+                            <div className="lessonPreview">
+                                {lessonPreview.steps.map((step, index) => (
+                                    <div key={index} className="lessonPreviewStep">
+                                        {lessonPreview.images[index + 1]
+                                            ? <img className="lessonPreviewImage" src={lessonPreview.images[index + 1]} alt={`Visual for ${step}`} />
+                                            : <div className="lessonPreviewImage lessonPreviewImage-pending">Drawing…</div>}
+                                        <p className="stepText">{step}</p>
+                                    </div>
+                                ))}
+                            </div>
+                        )}
                     </form>
                 )}
             </>
@@ -1,4 +1,36 @@
-const handleCreateLessonSubmissionButton = (e, setLessons, setIsCreatingLesson, setIsWaitingOnLessonCreation) => {
+// /createLesson only queues the lesson; follow the job's event stream until it finishes.
+// "steps" and "image" events arrive as soon as each part of the lesson is ready and are
+// handed to onPreview as { steps: [...], images: { [step_number]: url } }.
+const followLessonJob = (jobId, onPreview) =>
+    new Promise((resolve, reject) => {
+        const events = new EventSource(`http://localhost:5000/lessonJobs/${jobId}/events`);
+        let preview = { steps: [], images: {} };
+        events.onmessage = (message) => {
+            const event = JSON.parse(message.data);
+            if (event.type === "steps") {
+                preview = { ...preview, steps: event.steps };
+                onPreview(preview);
+            } else if (event.type === "image") {
+                preview = { ...preview, images: { ...preview.images, [event.step_number]: event.thumbnail_url || event.url } };
+                onPreview(preview);
+            } else if (event.type === "done") {
+                events.close();
+                resolve(event.lesson);
+            } else if (event.type === "error") {
+                events.close();
+                reject(new Error(event.message));
+            }
+        };
+        // A dropped connection is retried by EventSource itself (readyState CONNECTING);
+        // CLOSED means it gave up, e.g. a 404 once the job was pruned or the server restarted
+        events.onerror = () => {
+            if (events.readyState === EventSource.CLOSED) {
+                reject(new Error("Lost track of the lesson job, check your lessons list before trying again"));
+            }
+        };
+    });
+
+const handleCreateLessonSubmissionButton = (e, setLessons, setIsCreatingLesson, setIsWaitingOnLessonCreation, setLessonPreview) => {
     e.preventDefault();
     const title = e.target[0].value;
     const topic = e.target[1].value;
@@ -6,6 +38,7 @@ const handleCreateLessonSubmissionButton = (e, setLessons, setIsCreatingLesson,
     const description = e.target[3].value;
 
     setIsWaitingOnLessonCreation(true);
+    setLessonPreview(null);
 
     fetch(`http://localhost:5000/createLesson`, {
         method: "POST",
@@ -16,20 +49,26 @@ const handleCreateLessonSubmissionButton = (e, setLessons, setIsCreatingLesson,
     })
         .then((res) => res.json())
         .then((data) => {
-            if (data.success) {
-                alert("Lesson created successfully!");
-                console.log(data.lesson);
-                setLessons(prevLessons => [...prevLessons, data.lesson]);
-                setIsCreatingLesson(false);
-            } else {
-                alert(`Failed to create lesson: ${data.message}`);
+            if (!data.success) {
+                throw new Error(data.message);
             }
+            return followLessonJob(data.job_id, setLessonPreview);
+        })
+        .then((lesson) => {
+            alert("Lesson created successfully!");
+            console.log(lesson);
+            setLessons(prevLessons => [...prevLessons, lesson]);
+            setIsCreatingLesson(false);
         })
         .catch((err) => {
             console.error("Error during lesson creation:", err);
-            alert("An error occurred during lesson creation. Please try again.");
+            alert(`Failed to create lesson: ${err.message}`);
             setIsCreatingLesson(false);
+        })
+        .finally(() => {
+            setIsWaitingOnLessonCreation(false);
+            setLessonPreview(null);
         });
 }
 
-export default handleCreateLessonSubmissionButton;
\ No newline at end of file
+export default handleCreateLessonSubmissionButton;